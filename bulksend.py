@@ -0,0 +1,243 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+
+from dotenv import load_dotenv
+from upstash_redis import Redis
+
+from sendmail import open_smtp, send_batch
+
+load_dotenv()
+
+# Bulk mail engine for /emailall/. The recipient list is deduped and split into batches
+# small enough for the provider's per-message recipient limit, and the batches are sent
+# over a small pool of SMTP connections. Job state (per-batch status) is saved after every
+# batch, so a failed mailing can be resumed without re-sending the batches that went out.
+
+BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", 90))  # Gmail allows 100 recipients per message
+POOL_SIZE = int(os.environ.get("BULK_POOL_SIZE", 3))  # parallel SMTP connections
+JOB_EXPIRY = 7 * 24 * 3600  # seconds
+RUN_LOCK_EXPIRY = 30 * 60  # seconds; a crashed run's claim lapses after this
+
+
+class RedisJobStore:
+    def __init__(self, client, prefix="bulksend"):
+        self.client = client
+        self.prefix = prefix
+
+    def save(self, job):
+        self.client.set(f"{self.prefix}:{job['id']}", json.dumps(job), ex=JOB_EXPIRY)
+
+    def load(self, job_id):
+        raw = self.client.get(f"{self.prefix}:{job_id}")
+        if raw is None:
+            return None
+        return json.loads(raw)
+
+    def claim(self, job_id):
+        # SET NX: True for exactly one caller until release() (or the claim expires).
+        key = f"{self.prefix}:{job_id}:running"
+        return bool(self.client.set(key, 1, nx=True, ex=RUN_LOCK_EXPIRY))
+
+    def release(self, job_id):
+        self.client.delete(f"{self.prefix}:{job_id}:running")
+
+
+class MemoryJobStore:
+    def __init__(self):
+        self.jobs = {}
+        self.running = set()
+        self.lock = threading.Lock()
+
+    def save(self, job):
+        self.jobs[job["id"]] = json.dumps(job)
+
+    def load(self, job_id):
+        raw = self.jobs.get(job_id)
+        if raw is None:
+            return None
+        return json.loads(raw)
+
+    def claim(self, job_id):
+        with self.lock:
+            if job_id in self.running:
+                return False
+            self.running.add(job_id)
+            return True
+
+    def release(self, job_id):
+        with self.lock:
+            self.running.discard(job_id)
+
+
+def make_store(prefix="bulksend"):
+    if os.environ.get("OUTBOX_BACKEND") == "memory":
+        return MemoryJobStore()
+    return RedisJobStore(
+        Redis(url=os.environ.get("REDIS_URL"), token=os.environ.get("REDIS_TOKEN")),
+        prefix,
+    )
+
+
+store = make_store()
+
+
+def dedupe_emails(emails):
+    # Case-insensitive, order-preserving; drops blanks.
+    seen = set()
+    result = []
+    for e in emails:
+        if not isinstance(e, str):
+            continue
+        e = e.strip()
+        if len(e) == 0 or e.lower() in seen:
+            continue
+        seen.add(e.lower())
+        result.append(e)
+    return result
+
+
+def chunk(items, size):
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def job_summary(job):
+    counts = {"pending": 0, "sent": 0, "failed": 0}
+    failures = []
+    for i, b in enumerate(job["batches"]):
+        counts[b["status"]] += 1
+        if b["status"] == "failed":
+            failures.append(
+                {
+                    "batch": i,
+                    "size": len(b["recipients"]),
+                    "refused": b.get("refused"),
+                    "error": b["error"],
+                }
+            )
+    return {
+        "job_id": job["id"],
+        "state": job["state"],
+        "recipients": sum(len(b["recipients"]) for b in job["batches"]),
+        "batches": len(job["batches"]),
+        "sent": counts["sent"],
+        "failed": counts["failed"],
+        "pending": counts["pending"],
+        "failures": failures,
+    }
+
+
+def create_bulk_job(emails, subject, body, batch_size=None):
+    recipients = dedupe_emails(emails)
+    job = {
+        "id": str(uuid.uuid4()),
+        "subject": subject,
+        "body": body,
+        "state": "queued",
+        "created": time.time(),
+        "batches": [
+            {"recipients": b, "status": "pending", "error": None}
+            for b in chunk(recipients, batch_size or BATCH_SIZE)
+        ],
+    }
+    store.save(job)
+    return job
+
+
+def _send_worker(job, todo, lock, connect, sender):
+    smtp = None
+    try:
+        while True:
+            try:
+                i = todo.get_nowait()
+            except Empty:
+                return
+            batch = job["batches"][i]
+            # A batch the server partly refused is retried for the refused addresses only.
+            recipients = batch.get("refused") or batch["recipients"]
+            refused = None
+            try:
+                if smtp is None:
+                    smtp = connect()
+                refused = sender(smtp, recipients, job["subject"], job["body"]) or None
+                if refused:
+                    refused = sorted(refused)
+                    status = "failed"
+                    error = f"{len(refused)} of {len(recipients)} recipients refused"
+                else:
+                    status, error = "sent", None
+            except Exception as e:
+                # Drop the connection; the next batch gets a fresh one.
+                status, error = "failed", str(e)
+                refused = batch.get("refused")
+                if smtp is not None:
+                    try:
+                        smtp.close()
+                    except Exception:
+                        pass
+                    smtp = None
+            with lock:
+                batch["status"] = status
+                batch["error"] = error
+                batch["refused"] = refused
+                store.save(job)
+    finally:
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except Exception:
+                pass
+
+
+def claim_bulk_job(job_id):
+    # Marks the job as running; False if another run holds it. A claimed job must be
+    # passed to run_bulk_job(job_id, claimed=True), which releases it.
+    return store.claim(job_id)
+
+
+def run_bulk_job(job_id, connect=open_smtp, sender=send_batch, claimed=False):
+    # Sends every batch that has not gone out yet, so calling it again on a finished or
+    # partially failed job resumes it. Only one run of a job can be in progress.
+    if not claimed and not store.claim(job_id):
+        return {"status": -28, "error_message": "This job is already running"}
+    try:
+        job = store.load(job_id)
+        if job is None:
+            return {"status": -1, "error_message": "No bulk mail job found"}
+        todo = Queue()
+        for i, b in enumerate(job["batches"]):
+            if b["status"] != "sent":
+                b["status"] = "pending"
+                b["error"] = None
+                todo.put(i)
+        job["state"] = "running"
+        store.save(job)
+
+        lock = threading.Lock()
+        workers = max(1, min(POOL_SIZE, todo.qsize()))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_send_worker, job, todo, lock, connect, sender)
+                for _ in range(workers)
+            ]
+            for f in futures:
+                f.result()
+
+        summary = job_summary(job)
+        job["state"] = "partial" if summary["failed"] > 0 else "done"
+        store.save(job)
+        summary["state"] = job["state"]
+        return {"status": 0, **summary}
+    finally:
+        store.release(job_id)
+
+
+def get_bulk_job(job_id):
+    job = store.load(job_id)
+    if job is None:
+        return {"status": -1, "error_message": "No bulk mail job found"}
+    return {"status": 0, **job_summary(job)}
@@ -0,0 +1,123 @@
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+
+from dotenv import load_dotenv
+from upstash_redis import Redis
+
+from outbox import enqueue_mail
+
+load_dotenv()
+
+redis = Redis(url=os.environ.get("REDIS_URL"), token=os.environ.get("REDIS_TOKEN"))
+
+# Admin notifications (new signups, club registrations, mentor logs) are collected here
+# and mailed to the admin inbox as one digest every DIGEST_MAX_EVENTS events or every
+# DIGEST_INTERVAL seconds, whichever comes first. Recording an event is one Redis push,
+# so the request path never waits on SMTP. /flushdigest/ (cron) sends whatever is left
+# during quiet periods.
+
+ADMIN_EMAIL = "crlspathfinders25@gmail.com"
+DIGEST_KEY = "digest:admin"
+DIGEST_SINCE = "digest:admin:since"  # time the oldest pending event was recorded
+DIGEST_FLUSHING = "digest:admin:flushing"  # sorted set of lists being mailed (score = start)
+
+DIGEST_MAX_EVENTS = int(os.environ.get("DIGEST_MAX_EVENTS", 25))
+DIGEST_INTERVAL = int(os.environ.get("DIGEST_INTERVAL", 3600))  # seconds
+FLUSH_TIMEOUT = 10 * 60  # seconds before a flush that never finished is retried
+
+# Moves the pending list aside and clears its since marker in one step, so an event
+# recorded meanwhile always starts a new list with its own marker.
+TAKE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('DEL', KEYS[3])
+redis.call('ZADD', KEYS[4], ARGV[1], KEYS[2])
+return 1
+"""
+
+# Takes over a flushing list whose flush started before ARGV[2] (i.e. crashed).
+RECLAIM_SCRIPT = """
+local started = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if started and tonumber(started) <= tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+
+def record_admin_event(kind, text):
+    try:
+        event = {"kind": kind, "text": text, "at": time.time()}
+        count = redis.rpush(DIGEST_KEY, json.dumps(event))
+        if count == 1:
+            redis.set(DIGEST_SINCE, event["at"])
+        since = redis.get(DIGEST_SINCE)
+        if count >= DIGEST_MAX_EVENTS or (
+            since is not None and time.time() - float(since) >= DIGEST_INTERVAL
+        ):
+            flush_admin_digest()
+        return {"status": 0}
+    except Exception as e:
+        print(f"Failed to record admin event: {e}")
+        return {"status": -1, "error_message": e}
+
+
+def format_digest(events):
+    by_kind = {}
+    for e in events:
+        by_kind.setdefault(e["kind"], []).append(e)
+    sections = []
+    for kind, items in by_kind.items():
+        lines = [f"{kind} ({len(items)})", "-" * (len(kind) + len(str(len(items))) + 3)]
+        for e in items:
+            stamp = datetime.fromtimestamp(e["at"]).strftime("%Y-%m-%d %H:%M")
+            lines.append(f"[{stamp}] {e['text'].strip()}")
+            lines.append("")
+        sections.append("\n".join(lines))
+    return "\n".join(sections)
+
+
+def send_flushing(flushing):
+    events = [json.loads(raw) for raw in redis.lrange(flushing, 0, -1)]
+    if len(events) > 0:
+        subject = f"CRLS Pathfinders | {len(events)} new notifications"
+        enqueue_mail(ADMIN_EMAIL, subject, format_digest(events))
+    tx = redis.multi()
+    tx.delete(flushing)
+    tx.zrem(DIGEST_FLUSHING, flushing)
+    tx.exec()
+    return len(events)
+
+
+def flush_admin_digest():
+    # The pending list is renamed to a flushing key first, so events recorded while we
+    # build the mail go into the next digest instead of being lost or sent twice. A
+    # flush that crashed before finishing is picked up again by a later one.
+    try:
+        now = time.time()
+        events = 0
+        for leftover in redis.zrange(
+            DIGEST_FLUSHING, 0, now - FLUSH_TIMEOUT, sortby="BYSCORE"
+        ):
+            if redis.eval(
+                RECLAIM_SCRIPT,
+                keys=[DIGEST_FLUSHING],
+                args=[leftover, now - FLUSH_TIMEOUT, now],
+            ):
+                events += send_flushing(leftover)
+        flushing = f"{DIGEST_KEY}:flushing:{uuid.uuid4()}"
+        taken = redis.eval(
+            TAKE_SCRIPT,
+            keys=[DIGEST_KEY, flushing, DIGEST_SINCE, DIGEST_FLUSHING],
+            args=[now],
+        )
+        if taken:
+            events += send_flushing(flushing)
+        return {"status": 0, "events": events}
+    except Exception as e:
+        print(f"Failed to flush admin digest: {e}")
+        return {"status": -1, "error_message": e}
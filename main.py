@@ -1,11 +1,12 @@
-from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, status
+from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, status, BackgroundTasks
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 import secrets
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 import os, sys, io
 import json, tempfile, mimetypes
 from fastapi.responses import StreamingResponse
-from typing import List, Annotated
+from typing import List, Optional, Annotated
 from datetime import timedelta
 from pydantic import BaseModel
 from models.model import (
@@ -14,12 +15,20 @@ from models.model import (
     get_sub_collection,
     remove_id,
     get_collection_python,
+    begin_unit_of_work,
+    end_unit_of_work,
 )
 from routers import user, club, mentor, opportunity, allinfo, libraryinfo, alumni
 from requests_cache import CachedSession
 from dotenv import load_dotenv
 from sendmail import send_mail
+from outbox import drain_outbox, queue as outbox_queue
+from bulksend import create_bulk_job, claim_bulk_job, run_bulk_job, get_bulk_job
+from digest import flush_admin_digest
 from upstash_redis import Redis
+from models.audiencemodel import get_audience, rebuild_audiences
+from models.uploadmodel import sweep_images, MAX_UPLOAD_BODY_BYTES
+from models.cascademodel import get_cascade_job, claim_cascade_job, run_cascade_job
 from models.redismodel import (
     get_redis_collection,
     add_redis_collection,
@@ -45,7 +54,15 @@ redis = Redis(url=os.environ.get("REDIS_URL"), token=os.environ.get("REDIS_TOKEN
 
 # Create virtual environment: python3 -m venv venv
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Clients are created on first use; where the host runs the lifespan, they are
+    # closed on shutdown.
+    yield
+    await libraryinfo.close_client()
+
+
+app = FastAPI(lifespan=lifespan)
 
 security = HTTPBasic()
 
@@ -81,6 +98,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+# Image upload routes and the status each returns for an image that is too large.
+UPLOAD_ROUTES = {"/uploadclubimage/": -22.2, "/uploadmentorimage/": -5.2}
+
+
+@app.middleware("http")
+async def limit_upload_size(request, call_next):
+    # FastAPI reads (and spools) the whole multipart body before the route runs, so the
+    # size cap has to be checked here, from Content-Length, before anything is read.
+    # The server stops a body from running past its declared length.
+    status = UPLOAD_ROUTES.get(request.url.path)
+    if request.method == "POST" and status is not None:
+        length = request.headers.get("content-length")
+        if length is None or not length.isdigit():
+            return JSONResponse(
+                {"status": status, "error_message": "Content-Length required"},
+                status_code=411,
+            )
+        if int(length) > MAX_UPLOAD_BODY_BYTES:
+            return JSONResponse(
+                {"status": status, "error_message": "Image is too large"},
+                status_code=413,
+            )
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def unit_of_work(request, call_next):
+    # Memoize get_el_id / get_doc lookups for the length of one request (see models/model.py).
+    token = begin_unit_of_work()
+    try:
+        return await call_next(request)
+    finally:
+        end_unit_of_work(token)
+
+
 app.include_router(user.router)
 app.include_router(club.router)
 app.include_router(mentor.router)
@@ -270,37 +323,115 @@ class SendMassEmail(BaseModel):
     subject: str
     body: str
     recipients: List[str]
+    grade: Optional[str] = None  # only for Users: Senior, Junior, Sophomore, Freshman, Teacher
 
 
 @app.post("/emailall/")
 def email_all(
-    email: SendMassEmail, username: Annotated[str, Depends(get_current_username)]
+    email: SendMassEmail,
+    background_tasks: BackgroundTasks,
+    username: Annotated[str, Depends(get_current_username)],
 ):
-    sendees = get_collection_python(email.collection)
-    emails = []
     if email.collection == "Rehaan":
         print("rehaan found")
         send_mail("25ranjaria@cpsd.us", email.subject, email.body)
         return {"status": 0}
-    if email.collection == "Clubs":
-        for s in sendees:
-            emails.append(s["president_email"])
-            if len(s["vice_presidents_emails"]) > 0:
-                for v in s["vice_presidents_emails"]:
-                    emails.append(v)
-        try:
-            send_mail(emails, email.subject, email.body)
-            return {"status": 0}
-        except Exception as e:
-            return {"status": -1, "error_message": e}
-    else:
-        for s in sendees:
-            emails.append(s["email"])
-        try:
-            send_mail(emails, email.subject, email.body)
-            return {"status": 0}
-        except Exception as e:
-            return {"status": -1, "error_message": e}
+    try:
+        # Maintained Redis recipient sets (Clubs = every president and vice president),
+        # so no Firestore read is needed here.
+        audience = get_audience(email.collection, email.grade)
+        if audience["status"] != 0:
+            return audience
+        emails = audience["emails"]
+        # Deduped and split into batches; sent after the response by run_bulk_job.
+        job = create_bulk_job(emails, email.subject, email.body)
+        background_tasks.add_task(run_bulk_job, job["id"])
+        return {
+            "status": 0,
+            "job_id": job["id"],
+            "batches": len(job["batches"]),
+            "recipients": sum(len(b["recipients"]) for b in job["batches"]),
+        }
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+@app.get("/emailall/{job_id}")
+def email_all_progress(
+    job_id: str, username: Annotated[str, Depends(get_current_username)]
+):
+    try:
+        return get_bulk_job(job_id)
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+# Re-sends only the batches of a mass email that failed or never went out.
+@app.post("/emailall/{job_id}/resume")
+def email_all_resume(
+    job_id: str,
+    background_tasks: BackgroundTasks,
+    username: Annotated[str, Depends(get_current_username)],
+):
+    try:
+        job = get_bulk_job(job_id)
+        if job["status"] != 0:
+            return job
+        # Claimed here, so a second resume of a job still sending is refused instead of
+        # sending its in-flight batches again.
+        if not claim_bulk_job(job_id):
+            return {"status": -28, "error_message": "This job is already running"}
+        background_tasks.add_task(run_bulk_job, job_id, claimed=True)
+        return {"status": 0, "job_id": job_id, "pending": job["pending"] + job["failed"]}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+# Progress of the background cleanup started by /deleteclub/, /deleteuser/ and
+# /deletementor/.
+@app.get("/cascade/{job_id}")
+def cascade_progress(
+    job_id: str, username: Annotated[str, Depends(get_current_username)]
+):
+    try:
+        return get_cascade_job(job_id)
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+# Re-runs the unfinished steps of a cleanup job.
+@app.post("/cascade/{job_id}/resume")
+def cascade_resume(
+    job_id: str,
+    background_tasks: BackgroundTasks,
+    username: Annotated[str, Depends(get_current_username)],
+):
+    try:
+        job = get_cascade_job(job_id)
+        if job["status"] != 0:
+            return job
+        # Claimed here, so resuming a job whose steps are still running is refused.
+        if not claim_cascade_job(job_id):
+            return {"status": -28, "error_message": "This job is already running"}
+        background_tasks.add_task(run_cascade_job, job_id, claimed=True)
+        return {"status": 0, "job_id": job_id}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+# Rebuilds the mass email recipient sets from Firestore (e.g. after Redis was flushed).
+@app.get("/rebuildaudiences/")
+def rebuild_audiences_route(username: Annotated[str, Depends(get_current_username)]):
+    return rebuild_audiences()
+
+
+# Garbage-collects club / mentor images no document references. Dry run unless
+# dry_run=false is passed.
+@app.get("/sweepimages/")
+def sweep_images_route(
+    username: Annotated[str, Depends(get_current_username)], dry_run: bool = True
+):
+    return sweep_images(dry_run=dry_run)
 
 
 @app.get("/emailone/{subject}/{body}/{receiver}")
@@ -316,3 +447,36 @@ def email_one(
         return {"status": 0}
     except Exception as e:
         return {"status": -1, "error_message": e}
+
+
+# Outbox worker. Handlers queue their mail and drain it in a background task; this route
+# lets a cron job pick up retries and anything a crashed instance left behind.
+@app.get("/drainoutbox/")
+def drain_outbox_route(
+    username: Annotated[str, Depends(get_current_username)], recover: bool = False
+):
+    try:
+        if recover:
+            outbox_queue.recover()
+        return drain_outbox(max_messages=200)
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+# Sends the pending admin digest now; run from cron so quiet periods still get mailed.
+@app.get("/flushdigest/")
+def flush_digest_route(
+    background_tasks: BackgroundTasks,
+    username: Annotated[str, Depends(get_current_username)],
+):
+    result = flush_admin_digest()
+    background_tasks.add_task(drain_outbox)
+    return result
+
+
+@app.get("/outbox/")
+def outbox_stats(username: Annotated[str, Depends(get_current_username)]):
+    try:
+        return {"status": 0, "stats": outbox_queue.stats(), "dead": outbox_queue.dead()}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
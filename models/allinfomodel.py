@@ -1,63 +1,126 @@
+import json
+
+from google.api_core import exceptions
+from google.cloud.firestore_v1.field_path import FieldPath
+
 from .model import (
     db,
-    get_collection_python,
+    forget,
 )
+from .redismodel import redis
+from .mapmodel import invalidate_map
 
+# Redis index of the schools in AllInfo/universities (see models/alumnimodel.py).
+SCHOOLS = "alumni:schools"
+SCHOOLS_READY = "alumni:schools:ready"
+SCHOOLS_WRITTEN = "alumni:schools:written"  # keys whose name, coords etc. are stored
+CACHE_VERSIONS = "AllInfo:versions"  # doc -> update time (us) of its cached entry
 
-def update_all_info_collection(doc, vals):  # vals is a dict
+# Replaces one cached AllInfo entry, but only while the AllInfo hash is cached (a lone
+# entry would pass for the whole collection) and only with a newer version than the
+# one cached, so concurrent updates cannot put an older copy back.
+REPLACE_CACHED_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local cached = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '0')
+if tonumber(ARGV[3]) <= cached then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+return 1
+"""
+
+
+def all_info_ref(doc):
+    return db.collection("AllInfo").document(doc)
+
+
+def field_path(*parts):
+    # Firestore field path for nested keys, quoting names with spaces etc.:
+    # field_path("universities", "Harvard University") -> "universities.`Harvard University`"
+    return FieldPath(*parts).to_api_repr()
+
+
+def invalidate_universities():
+    # Call after AllInfo/universities is rewritten: schools may have been renamed,
+    # moved or removed, so the map and the school index are rebuilt on next use.
+    invalidate_map()
+    redis.delete(SCHOOLS_READY)
+
+
+def refresh_all_info_cache(doc):
+    # Call after writing an AllInfo document: caches the stored version of it.
+    try:
+        snap = all_info_ref(doc).get()
+        if not snap.exists:
+            return
+        data = snap.to_dict()
+        data["id"] = doc
+        version = round(snap.update_time.timestamp() * 1_000_000)
+        redis.eval(
+            REPLACE_CACHED_SCRIPT,
+            keys=["AllInfo", CACHE_VERSIONS],
+            args=[doc, json.dumps(data), version],
+        )
+    except Exception as e:
+        print(f"Failed to refresh AllInfo cache: {e}")
+
+
+def update_all_info_fields(doc, updates, last_update_time=None):
+    # updates maps field paths ("a.b.c", see field_path) to new values and is applied
+    # in one update(). If last_update_time is given, the update only goes through when
+    # the document has not changed since then (status -14 otherwise).
     try:
-        all_all_info = get_collection_python("AllInfo")
-        all_info_keys = []
-        target = None
-        for a in all_all_info:
-            if a["id"] == doc:
-                # print(a)
-                curr_keys = list(a.keys())
-                # print(curr_keys)
-                curr_keys.pop()
-                all_info_keys = curr_keys
-                # print(all_info_keys)
-                target = a
-                # print(target)
-        try:
-            # print(f"old: {target[all_info_keys[0]]}")
-            # print(f"new: {vals}")
-            # print(f"changed key: {find_changed_key(target[all_info_keys[0]], vals)}")
-            changed_key = find_changed_key(target[all_info_keys[0]], vals)
-            changed_key_loc = list(vals.keys()).index(changed_key)
-        except Exception as e:
-            # print(f"not a dict: {e}")
-            changed_key_loc = 0
-        if target is not None:
-            for t in target:
-                print(t)
-                if t in list(vals.keys()):  # vals.keys() will only ever have one key
-                    # print(f"keys: {list(vals.keys())}") # keys
-                    # # print(vals[list(vals.keys())[0]]) # new info
-                    # print(vals[list(vals.keys())[changed_key_loc]])
-                    # print(all_all_info[all_all_info.index(target)]) # correct location inside all info
-                    # print(f"at location {list(vals.keys())[changed_key_loc]}") # necessary key to change
-                    # print(type(all_all_info[all_all_info.index(target)]))
-                    try:
-                        all_all_info[all_all_info.index(target)][all_info_keys[0]][list(vals.keys())[changed_key_loc]] = (
-                            vals[list(vals.keys())[changed_key_loc]]
-                        )
-                        print("works")
-                    except Exception as e:
-                        print(f"doesn't work: {e}")
-                        all_all_info[all_all_info.index(target)][list(vals.keys())[0]] = (
-                            vals[list(vals.keys())[0]]
-                        )
-                        # print("now works")
-                    final = all_all_info[all_all_info.index(target)]
-                    print(f"final: {final}")
-                    for k in all_info_keys:
-                        db.collection("AllInfo").document(doc).update({k: final[k]})
-            return {"status": 0}
+        if last_update_time is not None:
+            option = db.write_option(last_update_time=last_update_time)
+            result = all_info_ref(doc).update(updates, option=option)
+        else:
+            result = all_info_ref(doc).update(updates)
+        forget("AllInfo", doc)
+        refresh_all_info_cache(doc)
+        if doc == "universities":
+            invalidate_universities()  # coords, names or counts may have changed
+        return {"status": 0, "update_time": result.update_time}
+    except exceptions.NotFound:
         return {"status": -13, "error_message": "No target found"}
+    except exceptions.FailedPrecondition:
+        return {
+            "status": -14,
+            "error_message": "The document changed since it was read",
+        }
     except Exception as e:
         return {"status": -1, "error_message": e}
-    
+
+
+def update_all_info_collection(doc, vals):  # vals is a dict
+    # Finds which value of the document's first map vals changes (or else the top-level
+    # key it sets) and writes only that field, guarded by the read's update time.
+    try:
+        snapshot = all_info_ref(doc).get()
+        if not snapshot.exists:
+            return {"status": -13, "error_message": "No target found"}
+        target = snapshot.to_dict()
+        all_info_keys = list(target.keys())
+        if len(vals) == 0 or not any(k in vals for k in all_info_keys):
+            return {"status": 0}  # nothing in vals belongs to this document
+        first = all_info_keys[0]
+        changed_key = None
+        if isinstance(target[first], dict):
+            changed_key = find_changed_key(target[first], vals)
+        key = changed_key if changed_key else list(vals.keys())[0]
+        if isinstance(target[first], dict):
+            path = field_path(first, key)
+        else:
+            path = field_path(key)
+        return update_all_info_fields(
+            doc, {path: vals[key]}, last_update_time=snapshot.update_time
+        )
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
 def find_changed_key(old_dict, new_dict):
     changed_keys = []
 
@@ -75,17 +138,17 @@ def add_document_to_all_info_collection(doc):
         first_part = db.collection("AllInfo").document(doc["id"])
         del doc["id"]
         first_part.set(doc)
+        forget("AllInfo")
+        if first_part.id == "universities":
+            invalidate_universities()
         return {"status": 0}
     except Exception as e:
         print(e)
         return {"status": -1, "error_message": e}
     
 def update_doc(doc, update):
-    try:
-        all_all_info = get_collection_python("AllInfo")
-        for a in all_all_info:
-            if a["id"] == doc:
-                # print(a)
-                db.collection("AllInfo").document(doc).update(update)
-    except Exception as e:
-        print(f"Failed miserably: {e}")
\ No newline at end of file
+    # update may use field paths, e.g. {field_path(uni_id, "amount_in"): 3}.
+    result = update_all_info_fields(doc, update)
+    if result["status"] != 0:
+        print(f"Failed miserably: {result['error_message']}")
+    return result
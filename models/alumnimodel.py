@@ -1,15 +1,121 @@
+import random
+import re
+import string
+
+from firebase_admin import firestore
+
 from .model import (
     db,
     get_collection_python,
+    get_doc,
 )
+from .allinfomodel import (
+    SCHOOLS,
+    SCHOOLS_READY,
+    SCHOOLS_WRITTEN,
+    field_path,
+    refresh_all_info_cache,
+)
+from .alumnistatsmodel import count_alum, cache_alum, ensure_alumni_counted
+from .mapmodel import map_school, map_alum, invalidate_map
+from .redismodel import redis
+
+# AllInfo/universities maps a random key to each school ({name, loc, amount_in, coords,
+# logo}). alumni:schools is a Redis hash from the normalized school name to that key,
+# so adding an alum finds their school without reading the universities document.
+# A key stays out of alumni:schools:written until a batch holding its name, coords and
+# logo has committed; until then every alum of that school writes them, so a claim whose
+# batch failed never leaves a school entry with only a counter.
+
+
+def generate_rand_id(length=20):
+    chars = string.ascii_letters
+    return "".join(random.choices(chars, k=length))
+
+
+def normalize_school(name):
+    # "  Harvard  University" / "harvard university" -> "harvard university"
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", str(name).lower()).split())
+
+
+def rebuild_school_index():
+    try:
+        universities = get_doc("AllInfo", "universities") or {}
+        tx = redis.multi()
+        tx.delete(SCHOOLS, SCHOOLS_WRITTEN)
+        for key, uni in universities.items():
+            if isinstance(uni, dict) and "name" in uni:
+                tx.hsetnx(SCHOOLS, normalize_school(uni["name"]), key)
+                tx.sadd(SCHOOLS_WRITTEN, key)
+        tx.set(SCHOOLS_READY, 1)
+        tx.exec()
+        return {"status": 0}
+    except Exception as e:
+        print(f"Failed to rebuild school index: {e}")
+        return {"status": -1, "error_message": e}
+
+
+def claim_school_key(fullschool):
+    # Returns (key, is_new). A new school's key is claimed with HSETNX, so two alumni of
+    # the same new school added at once still share one entry.
+    if not redis.exists(SCHOOLS_READY):
+        rebuilt = rebuild_school_index()
+        if rebuilt["status"] != 0:
+            raise Exception(rebuilt["error_message"])
+    name = normalize_school(fullschool)
+    key = redis.hget(SCHOOLS, name)
+    if key is not None:
+        return key, False
+    key = generate_rand_id()
+    if redis.hsetnx(SCHOOLS, name, key):
+        return key, True
+    return redis.hget(SCHOOLS, name), False
+
 
 def make_alumni(alumni):
-    # alumni is a dict (so the schema can be changed at any time)
+    # alumni is a dict (so the schema can be changed at any time). The alum, their
+    # school's amount_in counter and the alumni stats are written in one batch; the
+    # counters use Increment, so concurrent or bulk imports never lose counts.
     try:
-        _, second = db.collection("AlumniNetwork").add(alumni)
-        # print(second)
-        new_doc_id = second.id
-        # print(new_doc_id)
-        return {"status": 0, "id": new_doc_id}
+        ensure_alumni_counted()
+        key, is_new = claim_school_key(alumni["fullschool"])
+        write_school = is_new or not redis.sismember(SCHOOLS_WRITTEN, key)
+        updates = {field_path(key, "amount_in"): firestore.Increment(1)}
+        if write_school:
+            # Field by field (not the whole map) so it cannot overwrite a concurrent
+            # Increment of the same school.
+            for field, value in [
+                ("name", alumni["fullschool"]),
+                ("loc", alumni.get("loc")),
+                ("coords", alumni.get("coords")),
+                ("logo", alumni.get("logo")),
+            ]:
+                updates[field_path(key, field)] = value
+        alum_ref = db.collection("AlumniNetwork").document()
+        batch = db.batch()
+        batch.set(alum_ref, alumni)
+        batch.update(db.collection("AllInfo").document("universities"), updates)
+        count_alum(batch, alumni)
+        batch.commit()
+        if write_school:
+            redis.sadd(SCHOOLS_WRITTEN, key)
+        refresh_all_info_cache("universities")
+        cache_alum(alumni)
+        if write_school and not is_new:
+            invalidate_map()  # the school's count is not known here
+        elif is_new:
+            map_school(
+                key,
+                {
+                    "name": alumni["fullschool"],
+                    "loc": alumni.get("loc"),
+                    "coords": alumni.get("coords"),
+                    "logo": alumni.get("logo"),
+                    "amount_in": 1,
+                },
+            )
+        else:
+            map_alum(key)
+        return {"status": 0, "id": alum_ref.id, "school_key": key}
     except Exception as e:
-        return {"status": -1, "error_message": e}
\ No newline at end of file
+        return {"status": -1, "error_message": e}
@@ -0,0 +1,128 @@
+from firebase_admin import firestore
+
+from .model import db
+from .redismodel import redis
+
+# Alumni counts by school, major, graduation year and location. The counts live in one
+# Firestore document (AlumniStats/counts: {group: {value: count}}) that make_alumni
+# increments in the same batch as the alum, and are cached in one Redis hash per group
+# (alumni:stats:<group>) that is HINCRBY'd after each add. The document counts every
+# alum only once it has been recounted from AlumniNetwork (it then has backfilled:
+# True); make_alumni checks that before its first increment, so alumni added before
+# the counts existed are never missed.
+
+STATS_GROUPS = ["fullschool", "major", "gradyear", "loc"]
+STATS_READY = "alumni:stats:ready"
+STATS_COUNTED = "alumni:stats:counted"  # AlumniStats/counts has been backfilled
+UNKNOWN = "Unknown"
+MAX_STATS_ROWS = 1000  # largest limit per group
+
+
+def stats_ref():
+    return db.collection("AlumniStats").document("counts")
+
+
+def stats_key(group):
+    return f"alumni:stats:{group}"
+
+
+def stats_value(alumni, group):
+    value = str(alumni.get(group) or "").strip()
+    return value if value else UNKNOWN
+
+
+def ensure_alumni_counted():
+    # Call before count_alum: recounts once if AlumniStats/counts was never backfilled.
+    if redis.exists(STATS_COUNTED):
+        return
+    snapshot = stats_ref().get()
+    if not snapshot.exists or not snapshot.to_dict().get("backfilled"):
+        recount_alumni()
+        redis.delete(STATS_READY)  # the cached tables predate the recount
+    redis.set(STATS_COUNTED, 1)
+
+
+def count_alum(batch, alumni):
+    # Adds the alum to every count table, as part of the batch that creates them.
+    batch.set(
+        stats_ref(),
+        {g: {stats_value(alumni, g): firestore.Increment(1)} for g in STATS_GROUPS},
+        merge=True,
+    )
+
+
+def cache_alum(alumni):
+    # Call after the batch committed. If the cache is not loaded, the next read loads it
+    # (with this alum) from Firestore; if this fails, /alumni/stats/rebuild fixes it.
+    try:
+        if not redis.exists(STATS_READY):
+            return
+        tx = redis.multi()
+        for g in STATS_GROUPS:
+            tx.hincrby(stats_key(g), stats_value(alumni, g), 1)
+        tx.exec()
+    except Exception as e:
+        print(f"Failed to update alumni stats cache: {e}")
+
+
+@firestore.transactional
+def _recount_in_transaction(transaction):
+    # Reading the counts document first locks it: make_alumni batches, which increment
+    # it, wait for this transaction and land on top of the recount instead of being
+    # overwritten by it.
+    stats_ref().get(transaction=transaction)
+    counts = {g: {} for g in STATS_GROUPS}
+    for doc in transaction.get(db.collection("AlumniNetwork").select(STATS_GROUPS)):
+        alumni = doc.to_dict()
+        for g in STATS_GROUPS:
+            value = stats_value(alumni, g)
+            counts[g][value] = counts[g].get(value, 0) + 1
+    transaction.set(stats_ref(), {**counts, "backfilled": True})
+    return counts
+
+
+def recount_alumni():
+    return _recount_in_transaction(db.transaction())
+
+
+def rebuild_alumni_stats(recount=False):
+    # Reloads the Redis tables from AlumniStats/counts; recount=True (or a document
+    # that was never backfilled) first recounts it from AlumniNetwork.
+    try:
+        snapshot = stats_ref().get()
+        if recount or not snapshot.exists or not snapshot.to_dict().get("backfilled"):
+            counts = recount_alumni()
+            redis.set(STATS_COUNTED, 1)
+        else:
+            counts = snapshot.to_dict()
+        tx = redis.multi()
+        tx.delete(*[stats_key(g) for g in STATS_GROUPS])
+        for g in STATS_GROUPS:
+            if counts.get(g):
+                tx.hset(stats_key(g), values=counts[g])
+        tx.set(STATS_READY, 1)
+        tx.exec()
+        return {"status": 0, "alumni": sum(counts.get("gradyear", {}).values())}
+    except Exception as e:
+        print(f"Failed to rebuild alumni stats: {e}")
+        return {"status": -1, "error_message": e}
+
+
+def get_alumni_stats(groups=None, limit=None):
+    # {group: [{"value", "count"}, ...]} largest first, top `limit` per group (all of
+    # them when limit is None; a negative limit would cut from the end).
+    if limit is not None and not 1 <= limit <= MAX_STATS_ROWS:
+        raise ValueError(f"limit must be between 1 and {MAX_STATS_ROWS}")
+    if not redis.exists(STATS_READY):
+        rebuilt = rebuild_alumni_stats()
+        if rebuilt["status"] != 0:
+            raise Exception(rebuilt["error_message"])
+    stats = {}
+    for g in groups or STATS_GROUPS:
+        counts = redis.hgetall(stats_key(g)) or {}
+        rows = sorted(
+            ({"value": v, "count": int(c)} for v, c in counts.items()),
+            key=lambda r: (-r["count"], r["value"]),
+        )
+        stats[g] = rows[:limit] if limit is not None else rows
+    return stats
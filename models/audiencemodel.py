@@ -0,0 +1,147 @@
+from .model import get_collection_python
+from .redismodel import redis
+
+# Recipient sets for mass email, kept in Redis and updated on every user, mentor and club
+# write so /emailall/ never has to read Firestore:
+#   audience:Users            every user email
+#   audience:Mentors          every mentor email
+#   audience:grade:<grade>    users by grade (Senior, Junior, ..., Teacher)
+#   audience:club:<club_id>   president + vice presidents of one club
+#   audience:clubs            ids of the clubs that have a leader set
+# The Clubs audience is the union of the per-club sets, so someone leading two clubs stays
+# in it until both clubs drop them.
+
+GRADES = ["Senior", "Junior", "Sophomore", "Freshman", "Teacher"]
+AUDIENCE_READY = "audience:ready"
+
+
+def add_user_audience(email, grade):
+    try:
+        redis.sadd("audience:Users", email)
+        redis.sadd(f"audience:grade:{grade}", email)
+        return {"status": 0}
+    except Exception as e:
+        print(f"Failed to add user audience: {e}")
+        return {"status": -1, "error_message": e}
+
+
+def remove_user_audience(email):
+    try:
+        redis.srem("audience:Users", email)
+        for g in GRADES:
+            redis.srem(f"audience:grade:{g}", email)
+        return {"status": 0}
+    except Exception as e:
+        print(f"Failed to remove user audience: {e}")
+        return {"status": -1, "error_message": e}
+
+
+def add_mentor_audience(email):
+    try:
+        redis.sadd("audience:Mentors", email)
+        return {"status": 0}
+    except Exception as e:
+        print(f"Failed to add mentor audience: {e}")
+        return {"status": -1, "error_message": e}
+
+
+def remove_mentor_audience(email):
+    try:
+        redis.srem("audience:Mentors", email)
+        return {"status": 0}
+    except Exception as e:
+        print(f"Failed to remove mentor audience: {e}")
+        return {"status": -1, "error_message": e}
+
+
+def club_leaders(president_email, vice_presidents_emails):
+    leaders = [president_email] + list(vice_presidents_emails or [])
+    return [l for l in leaders if isinstance(l, str) and len(l) > 1]
+
+
+def set_club_leaders(club_id, president_email, vice_presidents_emails):
+    try:
+        leaders = club_leaders(president_email, vice_presidents_emails)
+        tx = redis.multi()
+        tx.delete(f"audience:club:{club_id}")
+        if len(leaders) > 0:
+            tx.sadd(f"audience:club:{club_id}", *leaders)
+        tx.sadd("audience:clubs", club_id)
+        tx.exec()
+        return {"status": 0}
+    except Exception as e:
+        print(f"Failed to set club leaders audience: {e}")
+        return {"status": -1, "error_message": e}
+
+
+def remove_club_leaders(club_id):
+    try:
+        tx = redis.multi()
+        tx.delete(f"audience:club:{club_id}")
+        tx.srem("audience:clubs", club_id)
+        tx.exec()
+        return {"status": 0}
+    except Exception as e:
+        print(f"Failed to remove club leaders audience: {e}")
+        return {"status": -1, "error_message": e}
+
+
+def rebuild_audiences():
+    # Full rebuild from Firestore. Only needed once (or after Redis is flushed); after
+    # that the write hooks keep the sets current.
+    try:
+        users = get_collection_python("Users")
+        mentors = get_collection_python("Mentors")
+        clubs = get_collection_python("Clubs")
+        old_clubs = redis.smembers("audience:clubs")
+        tx = redis.multi()
+        tx.delete("audience:Users", "audience:Mentors", "audience:clubs")
+        for g in GRADES:
+            tx.delete(f"audience:grade:{g}")
+        for c in old_clubs:
+            tx.delete(f"audience:club:{c}")
+        for u in users:
+            tx.sadd("audience:Users", u["email"])
+            tx.sadd(f"audience:grade:{u.get('grade', 'Teacher')}", u["email"])
+        for m in mentors:
+            tx.sadd("audience:Mentors", m["email"])
+        for c in clubs:
+            leaders = club_leaders(
+                c.get("president_email"), c.get("vice_presidents_emails")
+            )
+            if len(leaders) > 0:
+                tx.sadd(f"audience:club:{c['id']}", *leaders)
+            tx.sadd("audience:clubs", c["id"])
+        tx.set(AUDIENCE_READY, 1)
+        tx.exec()
+        return {"status": 0}
+    except Exception as e:
+        print(f"Failed to rebuild audiences: {e}")
+        return {"status": -1, "error_message": e}
+
+
+AUDIENCES = ["Users", "Mentors", "Clubs"]
+
+
+def get_audience(collection, grade=None):
+    # collection is "Users", "Mentors" or "Clubs" (club leaders), same as /emailall/.
+    # Anything else is an error rather than an empty audience, so a typo sends to nobody
+    # loudly instead of silently.
+    if collection not in AUDIENCES:
+        return {"status": -1.1, "error_message": f"collection must be one of {AUDIENCES}"}
+    if grade and (collection != "Users" or grade not in GRADES):
+        return {"status": -1.1, "error_message": f"grade must be one of {GRADES}"}
+    if not redis.exists(AUDIENCE_READY):
+        rebuild = rebuild_audiences()
+        if rebuild["status"] != 0:
+            return rebuild
+    if collection == "Clubs":
+        club_ids = redis.smembers("audience:clubs")
+        if len(club_ids) == 0:
+            return {"status": 0, "emails": []}
+        emails = redis.sunion(*[f"audience:club:{c}" for c in club_ids])
+    elif grade:
+        emails = redis.smembers(f"audience:grade:{grade}")
+    else:
+        emails = redis.smembers(f"audience:{collection}")
+    return {"status": 0, "emails": list(emails)}
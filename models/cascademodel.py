@@ -0,0 +1,180 @@
+import json
+import time
+import uuid
+
+from firebase_admin import firestore
+
+from bulksend import make_store
+from .model import db, forget
+from .redismodel import redis, patch_cached
+from .ledgermodel import LEDGER
+from .pairingmodel import PAIRINGS
+
+# Background cleanup of the references a deleted club, user or mentor leaves behind.
+# Each cascade is a few named steps; a step is a query for the documents that still
+# reference the deleted target plus the change that removes the reference. Steps are
+# worked through in chunks of CASCADE_BATCH_SIZE documents, one WriteBatch per chunk.
+# Because a processed document no longer matches its step's query, re-running a step
+# just picks up where it stopped, so a failed or interrupted job can be resumed. Job
+# progress is saved after every chunk (same job store as bulksend, "cascade:<id>"), and
+# like a bulk mail job only one run of a job can be in progress (store.claim).
+
+CASCADE_BATCH_SIZE = 400  # Firestore allows 500 writes per batch
+CACHED_COLLECTIONS = ["Users", "Clubs", "Mentors"]  # mirrored in Redis hashes
+
+store = make_store("cascade")
+
+
+def array_remove_step(collection, field, value):
+    # Removes value from the array field of every document that contains it.
+    return {
+        "collection": collection,
+        "query": lambda: db.collection(collection).where(field, "array_contains", value),
+        "update": {field: firestore.ArrayRemove([value])},
+        "patch": lambda doc: {**doc, field: [v for v in doc.get(field, []) if v != value]},
+    }
+
+
+def unset_mentor_step(email):
+    # The user of a removed mentor is no longer a mentor.
+    return {
+        "collection": "Users",
+        "query": lambda: db.collection("Users")
+        .where("email", "==", email)
+        .where("is_mentor", "==", True),
+        "update": {"is_mentor": False},
+        "patch": lambda doc: {**doc, "is_mentor": False},
+    }
+
+
+def pending_logs_step(email):
+    # Unconfirmed hours logs of a removed mentor can never be confirmed.
+    return {
+        "collection": LEDGER,
+        "query": lambda: db.collection(LEDGER)
+        .where("mentor", "==", email)
+        .where("status", "==", -1),
+        "update": None,  # delete
+        "patch": None,
+    }
+
+
+def cascade_steps(kind, target):
+    if kind == "club":
+        return {"joined_clubs": array_remove_step("Users", "joined_clubs", target)}
+    if kind == "user":
+        return {"club_members": array_remove_step("Clubs", "members", target)}
+    if kind == "mentor":
+        return {
+            "user_is_mentor": unset_mentor_step(target),
+            "pending_logs": pending_logs_step(target),
+        }
+    raise ValueError(f"Unknown cascade kind: {kind}")
+
+
+def create_cascade_job(kind, target):
+    # kind is "club" (target = club id), "user" or "mentor" (target = email).
+    job = {
+        "id": str(uuid.uuid4()),
+        "kind": kind,
+        "target": target,
+        "state": "queued",
+        "created": time.time(),
+        "steps": {
+            name: {"status": "pending", "updated": 0, "error": None}
+            for name in cascade_steps(kind, target)
+        },
+    }
+    store.save(job)
+    return job
+
+
+def apply_chunk(step, snapshots):
+    batch = db.batch()
+    for snap in snapshots:
+        if step["update"] is None:
+            batch.delete(snap.reference)
+        else:
+            batch.update(snap.reference, step["update"])
+    batch.commit()
+    collection = step["collection"]
+    for snap in snapshots:
+        forget(collection, snap.id)
+    if collection == LEDGER:
+        redis.hdel(PAIRINGS, *[snap.id for snap in snapshots])
+    if collection in CACHED_COLLECTIONS:
+        # Patch the cached copies instead of reloading the whole collection.
+        if step["patch"] is None:
+            redis.hdel(collection, *[snap.id for snap in snapshots])
+        else:
+            patch_cached(
+                collection,
+                {
+                    snap.id: json.dumps({**step["patch"](snap.to_dict()), "id": snap.id})
+                    for snap in snapshots
+                },
+            )
+
+
+def claim_cascade_job(job_id):
+    # Marks the job as running; False if another run holds it. A claimed job must be
+    # passed to run_cascade_job(job_id, claimed=True), which releases it.
+    return store.claim(job_id)
+
+
+def run_cascade_job(job_id, claimed=False):
+    # Runs every step that has not finished; calling it again resumes the job.
+    if not claimed and not store.claim(job_id):
+        return {"status": -28, "error_message": "This job is already running"}
+    try:
+        return run_cascade_steps(job_id)
+    finally:
+        store.release(job_id)
+
+
+def run_cascade_steps(job_id):
+    job = store.load(job_id)
+    if job is None:
+        return {"status": -1, "error_message": "No cascade job found"}
+    job["state"] = "running"
+    store.save(job)
+    steps = cascade_steps(job["kind"], job["target"])
+    for name, progress in job["steps"].items():
+        if progress["status"] == "done":
+            continue
+        step = steps[name]
+        try:
+            while True:
+                snapshots = list(step["query"]().limit(CASCADE_BATCH_SIZE).stream())
+                if len(snapshots) == 0:
+                    break
+                apply_chunk(step, snapshots)
+                progress["updated"] += len(snapshots)
+                store.save(job)
+            progress["status"], progress["error"] = "done", None
+        except Exception as e:
+            print(f"Cascade step {name} failed: {e}")
+            progress["status"], progress["error"] = "failed", str(e)
+        store.save(job)
+    failed = any(p["status"] == "failed" for p in job["steps"].values())
+    job["state"] = "partial" if failed else "done"
+    store.save(job)
+    return {"status": 0, **job_summary(job)}
+
+
+def job_summary(job):
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "target": job["target"],
+        "state": job["state"],
+        "updated": sum(p["updated"] for p in job["steps"].values()),
+        "steps": job["steps"],
+    }
+
+
+def get_cascade_job(job_id):
+    job = store.load(job_id)
+    if job is None:
+        return {"status": -1, "error_message": "No cascade job found"}
+    return {"status": 0, **job_summary(job)}
@@ -1,10 +1,23 @@
-from uuid import uuid4
-
 from fastapi import File, UploadFile
+from firebase_admin import firestore
+from starlette.concurrency import run_in_threadpool
 
-from .model import db, get_el_id, get_doc, storage, get_collection_id
+from .model import db, get_el_id, get_doc, get_collection_id, forget
+from .uploadmodel import (
+    process_image_upload,
+    get_bucket,
+    rendition_folder,
+    is_content_addressed,
+    create_signed_upload,
+    finalize_signed_upload,
+    build_stored_renditions,
+)
 from .redismodel import add_redis_collection_id, add_redis_collection
 from .usermodel import change_user_role, join_leave_club, change_is_leader
+from .audiencemodel import set_club_leaders, remove_club_leaders
+from .clubsearchmodel import index_club, unindex_club
+from .schedulemodel import schedule_club, unschedule_club
+from .membershipmodel import remove_club_memberships
 
 
 def get_secret_pass(club_id):
@@ -29,24 +42,26 @@ def make_club(
     standard_img = "https://firebasestorage.googleapis.com/v0/b/crlspathfinders-82886.appspot.com/o/club-images%2Felementor-placeholder-image.webp?alt=media&token=ca920f5c-bcfa-4739-b6bc-12fd70b00c9c"
     print("in make club")
     try:
-        db.collection(collection).add(
-            {
-                "advisor_email": advisor_email,
-                "club_days": club_days,
-                "club_description": club_description,
-                "club_name": club_name,
-                "president_email": president_email,
-                "room_number": room_number,
-                "google_classroom_link": google_classroom_link,
-                "secret_password": secret_password,
-                "start_time": start_time,
-                "status": status,
-                "vice_presidents_emails": vice_presidents_emails,
-                "members": [],
-                "club_img": standard_img,
-                # Need to add img_url
-            }
-        )
+        club = {
+            "advisor_email": advisor_email,
+            "club_days": club_days,
+            "club_description": club_description,
+            "club_name": club_name,
+            "president_email": president_email,
+            "room_number": room_number,
+            "google_classroom_link": google_classroom_link,
+            "secret_password": secret_password,
+            "start_time": start_time,
+            "status": status,
+            "vice_presidents_emails": vice_presidents_emails,
+            "members": [],
+            "club_img": standard_img,
+            # Need to add img_url
+        }
+        result = db.collection(collection).add(club)
+        forget(collection)
+        index_club(result[1].id, club)
+        schedule_club(result[1].id, club)
         print("added to collection")
         # Make the president and vice-presidents have "Leader" role and add club to joined_clubs:
         try:
@@ -54,6 +69,7 @@ def make_club(
             print(f"Changed pres role: {president_email}")
             club_id = get_el_id("Clubs", secret_password)
             print(f"clubid: {club_id}")
+            set_club_leaders(club_id, president_email, vice_presidents_emails)
             print(join_leave_club("join", president_email, club_id))
             print(f"pres joined {club_id}")
             members = get_members(club_id)
@@ -116,6 +132,11 @@ def change_club(
                 "vice_presidents_emails": vice_presidents_emails,
             }
         )
+        forget(collection, doc_id)
+        club = get_doc(collection, doc_id)
+        index_club(doc_id, club)
+        schedule_club(doc_id, club)
+        set_club_leaders(doc_id, president_email, vice_presidents_emails)
         return {"status": "Success"}
     except Exception as e:
         return {"status": f"Failed: {str(e)}"}
@@ -126,6 +147,10 @@ def update_status(secret_password, status):
     doc_id = get_el_id(collection, secret_password)
     try:
         db.collection(collection).document(doc_id).update({"status": status})
+        forget(collection, doc_id)
+        club = get_doc(collection, doc_id)
+        index_club(doc_id, club)
+        schedule_club(doc_id, club)
         return {"status": "Successfully changed status"}
     except Exception as e:
         return {"status": f"Failed to change status: {e}"}
@@ -140,6 +165,7 @@ def manage_members(secret_password, new_members):
     doc_id = get_el_id(collection, secret_password)
     try:
         db.collection(collection).document(doc_id).update({"members": new_members})
+        forget(collection, doc_id)
         club_id = get_el_id("Clubs", secret_password)
         coll_id = get_collection_id("Clubs", club_id)
         add_redis_collection_id("Clubs", coll_id, club_id=club_id)
@@ -152,6 +178,11 @@ def manage_members(secret_password, new_members):
 def remove_club(club_id):
     try:
         db.collection("Clubs").document(club_id).delete()
+        forget("Clubs")
+        unindex_club(club_id)
+        unschedule_club(club_id)
+        remove_club_memberships(club_id)
+        remove_club_leaders(club_id)
         # Also have to delete from joined club of every user, etc.
         return {"status": "Successfully deleted club"}
     except Exception as e:
@@ -178,23 +209,10 @@ def verify_club_model(secret_password):
         return {"status": "Failed", "error": e}
 
 
-def upload_club_image(file: UploadFile = File(...)):
-    try:
-        # Generate a unique file name
-        file_name = f"{uuid4()}.jpg"
-        blob = storage.bucket().blob(f"club-images/{file_name}")
-
-        # Upload the image
-        blob.upload_from_file(file.file, content_type=file.content_type)
-        blob.make_public()
-
-        image_url = blob.public_url
-
-        print(f"Successfully uploaded image: {image_url}")
-        return image_url
-    except Exception as e:
-        print(f"Failed to upload img: {e}")
-        return "Failed"
+async def upload_club_image(file: UploadFile = File(...)):
+    # Streams the upload into club-images/ and builds its WebP renditions
+    # (see uploadmodel.process_image_upload).
+    return await process_image_upload(file, "club-images")
 
 
 def delete_club_image(file_name):
@@ -203,19 +221,55 @@ def delete_club_image(file_name):
     new_new_file_name = file_name[len(to_delete) :]
     # if file_path_or_url.startswith("http"):
     #     file_path_or_url = extract_relative_path(file_path_or_url)
+    if is_content_addressed(new_new_file_name):
+        # May be shared with other clubs / mentors; sweep_images() removes it once unused.
+        print(f"Leaving shared image for the sweeper: {file_name}")
+        return
     try:
-        blob = storage.bucket().blob(new_new_file_name)
-        blob.delete()
+        folder = rendition_folder(new_new_file_name)
+        if folder:  # Original + renditions live in one folder, delete all of them
+            get_bucket().delete_blobs(list(get_bucket().list_blobs(prefix=folder)))
+        else:
+            blob = get_bucket().blob(new_new_file_name)
+            blob.delete()
         print(f"Successfully deleted image: {file_name}")
     except Exception as e:
         print(f"Failed to delete image: {e}")
 
 
-def set_club_image_doc(club_id, img_url, old_id):
+def set_club_image_doc(club_id, img_url, old_id, renditions=None):
     try:
-        db.collection("Clubs").document(club_id).update({"club_img": img_url})
-        delete_club_image(old_id)
+        # {"thumb", "card", "full"} urls; a new image without renditions (yet) must not
+        # keep showing the previous image's.
+        update = {
+            "club_img": img_url,
+            "club_img_renditions": renditions or firestore.DELETE_FIELD,
+        }
+        db.collection("Clubs").document(club_id).update(update)
+        forget("Clubs", club_id)
+        index_club(club_id, get_doc("Clubs", club_id))
+        if old_id:
+            delete_club_image(old_id)
         return {"status": "Successfully updated club img doc"}
     except Exception as e:
         print(f"Failed to update club img doc: {e}")
         return {"status": f"Failed to update club img doc: {e}"}
+
+
+def create_club_image_upload(content_type, sha256=None):
+    return create_signed_upload("club-images", content_type, sha256)
+
+
+def finalize_club_image(blob_name):
+    return finalize_signed_upload("club-images", blob_name)
+
+
+async def add_club_image_renditions(club_id, blob_name):
+    # Background step after /finalizeclubimage/: swap club_img to the card rendition.
+    try:
+        urls = await build_stored_renditions(blob_name)
+        await run_in_threadpool(set_club_image_doc, club_id, urls["card"], "", urls)
+        coll_id = get_collection_id("Clubs", club_id)
+        add_redis_collection_id("Clubs", coll_id, club_id=club_id)
+    except Exception as e:
+        print(f"Failed to add club image renditions: {e}")
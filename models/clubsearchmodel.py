@@ -0,0 +1,165 @@
+import math
+import re
+from bisect import bisect_left, insort
+from collections import Counter
+
+from .model import get_collection_python
+from .indexmodel import SharedIndex
+
+# In-process full-text index for /clubs/search ("Find a Club"). Approved clubs are
+# tokenized over their name, description and advisor / president emails into an
+# inverted index scored with BM25. Query words also match longer words they are a
+# prefix of ("rob" finds "robotics"), using a sorted vocabulary. Kept in step with
+# the other instances by indexmodel.SharedIndex.
+
+INDEX_NAME = "clubs"
+K1 = 1.2
+B = 0.75
+# Field weights, applied as term-frequency multipliers (club_name matches count most).
+FIELD_WEIGHTS = {
+    "club_name": 3,
+    "club_description": 1,
+    "advisor_email": 1,
+    "president_email": 1,
+}
+PREFIX_WEIGHT = 0.5  # a prefix match scores half of an exact one
+MAX_PREFIX_TERMS = 50
+MAX_SEARCH_RESULTS = 100  # clubs per page
+SUMMARY_FIELDS = [
+    "club_name",
+    "club_description",
+    "advisor_email",
+    "president_email",
+    "vice_presidents_emails",
+    "club_days",
+    "start_time",
+    "room_number",
+    "google_classroom_link",
+    "club_img",
+    "club_img_renditions",
+]
+
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", str(text).lower())
+
+
+def club_terms(club):
+    terms = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        value = club.get(field) or ""
+        tokens = tokenize(value)
+        if field.endswith("_email") and value:
+            tokens.append(value.lower())  # the whole address matches too
+        for t in tokens:
+            terms[t] += weight
+    return terms
+
+
+class ClubIndex:
+    def __init__(self):
+        self.clubs = {}  # club id -> summary dict
+        self.terms = {}  # club id -> Counter of weighted term frequencies
+        self.lengths = {}  # club id -> weighted document length
+        self.postings = {}  # term -> {club id: weighted tf}
+        self.vocab = []  # sorted terms, for prefix lookups
+        self.total_length = 0
+
+    def add(self, club_id, club):
+        self.remove(club_id)
+        if club.get("status") != "Approved":
+            return
+        terms = club_terms(club)
+        summary = {k: club[k] for k in SUMMARY_FIELDS if k in club}
+        summary["id"] = club_id
+        self.clubs[club_id] = summary
+        self.terms[club_id] = terms
+        self.lengths[club_id] = sum(terms.values())
+        self.total_length += self.lengths[club_id]
+        for term, tf in terms.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                insort(self.vocab, term)
+            self.postings[term][club_id] = tf
+
+    def remove(self, club_id):
+        if club_id not in self.clubs:
+            return
+        for term in self.terms.pop(club_id):
+            posting = self.postings[term]
+            del posting[club_id]
+            if not posting:
+                del self.postings[term]
+                del self.vocab[bisect_left(self.vocab, term)]
+        self.total_length -= self.lengths.pop(club_id)
+        del self.clubs[club_id]
+
+    def expand(self, token):
+        # {term: weight} for the exact token and the vocabulary words it prefixes.
+        expanded = {}
+        i = bisect_left(self.vocab, token)
+        while i < len(self.vocab) and len(expanded) < MAX_PREFIX_TERMS:
+            term = self.vocab[i]
+            if not term.startswith(token):
+                break
+            expanded[term] = 1.0 if term == token else PREFIX_WEIGHT
+            i += 1
+        return expanded
+
+    def search(self, query, limit=20, offset=0):
+        n = len(self.clubs)
+        if n == 0:
+            return {"total": 0, "clubs": []}
+        avg_length = self.total_length / n
+        scores = {}
+        for token in set(tokenize(query)):
+            for term, weight in self.expand(token).items():
+                posting = self.postings[term]
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for club_id, tf in posting.items():
+                    norm = K1 * (1 - B + B * self.lengths[club_id] / avg_length)
+                    score = weight * idf * tf * (K1 + 1) / (tf + norm)
+                    scores[club_id] = scores.get(club_id, 0) + score
+        ranked = sorted(
+            scores.items(), key=lambda s: (-s[1], self.clubs[s[0]].get("club_name", ""))
+        )
+        return {
+            "total": len(ranked),
+            "clubs": [
+                {**self.clubs[club_id], "score": round(score, 4)}
+                for club_id, score in ranked[offset : offset + limit]
+            ],
+        }
+
+
+def build_club_index():
+    index = ClubIndex()
+    for c in get_collection_python("Clubs"):
+        index.add(c["id"], c)
+    return index
+
+
+club_index = SharedIndex(INDEX_NAME, build_club_index)
+
+
+def rebuild_club_index():
+    index = club_index.rebuild()
+    return {"status": 0, "clubs": len(index.clubs)}
+
+
+def index_club(club_id, club):
+    # Also drops clubs that are no longer Approved.
+    club_index.apply(lambda index: index.add(club_id, club))
+
+
+def unindex_club(club_id):
+    club_index.apply(lambda index: index.remove(club_id))
+
+
+def search_clubs(query, limit=20, offset=0):
+    # limit must be 1..MAX_SEARCH_RESULTS (negative values would slice from the end).
+    if not 1 <= limit <= MAX_SEARCH_RESULTS or offset < 0:
+        raise ValueError(
+            f"limit must be between 1 and {MAX_SEARCH_RESULTS} and offset at least 0"
+        )
+    return club_index.read(lambda index: index.search(query, limit, offset))
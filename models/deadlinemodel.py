@@ -0,0 +1,173 @@
+import json
+import time
+
+from .deadlineparser import parse_deadline
+from .model import db, get_collection_python, get_collection_id, forget
+from .redismodel import redis
+
+# Deadline index for opportunity links. The free-text deadline is parsed once into
+# deadline_ts (epoch seconds, end of that day in school time) and kept in Redis sorted
+# sets scored by it:
+#   opportunities:deadlines              every link with a deadline
+#   opportunities:deadlines:<category>   the links of one category
+# /opportunities/upcoming pages through them, and archive_expired_links() moves links
+# whose deadline passed into OpportunitiesArchive so the hot collection stays small.
+# Links without a clear deadline ("Rolling", "N/A", "Summer 2025") are not indexed or
+# archived; see models/deadlineparser.py.
+
+DEADLINES = "opportunities:deadlines"
+DEADLINES_READY = "opportunities:deadlines:ready"
+ARCHIVE = "OpportunitiesArchive"
+ARCHIVE_BATCH_SIZE = 200  # links per batch (one set + one delete each)
+MAX_UPCOMING = 100  # links per page of upcoming_links
+
+
+def category_key(category):
+    return f"{DEADLINES}:{category}"
+
+
+def index_deadline(tx, link_id, deadline_ts, categories):
+    if deadline_ts is None:
+        return
+    tx.zadd(DEADLINES, {link_id: deadline_ts})
+    for c in categories or []:
+        tx.zadd(category_key(c), {link_id: deadline_ts})
+
+
+def unindex_deadline(tx, link_id, categories):
+    tx.zrem(DEADLINES, link_id)
+    for c in categories or []:
+        tx.zrem(category_key(c), link_id)
+
+
+def reindex_link(link_id, link, old_categories=None):
+    # Call after a link is created or changed (old_categories: what it had before).
+    try:
+        tx = redis.multi()
+        unindex_deadline(tx, link_id, old_categories)
+        index_deadline(tx, link_id, link.get("deadline_ts"), link.get("categories"))
+        tx.exec()
+    except Exception as e:
+        print(f"Failed to index link deadline: {e}")
+
+
+def unindex_link(link_id, categories):
+    try:
+        tx = redis.multi()
+        unindex_deadline(tx, link_id, categories)
+        tx.exec()
+    except Exception as e:
+        print(f"Failed to unindex link deadline: {e}")
+
+
+def rebuild_deadline_index():
+    # Recomputes the index from Firestore, backfilling deadline_ts on links without it.
+    try:
+        links = get_collection_python("Opportunities")
+        categories = get_collection_id("Demographics", "Opportunities")["categories"]
+        batch = db.batch()
+        backfilled = 0
+        for link in links:
+            if "deadline_ts" not in link:
+                link["deadline_ts"] = parse_deadline(link.get("deadline"))
+                batch.update(
+                    db.collection("Opportunities").document(link["id"]),
+                    {"deadline_ts": link["deadline_ts"]},
+                )
+                backfilled += 1
+                if backfilled % 400 == 0:
+                    batch.commit()
+                    batch = db.batch()
+        if backfilled % 400 != 0:
+            batch.commit()
+        tx = redis.multi()
+        tx.delete(DEADLINES, *[category_key(c) for c in categories])
+        for link in links:
+            index_deadline(tx, link["id"], link["deadline_ts"], link.get("categories"))
+        tx.set(DEADLINES_READY, 1)
+        tx.exec()
+        return {"status": 0, "links": len(links), "backfilled": backfilled}
+    except Exception as e:
+        print(f"Failed to rebuild deadline index: {e}")
+        return {"status": -1, "error_message": e}
+
+
+def ensure_deadline_index():
+    if not redis.exists(DEADLINES_READY):
+        rebuilt = rebuild_deadline_index()
+        if rebuilt["status"] != 0:
+            raise Exception(rebuilt["error_message"])
+
+
+def load_links(link_ids):
+    # From the Opportunities cache, falling back to Firestore for missing entries.
+    links = []
+    raw = redis.hmget("Opportunities", *link_ids) if link_ids else []
+    for link_id, value in zip(link_ids, raw):
+        link = None
+        if value:
+            try:
+                link = json.loads(value) if isinstance(value, str) else value
+            except json.JSONDecodeError:
+                link = None
+        if not isinstance(link, dict):
+            link = get_collection_id("Opportunities", link_id)
+        if link:
+            link["id"] = link_id
+            links.append(link)
+    return links
+
+
+def upcoming_links(limit=20, offset=0, category=None):
+    # Links whose deadline has not passed, soonest first. limit must be
+    # 1..MAX_UPCOMING (a negative count would return the whole set).
+    if not 1 <= limit <= MAX_UPCOMING or offset < 0:
+        raise ValueError(
+            f"limit must be between 1 and {MAX_UPCOMING} and offset at least 0"
+        )
+    ensure_deadline_index()
+    key = category_key(category) if category else DEADLINES
+    now = time.time()
+    link_ids = redis.zrange(
+        key, now, "+inf", sortby="BYSCORE", offset=offset, count=limit
+    )
+    return {
+        "total": redis.zcount(key, now, "+inf"),
+        "links": load_links(link_ids),
+    }
+
+
+def archive_expired_links(grace_seconds=0):
+    # Moves links whose deadline passed more than grace_seconds ago into OpportunitiesArchive.
+    ensure_deadline_index()
+    cutoff = time.time() - grace_seconds
+    expired = redis.zrange(DEADLINES, "-inf", cutoff, sortby="BYSCORE")
+    archived = 0
+    for i in range(0, len(expired), ARCHIVE_BATCH_SIZE):
+        chunk = expired[i : i + ARCHIVE_BATCH_SIZE]
+        refs = [db.collection("Opportunities").document(link_id) for link_id in chunk]
+        batch = db.batch()
+        moved = []
+        for snap in db.get_all(refs):
+            if not snap.exists:
+                continue
+            link = snap.to_dict()
+            batch.set(
+                db.collection(ARCHIVE).document(snap.id), {**link, "archived": time.time()}
+            )
+            batch.delete(snap.reference)
+            moved.append((snap.id, link.get("categories")))
+        if len(moved) > 0:
+            batch.commit()
+        tx = redis.multi()
+        for link_id in chunk:
+            tx.zrem(DEADLINES, link_id)
+        for link_id, categories in moved:
+            unindex_deadline(tx, link_id, categories)
+        if len(moved) > 0:
+            tx.hdel("Opportunities", *[link_id for link_id, _ in moved])
+        tx.exec()
+        archived += len(moved)
+    if archived > 0:
+        forget("Opportunities")
+    return {"status": 0, "archived": archived}
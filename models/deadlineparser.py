@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+from dateutil import parser, tz
+
+# Turns the free-text deadline of an opportunity link into epoch seconds (end of that
+# day in school time). Only dates that name both a month and a day are accepted; text
+# like "Summer 2025", "Every Friday", "May" or "Apply by 5pm" gives None rather than a
+# confident guess, and such links are simply not indexed or archived.
+
+SCHOOL_TZ = tz.gettz("America/New_York")
+# Parsed twice with these defaults: a field that differs between the two results was
+# not in the text. Both are leap years so "Feb 29" parses.
+DEFAULT_A = datetime(2000, 1, 1)
+DEFAULT_B = datetime(2004, 2, 2)
+MAX_YEARS_AWAY = 5  # "2nd round: April 3" reads as 2003; no real deadline is that far
+# Words fuzzy parsing may skip around a date; anything else counts against the text.
+FILLER_WORDS = set(
+    "apply application applications at before by close closes date deadline due is of "
+    "on the to until".split()
+)
+MAX_SKIPPED_WORDS = 2
+
+
+def skipped_words(tokens):
+    words = " ".join(tokens).replace(":", " ").replace(",", " ").lower().split()
+    return [w for w in words if w not in FILLER_WORDS]
+
+
+def parse_deadline(deadline, now=None):
+    # "March 15, 2025", "3/15/25", "Due 2025-03-15" -> epoch seconds, None if the text
+    # is not clearly one date. Without a year, the next "March 15" from now is meant.
+    if not isinstance(deadline, str) or len(deadline.strip()) == 0:
+        return None
+    now = now or datetime.now(SCHOOL_TZ)
+    try:
+        a, tokens = parser.parse(deadline, fuzzy_with_tokens=True, default=DEFAULT_A)
+        b = parser.parse(deadline, fuzzy=True, default=DEFAULT_B)
+    except (ValueError, OverflowError):  # also raised when the text has no date
+        return None
+    if a.month != b.month or a.day != b.day:
+        return None  # no month or no day in the text
+    if len(skipped_words(tokens)) > MAX_SKIPPED_WORDS:
+        return None
+    if a.hour == 0 and a.minute == 0:
+        a = a + timedelta(days=1, seconds=-1)  # due by the end of the day
+    if a.tzinfo is None:
+        a = a.replace(tzinfo=SCHOOL_TZ)
+    if a.year == b.year:
+        if abs(a.year - now.year) > MAX_YEARS_AWAY:
+            return None
+        return a.timestamp()
+    # No year: this year's date, or next year's if it has already passed.
+    for year in (now.year, now.year + 1):
+        try:
+            parsed = a.replace(year=year)
+        except ValueError:  # Feb 29 outside a leap year
+            continue
+        if parsed.timestamp() >= now.timestamp():
+            return parsed.timestamp()
+    return None
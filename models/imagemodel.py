@@ -0,0 +1,97 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from PIL import Image, ImageOps
+from starlette.concurrency import run_in_threadpool
+
+# Resizes uploaded club / mentor images into WebP renditions. Each upload is stored as
+#   <prefix>/<image_id>/original.<ext>
+#   <prefix>/<image_id>/thumb.webp   (list thumbnails)
+#   <prefix>/<image_id>/card.webp    (cards on the Find a Club / Find a Mentor pages)
+#   <prefix>/<image_id>/full.webp    (detail views)
+# Decoding and encoding are CPU bound, so they run in a process pool. Where processes
+# cannot be started (serverless hosts such as Vercel have no /dev/shm), a thread pool is
+# used instead.
+
+RENDITIONS = {"thumb": 160, "card": 480, "full": 1600}  # longest edge in px
+WEBP_QUALITY = 80
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", 2))
+# Uploads are untrusted: a small file can decode to a huge bitmap. 40 MP covers any phone.
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 40_000_000))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS  # Image.open raises past twice this
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        try:
+            _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+        except (OSError, NotImplementedError, ImportError) as e:
+            print(f"No process pool for images ({e}), using threads")
+            _pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _pool
+
+
+def use_thread_pool():
+    global _pool
+    _pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _pool
+
+
+def make_renditions(data):
+    # Runs in a worker: bytes in, {name: webp bytes} out.
+    renditions = {}
+    try:
+        img = Image.open(BytesIO(data))
+    except Image.DecompressionBombError as e:
+        raise ValueError(f"Image has too many pixels: {e}")
+    with img:
+        # Only the header has been read so far; check the size before decoding.
+        if img.width * img.height > MAX_IMAGE_PIXELS:
+            raise ValueError(f"Image has too many pixels: {img.width}x{img.height}")
+        img = ImageOps.exif_transpose(img)  # respect phone camera rotation
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+        for name, edge in RENDITIONS.items():
+            resized = img.copy()
+            resized.thumbnail((edge, edge), Image.LANCZOS)  # never upscales
+            out = BytesIO()
+            resized.save(out, "WEBP", quality=WEBP_QUALITY, method=4)
+            renditions[name] = out.getvalue()
+    return renditions
+
+
+async def build_renditions(data):
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_pool(), make_renditions, data)
+    except (BrokenProcessPool, OSError) as e:
+        # Worker processes could not be started (or died); fall back to threads.
+        if isinstance(_pool, ThreadPoolExecutor):
+            raise
+        print(f"Image process pool failed ({e}), using threads")
+        return await loop.run_in_executor(use_thread_pool(), make_renditions, data)
+
+
+def store_rendition(bucket, key, data):
+    blob = bucket.blob(key)
+    # Keys are unique per upload, so the files can be cached forever.
+    blob.cache_control = "public, max-age=31536000, immutable"
+    blob.upload_from_string(data, content_type="image/webp")
+    blob.make_public()
+    return blob.public_url
+
+
+async def store_renditions(bucket, folder, renditions):
+    urls = await asyncio.gather(
+        *[
+            run_in_threadpool(store_rendition, bucket, f"{folder}/{name}.webp", data)
+            for name, data in renditions.items()
+        ]
+    )
+    return dict(zip(renditions.keys(), urls))
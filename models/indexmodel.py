@@ -0,0 +1,55 @@
+import threading
+
+from .redismodel import get_index_version, bump_index_version
+
+
+class SharedIndex:
+    # An in-process index (search bitmaps, match matrix, ...) kept in step across
+    # instances. Writes apply to this instance's copy and bump the index's version in
+    # Redis; a copy built at an older version is rebuilt with build() on next use.
+
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+        self.index = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def _build(self):
+        version = get_index_version(self.name)
+        self.index = self.build()
+        self.version = version
+
+    def rebuild(self):
+        with self.lock:
+            self._build()
+            return self.index
+
+    def read(self, query):
+        # Runs query(index) against an up-to-date copy.
+        with self.lock:
+            if self.index is None or self.version != get_index_version(self.name):
+                self._build()
+            return query(self.index)
+
+    def apply(self, change):
+        # If another instance also wrote since we last synced, drop our copy so the next
+        # read rebuilds it.
+        try:
+            with self.lock:
+                if self.index is not None:
+                    change(self.index)
+                version = bump_index_version(self.name)
+                self.version = version if self.version == version - 1 else None
+        except Exception as e:
+            print(f"Failed to update {self.name} index: {e}")
+
+    def invalidate(self):
+        # For writes that are not worth applying in place: every instance (this one
+        # included) rebuilds on its next read.
+        try:
+            with self.lock:
+                self.index = None
+                bump_index_version(self.name)
+        except Exception as e:
+            print(f"Failed to invalidate {self.name} index: {e}")
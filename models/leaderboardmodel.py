@@ -0,0 +1,148 @@
+import re
+
+from .model import get_collection_python
+from .ledgermodel import LEDGER, to_hours
+from .redismodel import redis
+
+# Precomputed volunteer-hours reports, updated whenever a mentee confirms a log:
+#   hours:leaderboard              sorted set, mentor email -> all-time confirmed hours
+#   hours:month:<YYYY-MM>          sorted set per month (month the mentor met the mentee)
+#   hours:semester:<YYYY-fall|spring>  sorted set per semester
+#   hours:total, hours:total:month:<..>, hours:total:semester:<..>  counters
+#   hours:months, hours:semesters  sets of the periods that have data
+# so the admin and volunteer-hours reports never pull the whole Mentors collection.
+
+LEADERBOARD = "hours:leaderboard"
+HOURS_READY = "hours:ready"
+MAX_LEADERBOARD = 100
+
+
+def valid_log(hours, date):
+    # Reports need numeric hours and a "YYYY-MM..." date; older logs are not always so.
+    try:
+        float(hours)
+    except (TypeError, ValueError):
+        return False
+    return isinstance(date, str) and re.match(r"\d{4}-(0[1-9]|1[0-2])", date) is not None
+
+
+def semester_of(date):
+    # Fall runs August - January, spring February - July. date is "YYYY-MM-DD".
+    year, month = int(date[:4]), int(date[5:7])
+    if month >= 8:
+        return f"{year}-fall"
+    if month == 1:
+        return f"{year - 1}-fall"
+    return f"{year}-spring"
+
+
+def add_hours(tx, mentor_email, hours, date):
+    hours = to_hours(hours)
+    month, semester = date[:7], semester_of(date)
+    tx.zincrby(LEADERBOARD, hours, mentor_email)
+    tx.zincrby(f"hours:month:{month}", hours, mentor_email)
+    tx.zincrby(f"hours:semester:{semester}", hours, mentor_email)
+    tx.incrbyfloat("hours:total", hours)
+    tx.incrbyfloat(f"hours:total:month:{month}", hours)
+    tx.incrbyfloat(f"hours:total:semester:{semester}", hours)
+    tx.sadd("hours:months", month)
+    tx.sadd("hours:semesters", semester)
+
+
+def record_confirmed_hours(mentor_email, hours, date):
+    # Before the first rebuild there is nothing to add to; the rebuild counts this log.
+    try:
+        if not redis.exists(HOURS_READY):
+            return {"status": 0}
+        tx = redis.multi()
+        add_hours(tx, mentor_email, hours, date)
+        tx.exec()
+        return {"status": 0}
+    except Exception as e:
+        print(f"Failed to record confirmed hours: {e}")
+        return {"status": -1, "error_message": e}
+
+
+def rebuild_hours_reports():
+    # Recompute every report from the confirmed logs (HoursLedger + the older
+    # hours_worked_catalog arrays).
+    try:
+        confirmed = []
+        skipped = 0
+        ledger = get_collection_python(LEDGER)
+        for e in ledger:
+            if e["status"] == 0:
+                confirmed.append((e["mentor"], e["hours"], e["date"]))
+        in_ledger = {e["id"] for e in ledger}  # also mirrored in hours_worked_catalog
+        for m in get_collection_python("Mentors"):
+            for c in m.get("hours_worked_catalog", []):
+                if c.get("status") == 0 and c.get("id") not in in_ledger:
+                    confirmed.append((m["email"], c.get("hours"), c.get("date")))
+        months = redis.smembers("hours:months")
+        semesters = redis.smembers("hours:semesters")
+        tx = redis.multi()
+        tx.delete(LEADERBOARD, "hours:total", "hours:months", "hours:semesters")
+        for month in months:
+            tx.delete(f"hours:month:{month}", f"hours:total:month:{month}")
+        for semester in semesters:
+            tx.delete(f"hours:semester:{semester}", f"hours:total:semester:{semester}")
+        counted = 0
+        for mentor_email, hours, date in confirmed:
+            if not valid_log(hours, date):
+                skipped += 1  # malformed legacy entry; left out of the reports
+                continue
+            add_hours(tx, mentor_email, hours, date)
+            counted += 1
+        tx.set(HOURS_READY, 1)
+        tx.exec()
+        return {"status": 0, "logs": counted, "skipped": skipped}
+    except Exception as e:
+        print(f"Failed to rebuild hours reports: {e}")
+        return {"status": -1, "error_message": e}
+
+
+def ensure_hours_reports():
+    if not redis.exists(HOURS_READY):
+        rebuilt = rebuild_hours_reports()
+        if rebuilt["status"] != 0:
+            raise Exception(rebuilt["error_message"])
+
+
+def get_leaderboard(limit=10, month=None, semester=None):
+    # limit must be 1..MAX_LEADERBOARD (0 or less would return the whole set).
+    if not 1 <= limit <= MAX_LEADERBOARD:
+        raise ValueError(f"limit must be between 1 and {MAX_LEADERBOARD}")
+    ensure_hours_reports()
+    key = LEADERBOARD
+    if month:
+        key = f"hours:month:{month}"
+    elif semester:
+        key = f"hours:semester:{semester}"
+    ranked = redis.zrange(key, 0, limit - 1, rev=True, withscores=True)
+    return [
+        {"rank": i + 1, "mentor": mentor, "hours": to_hours(hours)}
+        for i, (mentor, hours) in enumerate(ranked)
+    ]
+
+
+def get_mentor_hours(mentor_email):
+    ensure_hours_reports()
+    hours = redis.zscore(LEADERBOARD, mentor_email)
+    return to_hours(hours) if hours is not None else 0
+
+
+def get_hours_totals():
+    ensure_hours_reports()
+    months = sorted(redis.smembers("hours:months"))
+    semesters = sorted(redis.smembers("hours:semesters"))
+    keys = (
+        ["hours:total"]
+        + [f"hours:total:month:{m}" for m in months]
+        + [f"hours:total:semester:{s}" for s in semesters]
+    )
+    values = [to_hours(v or 0) for v in redis.mget(*keys)]
+    return {
+        "total": values[0],
+        "months": dict(zip(months, values[1 : 1 + len(months)])),
+        "semesters": dict(zip(semesters, values[1 + len(months) :])),
+    }
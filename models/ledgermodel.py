@@ -0,0 +1,199 @@
+from firebase_admin import firestore
+
+from .model import db, get_el_id, get_doc, forget
+
+# Mentor-mentee hours ledger. Each log is one HoursLedger/<catalog_id> document that both
+# sides use (the mentor writes it, the mentee confirms it), and the running totals are
+# kept with Firestore Increment on Mentors.total_hours_worked and Users.total_mentee_hours.
+# Logging and confirming read a fixed number of documents however long a mentor's
+# history is. The hours_worked_catalog / mentee_logs arrays are still kept for their
+# readers, but with ArrayUnion / ArrayRemove in the same write instead of being read and
+# rewritten; readers that merge them with the ledger skip ids the ledger has.
+
+LEDGER = "HoursLedger"
+
+
+def to_hours(hours):
+    hours = float(hours)
+    return int(hours) if hours.is_integer() else hours
+
+
+def ledger_ref(catalog_id):
+    return db.collection(LEDGER).document(catalog_id)
+
+
+def get_ledger_entry(catalog_id):
+    snapshot = ledger_ref(catalog_id).get()
+    if not snapshot.exists:
+        return None
+    return snapshot.to_dict()
+
+
+def catalog_entry(entry):
+    # The ledger entry as an hours_worked_catalog element.
+    return {
+        "id": entry["id"],
+        "mentee": entry["mentee"],
+        "description": entry["description"],
+        "hours": entry["hours"],
+        "date": entry["date"],
+        "status": entry["status"],
+    }
+
+
+def mentee_log_entry(entry):
+    # The (confirmed) ledger entry as a mentee_logs element.
+    return {
+        "id": entry["id"],
+        "mentor": entry["mentor"],
+        "hours": entry["hours"],
+        "description": entry["mentee_description"],
+        "date_confirmed": entry["date_confirmed"],
+        "date_met": entry["date"],
+    }
+
+
+def log_hours(catalog_id, mentor_id, mentor_email, mentee_email, description, hours, date):
+    entry = {
+        "id": catalog_id,
+        "mentor": mentor_email,
+        "mentor_id": mentor_id,
+        "mentee": mentee_email,
+        "description": description,
+        "hours": hours,
+        "date": str(date),
+        "status": -1,  # -1 means mentee not confirmed, 0 means mentee confirmed.
+        "mentee_description": None,
+        "date_confirmed": None,
+    }
+    batch = db.batch()
+    batch.set(ledger_ref(catalog_id), entry)
+    batch.update(
+        db.collection("Mentors").document(mentor_id),
+        {"hours_worked_catalog": firestore.ArrayUnion([catalog_entry(entry)])},
+    )
+    batch.commit()
+    forget("Mentors", mentor_id)
+
+
+@firestore.transactional
+def _confirm_in_transaction(
+    transaction, catalog_id, mentee_id, mentee_email, mentee_hours, description, date
+):
+    ref = ledger_ref(catalog_id)
+    snapshot = ref.get(transaction=transaction)
+    entry = snapshot.to_dict()
+    if entry["mentee"] != mentee_email:
+        return {"status": -1, "error_message": "No matching catalog id found"}
+    if entry["status"] == 0:  # This has already been changed, so skip
+        return {"status": -1, "error_message": "This log has already been confirmed."}
+    if entry["hours"] != str(mentee_hours):
+        return {"status": -2, "error_message": "Mismatching hours reported."}
+    hours = to_hours(mentee_hours)
+    pending = catalog_entry(entry)
+    entry.update(status=0, mentee_description=description, date_confirmed=date)
+    transaction.update(
+        ref, {"status": 0, "mentee_description": description, "date_confirmed": date}
+    )
+    # Both totals change together, and only once the mentee has confirmed.
+    mentor_ref = db.collection("Mentors").document(entry["mentor_id"])
+    transaction.update(
+        mentor_ref,
+        {
+            "total_hours_worked": firestore.Increment(hours),
+            "hours_worked_catalog": firestore.ArrayRemove([pending]),
+        },
+    )
+    transaction.update(
+        mentor_ref, {"hours_worked_catalog": firestore.ArrayUnion([catalog_entry(entry)])}
+    )
+    transaction.update(
+        db.collection("Users").document(mentee_id),
+        {
+            "is_mentee": True,
+            "total_mentee_hours": firestore.Increment(hours),
+            "mentee_logs": firestore.ArrayUnion([mentee_log_entry(entry)]),
+        },
+    )
+    return {"status": 0, "mentor_log": entry}
+
+
+def confirm_hours(catalog_id, mentee_email, mentee_hours, description, date_confirmed):
+    # Same results as confirm_mentor_mentee_logging: 0 ok, -1 not found / already
+    # confirmed, -2 mismatching hours. The ledger entry, both totals and both arrays are
+    # written in one transaction.
+    mentee_id = get_el_id("Users", mentee_email)
+    if mentee_id is None:
+        return {"status": -1, "error_message": "No mentee found"}
+    result = _confirm_in_transaction(
+        db.transaction(),
+        catalog_id,
+        mentee_id,
+        mentee_email,
+        mentee_hours,
+        description,
+        date_confirmed,
+    )
+    if result["status"] == 0:
+        forget("Mentors", result["mentor_log"]["mentor_id"])
+        forget("Users", mentee_id)
+    return result
+
+
+def mentor_ledger(mentor_email):
+    # Ledger entries plus any pre-ledger entries still in hours_worked_catalog.
+    entries = [
+        d.to_dict()
+        for d in db.collection(LEDGER).where("mentor", "==", mentor_email).stream()
+    ]
+    ids = {e["id"] for e in entries}
+    mentor_id = get_el_id("Mentors", mentor_email)
+    if mentor_id:
+        catalog = get_doc("Mentors", mentor_id).get("hours_worked_catalog", [])
+        entries += [c for c in catalog if c["id"] not in ids]
+    return entries
+
+
+def mentee_ledger(mentee_email):
+    # Confirmed logs in the same shape as the old mentee_logs entries.
+    entries = []
+    for d in db.collection(LEDGER).where("mentee", "==", mentee_email).stream():
+        e = d.to_dict()
+        if e["status"] == 0 and e["date_confirmed"] is not None:
+            entries.append(mentee_log_entry(e))
+    ids = {e["id"] for e in entries}
+    mentee_id = get_el_id("Users", mentee_email)
+    if mentee_id:
+        logs = get_doc("Users", mentee_id).get("mentee_logs", [])
+        entries += [l for l in logs if l["id"] not in ids]
+    return entries
+
+
+@firestore.transactional
+def _backfill_mentee_total(transaction, user_ref, email):
+    user = user_ref.get(transaction=transaction).to_dict()
+    hours = {l["id"]: l["hours"] for l in user.get("mentee_logs", [])}
+    query = db.collection(LEDGER).where("mentee", "==", email).where("status", "==", 0)
+    for d in transaction.get(query):
+        hours[d.id] = d.to_dict()["hours"]
+    total = to_hours(sum(float(h) for h in hours.values()))
+    transaction.update(user_ref, {"total_mentee_hours": total})
+    return total
+
+
+def backfill_mentee_totals():
+    # Sets Users.total_mentee_hours from each mentee's confirmed logs (mentee_logs plus
+    # ledger). Needed once for mentees from before the ledger; each user is recomputed in
+    # a transaction, so confirmations running meanwhile are not lost.
+    try:
+        updated = 0
+        for snap in db.collection("Users").where("is_mentee", "==", True).stream():
+            email = snap.to_dict().get("email")
+            if email:
+                _backfill_mentee_total(db.transaction(), snap.reference, email)
+                forget("Users", snap.id)
+                updated += 1
+        return {"status": 0, "updated": updated}
+    except Exception as e:
+        print(f"Failed to backfill mentee totals: {e}")
+        return {"status": -1, "error_message": e}
@@ -0,0 +1,183 @@
+import json
+import math
+
+from .model import get_doc
+from .indexmodel import SharedIndex
+from .redismodel import redis, get_index_version
+
+# Alumni map. Universities (AllInfo/universities, with their alumni counts) are indexed
+# by their parsed coordinates in a grid of GRID_DEGREES cells, so a bounding box only
+# looks at the cells it covers. For a zoom level, schools are clustered into cells of
+# 1/CLUSTERS_PER_TILE of a map tile; from DETAIL_ZOOM on every school is its own point.
+# Tile responses are cached in Redis under the index version, so any change to the
+# universities simply makes new tile keys (old ones expire).
+
+INDEX_NAME = "alumni-map"
+GRID_DEGREES = 1.0
+CLUSTERS_PER_TILE = 8
+DETAIL_ZOOM = 10
+MAX_ZOOM = 18
+TILE_EXPIRY = 24 * 3600  # seconds
+
+
+def parse_coords(coords):
+    # ["42.37", "-71.11"], "42.37, -71.11" or [42.37, -71.11] -> (lat, lng), None if invalid
+    if isinstance(coords, str):
+        coords = coords.split(",")
+    try:
+        lat, lng = float(coords[0]), float(coords[1])
+    except (TypeError, ValueError, IndexError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+def grid_cell(lat, lng):
+    return math.floor(lat / GRID_DEGREES), math.floor(lng / GRID_DEGREES)
+
+
+def tile_bbox(z, x, y):
+    # Web Mercator tile -> (west, south, east, north) in degrees.
+    n = 2**z
+
+    def lat_of(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360 - 180, lat_of(y + 1), (x + 1) / n * 360 - 180, lat_of(y)
+
+
+class MapIndex:
+    def __init__(self):
+        self.schools = {}  # key -> {"key", "name", "lat", "lng", "amount_in", "logo", ...}
+        self.cells = {}  # (lat cell, lng cell) -> set of keys
+
+    def add(self, key, uni):
+        self.remove(key)
+        point = parse_coords(uni.get("coords"))
+        if point is None:
+            return
+        lat, lng = point
+        self.schools[key] = {
+            "key": key,
+            "name": uni.get("name"),
+            "loc": uni.get("loc"),
+            "logo": uni.get("logo"),
+            "amount_in": uni.get("amount_in", 0),
+            "lat": lat,
+            "lng": lng,
+        }
+        self.cells.setdefault(grid_cell(lat, lng), set()).add(key)
+
+    def remove(self, key):
+        school = self.schools.pop(key, None)
+        if school is None:
+            return
+        cell = grid_cell(school["lat"], school["lng"])
+        self.cells[cell].discard(key)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def count_alum(self, key):
+        if key in self.schools:
+            self.schools[key]["amount_in"] += 1
+
+    def in_bbox(self, west, south, east, north):
+        if west > east:  # box crosses the antimeridian
+            return self.in_bbox(west, south, 180, north) + self.in_bbox(
+                -180, south, east, north
+            )
+        lat0, lng0 = grid_cell(south, west)
+        lat1, lng1 = grid_cell(north, east)
+        if (lat1 - lat0 + 1) * (lng1 - lng0 + 1) > len(self.cells):
+            keys = self.schools.keys()  # huge box: cheaper to check every school
+        else:
+            keys = [
+                k
+                for i in range(lat0, lat1 + 1)
+                for j in range(lng0, lng1 + 1)
+                for k in self.cells.get((i, j), ())
+            ]
+        results = []
+        for k in keys:
+            s = self.schools[k]
+            if south <= s["lat"] <= north and west <= s["lng"] <= east:
+                results.append(s)
+        return results
+
+    def clusters(self, west, south, east, north, zoom):
+        schools = self.in_bbox(west, south, east, north)
+        if zoom >= DETAIL_ZOOM:
+            return [{**s, "schools": 1, "alumni": s["amount_in"]} for s in schools]
+        size = 360 / (2**zoom * CLUSTERS_PER_TILE)  # cluster cell, in degrees
+        groups = {}
+        for s in schools:
+            groups.setdefault(
+                (math.floor(s["lat"] / size), math.floor(s["lng"] / size)), []
+            ).append(s)
+        results = []
+        for group in groups.values():
+            if len(group) == 1:
+                s = group[0]
+                results.append({**s, "schools": 1, "alumni": s["amount_in"]})
+                continue
+            # Centre weighted by school (alumni counts can be 0).
+            results.append(
+                {
+                    "lat": sum(s["lat"] for s in group) / len(group),
+                    "lng": sum(s["lng"] for s in group) / len(group),
+                    "schools": len(group),
+                    "alumni": sum(s["amount_in"] for s in group),
+                }
+            )
+        return results
+
+
+def build_map_index():
+    index = MapIndex()
+    universities = get_doc("AllInfo", "universities") or {}
+    for key, uni in universities.items():
+        if isinstance(uni, dict):
+            index.add(key, uni)
+    return index
+
+
+map_index = SharedIndex(INDEX_NAME, build_map_index)
+
+
+def rebuild_map_index():
+    index = map_index.rebuild()
+    return {"status": 0, "schools": len(index.schools)}
+
+
+def map_school(key, uni):
+    map_index.apply(lambda index: index.add(key, uni))
+
+
+def map_alum(key):
+    map_index.apply(lambda index: index.count_alum(key))
+
+
+def invalidate_map():
+    map_index.invalidate()
+
+
+def schools_in_bbox(west, south, east, north, zoom=None):
+    # Individual schools, or clusters when a zoom level is given.
+    if zoom is None:
+        return map_index.read(lambda index: index.in_bbox(west, south, east, north))
+    return map_index.read(
+        lambda index: index.clusters(west, south, east, north, zoom)
+    )
+
+
+def get_tile(z, x, y):
+    # Clusters for one Web Mercator tile, cached per index version.
+    key = f"map:tile:{get_index_version(INDEX_NAME)}:{z}:{x}:{y}"
+    cached = redis.get(key)
+    if cached is not None:
+        return json.loads(cached)
+    west, south, east, north = tile_bbox(z, x, y)
+    clusters = schools_in_bbox(west, south, east, north, z)
+    redis.set(key, json.dumps(clusters), ex=TILE_EXPIRY)
+    return clusters
@@ -0,0 +1,131 @@
+import numpy as np
+
+from .model import get_collection_python
+from .indexmodel import SharedIndex
+from .mentorsearchmodel import FACETS, SUMMARY_FIELDS, facet_values
+
+# Mentor-mentee matching. Mentor attributes are one-hot encoded into a matrix with one
+# row per mentor and one column per (facet, value); a mentee's preferences become a
+# weighted query vector, so scoring every mentor is a single matrix-vector product.
+# Rows are updated in place when a mentor changes (see indexmodel.SharedIndex).
+
+INDEX_NAME = "mentor-matrix"
+# How much a full match on each facet counts towards the score.
+MATCH_WEIGHTS = {
+    "languages": 3.0,
+    "academics": 2.0,
+    "races": 1.0,
+    "religions": 1.0,
+    "gender": 1.0,
+}
+
+
+class MentorMatrix:
+    def __init__(self, capacity=64, width=64):
+        self.rows = {}  # mentor id -> row
+        self.mentors = []  # row -> summary dict (None when free)
+        self.free = []
+        self.columns = {}  # (facet, value) -> column
+        self.onehot = np.zeros((capacity, width), dtype=np.float32)
+        self.visible = np.zeros(capacity, dtype=bool)
+
+    def column(self, facet, value):
+        key = (facet, value)
+        if key not in self.columns:
+            width = self.onehot.shape[1]
+            if len(self.columns) == width:  # grow by doubling
+                self.onehot = np.pad(self.onehot, ((0, 0), (0, width)))
+            self.columns[key] = len(self.columns)
+        return self.columns[key]
+
+    def add(self, mentor_id, mentor):
+        row = self.rows.get(mentor_id)
+        if row is None:
+            row = self.free.pop() if self.free else len(self.mentors)
+            if row == len(self.mentors):
+                self.mentors.append(None)
+            capacity = self.onehot.shape[0]
+            if row == capacity:  # grow by doubling
+                self.onehot = np.pad(self.onehot, ((0, capacity), (0, 0)))
+                self.visible = np.pad(self.visible, (0, capacity))
+            self.rows[mentor_id] = row
+        cols = [self.column(f, v) for f in FACETS for v in facet_values(mentor, f)]
+        self.onehot[row] = 0
+        self.onehot[row, cols] = 1
+        self.visible[row] = mentor.get("show", True)
+        summary = {k: mentor[k] for k in SUMMARY_FIELDS if k in mentor}
+        summary["id"] = mentor_id
+        self.mentors[row] = summary
+
+    def remove(self, mentor_id):
+        row = self.rows.pop(mentor_id, None)
+        if row is None:
+            return
+        self.onehot[row] = 0
+        self.visible[row] = False
+        self.mentors[row] = None
+        self.free.append(row)
+
+    def set_visible(self, mentor_id, show):
+        row = self.rows.get(mentor_id)
+        if row is None:
+            return
+        self.visible[row] = show
+        self.mentors[row]["show"] = show
+
+    def match(self, preferences, weights=None, limit=10):
+        # preferences: {facet: [values]}. A mentor scores weight * (share of the
+        # preferred values they have) per facet; scores are scaled to 0 - 1.
+        weights = {**MATCH_WEIGHTS, **(weights or {})}
+        query = np.zeros(self.onehot.shape[1], dtype=np.float32)
+        max_score = 0.0
+        for facet, values in preferences.items():
+            if facet not in weights or not values:
+                continue
+            max_score += weights[facet]
+            cols = [self.columns[(facet, v)] for v in values if (facet, v) in self.columns]
+            query[cols] = weights[facet] / len(values)
+
+        scores = self.onehot @ query
+        if max_score > 0:
+            scores /= max_score
+        scores[~self.visible] = -1
+        k = min(limit, int(self.visible.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [
+            {**self.mentors[row], "score": round(float(scores[row]), 4)} for row in top
+        ]
+
+
+def build_mentor_matrix():
+    matrix = MentorMatrix()
+    for m in get_collection_python("Mentors"):
+        matrix.add(m["id"], m)
+    return matrix
+
+
+mentor_matrix = SharedIndex(INDEX_NAME, build_mentor_matrix)
+
+
+def rebuild_mentor_matrix():
+    matrix = mentor_matrix.rebuild()
+    return {"status": 0, "mentors": len(matrix.rows)}
+
+
+def update_mentor_matrix(mentor_id, mentor):
+    mentor_matrix.apply(lambda matrix: matrix.add(mentor_id, mentor))
+
+
+def remove_from_mentor_matrix(mentor_id):
+    mentor_matrix.apply(lambda matrix: matrix.remove(mentor_id))
+
+
+def set_mentor_matrix_visible(mentor_id, show):
+    mentor_matrix.apply(lambda matrix: matrix.set_visible(mentor_id, show))
+
+
+def match_mentors(preferences, weights=None, limit=10):
+    return mentor_matrix.read(lambda matrix: matrix.match(preferences, weights, limit))
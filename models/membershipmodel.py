@@ -0,0 +1,219 @@
+import time
+
+from firebase_admin import firestore
+
+from .model import db, get_el_id, get_collection_id, get_collection_python, forget
+from .redismodel import redis, add_redis_collection_id, scan_keys
+
+# Club membership graph in Redis, the source of truth for joining / leaving clubs:
+#   members:club:<club_id>   emails of the club's members
+#   members:user:<email>     ids of the clubs the user joined
+# Both sides change together in one atomic step, membership checks are SISMEMBER and
+# set questions ("members shared by these clubs") are SINTER. The Clubs members and
+# Users joined_clubs arrays in Firestore are updated afterwards in a background task.
+# Every toggled pair is also put in members:unsynced; the sync copies whatever Redis
+# says *now* (not the change the toggle made), so late, repeated or reordered syncs all
+# end in the same state, and a pair whose sync failed is retried by a later one.
+
+MEMBERSHIP_READY = "members:ready"
+UNSYNCED = "members:unsynced"  # "<club_id> <email>" pairs Firestore may not reflect yet
+SYNC_ATTEMPTS = 3
+SYNC_BATCH = 20  # unsynced pairs a background sync also picks up
+
+# Flip one membership on both sides atomically and mark the pair unsynced; returns 1 if
+# the user joined, 0 if they left.
+TOGGLE_SCRIPT = """
+redis.call('SADD', KEYS[3], ARGV[3])
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    redis.call('SREM', KEYS[1], ARGV[1])
+    redis.call('SREM', KEYS[2], ARGV[2])
+    return 0
+end
+redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('SADD', KEYS[2], ARGV[2])
+return 1
+"""
+
+
+def club_key(club_id):
+    return f"members:club:{club_id}"
+
+
+def user_key(email):
+    return f"members:user:{email}"
+
+
+def pair_key(email, club_id):
+    return f"{club_id} {email}"
+
+
+def rebuild_memberships():
+    # Full rebuild from the Firestore arrays (a membership recorded on either side counts).
+    try:
+        pairs = set()
+        for c in get_collection_python("Clubs"):
+            for email in c.get("members", []):
+                pairs.add((email, c["id"]))
+        for u in get_collection_python("Users"):
+            for club_id in u.get("joined_clubs", []):
+                pairs.add((u["email"], club_id))
+        old_keys = scan_keys("members:club:*") + scan_keys("members:user:*")
+        tx = redis.multi()
+        if len(old_keys) > 0:
+            tx.delete(*old_keys)
+        for email, club_id in pairs:
+            tx.sadd(club_key(club_id), email)
+            tx.sadd(user_key(email), club_id)
+        tx.set(MEMBERSHIP_READY, 1)
+        tx.exec()
+        return {"status": 0, "memberships": len(pairs)}
+    except Exception as e:
+        print(f"Failed to rebuild memberships: {e}")
+        return {"status": -1, "error_message": e}
+
+
+def ensure_memberships():
+    if not redis.exists(MEMBERSHIP_READY):
+        rebuild = rebuild_memberships()
+        if rebuild["status"] != 0:
+            raise Exception(rebuild["error_message"])
+
+
+def toggle_membership(email, club_id):
+    ensure_memberships()
+    joined = redis.eval(
+        TOGGLE_SCRIPT,
+        keys=[user_key(email), club_key(club_id), UNSYNCED],
+        args=[club_id, email, pair_key(email, club_id)],
+    )
+    return int(joined) == 1
+
+
+def add_membership(email, club_id):
+    tx = redis.multi()
+    tx.sadd(user_key(email), club_id)
+    tx.sadd(club_key(club_id), email)
+    tx.exec()
+
+
+def remove_membership(email, club_id):
+    tx = redis.multi()
+    tx.srem(user_key(email), club_id)
+    tx.srem(club_key(club_id), email)
+    tx.exec()
+
+
+def remove_club_memberships(club_id):
+    # Drops a deleted club from the graph; returns the emails that were members.
+    members = redis.smembers(club_key(club_id))
+    tx = redis.multi()
+    for email in members:
+        tx.srem(user_key(email), club_id)
+    tx.delete(club_key(club_id))
+    tx.exec()
+    return list(members)
+
+
+def remove_user_memberships(email):
+    # Drops a deleted user from the graph; returns the ids of the clubs they were in.
+    clubs = redis.smembers(user_key(email))
+    tx = redis.multi()
+    for club_id in clubs:
+        tx.srem(club_key(club_id), email)
+    tx.delete(user_key(email))
+    tx.exec()
+    return list(clubs)
+
+
+def is_member(email, club_id):
+    ensure_memberships()
+    return bool(redis.sismember(club_key(club_id), email))
+
+
+def club_members(club_id):
+    ensure_memberships()
+    return list(redis.smembers(club_key(club_id)))
+
+
+def user_clubs(email):
+    ensure_memberships()
+    return list(redis.smembers(user_key(email)))
+
+
+def shared_members(club_ids):
+    ensure_memberships()
+    if len(club_ids) == 0:
+        return []
+    return list(redis.sinter(*[club_key(c) for c in club_ids]))
+
+
+def write_membership(user_id, email, club_id, member):
+    # ArrayUnion / ArrayRemove, so there is no read-modify-write of the arrays.
+    change = firestore.ArrayUnion if member else firestore.ArrayRemove
+    batch = db.batch()
+    batch.update(
+        db.collection("Users").document(user_id), {"joined_clubs": change([club_id])}
+    )
+    batch.update(db.collection("Clubs").document(club_id), {"members": change([email])})
+    batch.commit()
+    forget("Users", user_id)
+    forget("Clubs", club_id)
+    coll_id = get_collection_id("Users", user_id)
+    add_redis_collection_id("Users", coll_id, user_id=user_id)
+    coll_id = get_collection_id("Clubs", club_id)
+    add_redis_collection_id("Clubs", coll_id, club_id=club_id)
+
+
+def sync_pair(email, club_id, user_id=None):
+    # Copies the current Redis state of one membership into Firestore. Returns False if
+    # another worker is syncing the same pair (it stays unsynced for a later sync).
+    lock = f"members:sync:{club_id}:{email}"
+    if not redis.set(lock, 1, nx=True, ex=60):
+        return False
+    try:
+        user_id = user_id or get_el_id("Users", email)
+        if user_id is None or not db.collection("Clubs").document(club_id).get().exists:
+            redis.srem(UNSYNCED, pair_key(email, club_id))  # deleted; cascade cleans up
+            return True
+        member = bool(redis.sismember(club_key(club_id), email))
+        while True:
+            write_membership(user_id, email, club_id, member)
+            # Cleared before re-checking: a toggle from here on marks the pair again.
+            redis.srem(UNSYNCED, pair_key(email, club_id))
+            now = bool(redis.sismember(club_key(club_id), email))
+            if now == member:
+                return True
+            member = now
+    finally:
+        redis.delete(lock)
+
+
+def sync_membership(email, club_id, user_id=None):
+    # Background step after toggle_membership. Retries with backoff; a pair that still
+    # fails stays in members:unsynced and is picked up by the next sync.
+    for attempt in range(SYNC_ATTEMPTS):
+        try:
+            sync_pair(email, club_id, user_id)
+            break
+        except Exception as e:
+            print(f"Failed to sync membership (attempt {attempt + 1}): {e}")
+            if attempt + 1 < SYNC_ATTEMPTS:
+                time.sleep(2**attempt)
+    sync_unsynced(SYNC_BATCH)
+
+
+def sync_unsynced(limit=None):
+    # Syncs pairs left behind by failed or skipped syncs.
+    synced, failed = 0, 0
+    if limit:
+        pairs = redis.srandmember(UNSYNCED, limit)
+    else:
+        pairs = redis.smembers(UNSYNCED)
+    for pair in pairs:
+        club_id, email = pair.split(" ", 1)
+        try:
+            synced += 1 if sync_pair(email, club_id) else 0
+        except Exception as e:
+            print(f"Failed to sync membership {pair}: {e}")
+            failed += 1
+    return {"status": 0, "synced": synced, "failed": failed}
@@ -1,11 +1,31 @@
 from urllib.parse import urlparse
-from uuid import uuid4
 
 from fastapi import File, UploadFile
-
-from .model import db, get_el_id, get_doc, storage, get_collection_id
+from firebase_admin import firestore
+from starlette.concurrency import run_in_threadpool
+
+from .model import db, get_el_id, get_doc, get_collection_id, forget
+from .uploadmodel import (
+    process_image_upload,
+    get_bucket,
+    rendition_folder,
+    is_content_addressed,
+    create_signed_upload,
+    finalize_signed_upload,
+    build_stored_renditions,
+)
 from .redismodel import add_redis_collection_id
 from .usermodel import change_user_role, change_is_mentor
+from .audiencemodel import add_mentor_audience, remove_mentor_audience
+from .pairingmodel import update_pairing, pending_entry
+from .ledgermodel import log_hours, confirm_hours, get_ledger_entry
+from .leaderboardmodel import record_confirmed_hours
+from .mentorsearchmodel import index_mentor, unindex_mentor, set_mentor_visible
+from .matchmodel import (
+    update_mentor_matrix,
+    remove_from_mentor_matrix,
+    set_mentor_matrix_visible,
+)
 
 
 def make_mentor(
@@ -15,24 +35,27 @@ def make_mentor(
     collection = "Mentors"
     print("make mentor begin")
     try:
-        result = db.collection(collection).add(
-            {
-                "firstname": firstname,
-                "lastname": lastname,
-                "bio": bio,
-                "email": email,
-                "races": race,
-                "religions": religion,
-                "gender": gender,
-                "languages": languages,
-                "academics": academics,
-                "profile_pic": "",
-                "show": True,
-                "total_hours_worked": 0,
-                "hours_worked_catalog": [],
-            }
-        )
+        mentor = {
+            "firstname": firstname,
+            "lastname": lastname,
+            "bio": bio,
+            "email": email,
+            "races": race,
+            "religions": religion,
+            "gender": gender,
+            "languages": languages,
+            "academics": academics,
+            "profile_pic": "",
+            "show": True,
+            "total_hours_worked": 0,
+            "hours_worked_catalog": [],
+        }
+        result = db.collection(collection).add(mentor)
         print(result)
+        forget(collection)
+        index_mentor(result[1].id, mentor)
+        update_mentor_matrix(result[1].id, mentor)
+        add_mentor_audience(email)
         mentor_role = get_doc("Users", get_el_id("Users", email))["role"]
         print(f"Mentor role: {mentor_role}")
         if mentor_role == "Member":
@@ -69,6 +92,10 @@ def change_mentor(
                 }
             )
         )
+        forget(collection, doc_id)
+        mentor = get_doc(collection, doc_id)
+        index_mentor(doc_id, mentor)
+        update_mentor_matrix(doc_id, mentor)
         return {"status": "Success"}
     except Exception as e:
         return {"status": f"Failed: {str(e)}"}
@@ -78,6 +105,10 @@ def remove_mentor(email):
     doc_id = get_el_id("Mentors", email)
     try:
         db.collection("Mentors").document(doc_id).delete()
+        forget("Mentors")
+        unindex_mentor(doc_id)
+        remove_from_mentor_matrix(doc_id)
+        remove_mentor_audience(email)
         return {"Status": "Successfully deleted mentor"}
     except Exception as e:
         return {"status": f"Failed to delete mentor: {e}"}
@@ -86,23 +117,10 @@ def remove_mentor(email):
 # Make function that deletes old mentor image (look on Google or chatgpt how to delete firebase storage images from a url)
 
 
-def upload_mentor_image(file: UploadFile = File(...)):
-    try:
-        # Generate a unique file name
-        file_name = f"{uuid4()}.jpg"
-        blob = storage.bucket().blob(f"mentor-images/{file_name}")
-
-        # Upload the image
-        blob.upload_from_file(file.file, content_type=file.content_type)
-        blob.make_public()
-
-        image_url = blob.public_url
-
-        print(f"Successfully uploaded image: {image_url}")
-        return image_url
-    except Exception as e:
-        print(f"Failed to upload img: {e}")
-        return "Failed"
+async def upload_mentor_image(file: UploadFile = File(...)):
+    # Streams the upload into mentor-images/ and builds its WebP renditions
+    # (see uploadmodel.process_image_upload).
+    return await process_image_upload(file, "mentor-images")
 
 
 def extract_relative_path(full_url):
@@ -128,26 +146,64 @@ def delete_mentor_image(file_name):
     print(f"new_file_name: {new_file_name}")
     # if file_path_or_url.startswith("http"):
     #     file_path_or_url = extract_relative_path(file_path_or_url)
+    if is_content_addressed(new_new_file_name):
+        # May be shared with other clubs / mentors; sweep_images() removes it once unused.
+        print(f"Leaving shared image for the sweeper: {file_name}")
+        return
     try:
-        blob = storage.bucket().blob(new_new_file_name)
-        print(blob)
-        blob.delete()
+        folder = rendition_folder(new_new_file_name)
+        if folder:  # Original + renditions live in one folder, delete all of them
+            get_bucket().delete_blobs(list(get_bucket().list_blobs(prefix=folder)))
+        else:
+            blob = get_bucket().blob(new_new_file_name)
+            print(blob)
+            blob.delete()
         print(f"Successfully deleted image: {file_name}")
     except Exception as e:
         print(f"Failed to delete image: {e}")
 
 
-def set_mentor_image_doc(mentor_email, img_url):
+def set_mentor_image_doc(mentor_email, img_url, renditions=None):
     mentor_id = get_el_id("Mentors", mentor_email)
     print(f"mentor id: {mentor_id}, email: {mentor_email}")
     try:
-        db.collection("Mentors").document(mentor_id).update({"profile_pic": img_url})
+        # {"thumb", "card", "full"} urls; a new image without renditions (yet) must not
+        # keep showing the previous image's.
+        update = {
+            "profile_pic": img_url,
+            "profile_pic_renditions": renditions or firestore.DELETE_FIELD,
+        }
+        db.collection("Mentors").document(mentor_id).update(update)
+        forget("Mentors", mentor_id)
+        mentor = get_doc("Mentors", mentor_id)
+        index_mentor(mentor_id, mentor)
+        update_mentor_matrix(mentor_id, mentor)
         return {"status": "Successfully updated mentor img doc"}
     except Exception as e:
         print(f"Failed to update mentor img doc: {e}")
         return {"status": f"Failed to update mentor img doc: {e}"}
 
 
+def create_mentor_image_upload(content_type, sha256=None):
+    return create_signed_upload("mentor-images", content_type, sha256)
+
+
+def finalize_mentor_image(blob_name):
+    return finalize_signed_upload("mentor-images", blob_name)
+
+
+async def add_mentor_image_renditions(mentor_email, blob_name):
+    # Background step after /finalizementorimage/: swap profile_pic to the card rendition.
+    try:
+        urls = await build_stored_renditions(blob_name)
+        await run_in_threadpool(set_mentor_image_doc, mentor_email, urls["card"], urls)
+        mentor_id = get_el_id("Mentors", mentor_email)
+        coll_id = get_collection_id("Mentors", mentor_id)
+        add_redis_collection_id("Mentors", coll_id, mentor_id=mentor_id)
+    except Exception as e:
+        print(f"Failed to add mentor image renditions: {e}")
+
+
 def show_or_hide_mentor(mentor_email):
     doc_id = get_el_id("Mentors", mentor_email)
     mentor = get_doc("Mentors", doc_id)
@@ -155,6 +211,9 @@ def show_or_hide_mentor(mentor_email):
     # print(not toggle)
     try:
         db.collection("Mentors").document(doc_id).update({"show": toggle})
+        forget("Mentors", doc_id)
+        set_mentor_visible(doc_id, toggle)
+        set_mentor_matrix_visible(doc_id, toggle)
         mentor_id = get_el_id("Mentors", mentor["email"])
         coll_id = get_collection_id("Mentors", mentor_id)
         add_redis_collection_id("Mentors", coll_id, mentor_id=mentor_id)
@@ -173,6 +232,7 @@ def update_mentor_hours(mentor_email, hours):
         db.collection("Mentors").document(doc_id).update(
             {"total_hours_worked": new_hours}
         )
+        forget("Mentors", doc_id)
         return {"status": "Success"}
     except Exception as e:
         print(f"Failed to update mentor hours: {e}")
@@ -191,20 +251,54 @@ def update_hours_worked_catalog(
         "status": status,
     }
     doc_id = get_el_id("Mentors", mentor_email)
-    mentor = get_doc("Mentors", doc_id)
-    whole_catalog = mentor["hours_worked_catalog"]
-    whole_catalog.append(new_catalog)
     try:
-        db.collection("Mentors").document(doc_id).update(
-            {"hours_worked_catalog": whole_catalog}
+        # One HoursLedger document per log instead of rewriting hours_worked_catalog.
+        log_hours(
+            catalog_id,
+            doc_id,
+            mentor_email,
+            mentee_email,
+            description,
+            hours_worked,
+            date,
         )
+        update_pairing(catalog_id, pending_entry(mentor_email, new_catalog))
         return {"status": "Success"}
     except Exception as e:
         print(f"Failed to update mentor hours: {e}")
         return {"status": f"Failed to update mentor hours: {e}"}
 
 
-def confirm_mentor_mentee_logging(catalog_id, mentee_email, mentor_email, mentee_hours):
+def confirm_mentor_mentee_logging(
+    catalog_id,
+    mentee_email,
+    mentor_email,
+    mentee_hours,
+    mentee_description=None,
+    date_confirmed=None,
+):
+    try:
+        if get_ledger_entry(catalog_id) is not None:
+            log_status = confirm_hours(
+                catalog_id, mentee_email, mentee_hours, mentee_description, date_confirmed
+            )
+            if log_status["status"] == 0:
+                h = log_status["mentor_log"]
+                update_pairing(
+                    catalog_id,
+                    {
+                        "mentee": mentee_email,
+                        "mentor": mentor_email,
+                        "mentor_description": h["description"],
+                        "hours": h["hours"],
+                        "date_met": h["date"],
+                    },
+                )
+                record_confirmed_hours(mentor_email, mentee_hours, h["date"])
+            return log_status
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+    # Logs made before the ledger still live in hours_worked_catalog:
     mentor_id = get_el_id("Mentors", mentor_email)
     mentor = get_doc("Mentors", mentor_id)
     # mentee = get_doc("Users", mentee_id)
@@ -229,9 +323,21 @@ def confirm_mentor_mentee_logging(catalog_id, mentee_email, mentor_email, mentee
                     db.collection("Mentors").document(mentor_id).update(
                         {"hours_worked_catalog": catalog}
                     )
+                    forget("Mentors", mentor_id)
                     print("updated collection")
+                    update_pairing(
+                        catalog_id,
+                        {
+                            "mentee": mentee_email,
+                            "mentor": mentor_email,
+                            "mentor_description": h["description"],
+                            "hours": h["hours"],
+                            "date_met": h["date"],
+                        },
+                    )
                     # Only updates the mentor hours once the mentee has confirmed.
                     update_mentor_hours(mentor_email, mentee_hours)
+                    record_confirmed_hours(mentor_email, mentee_hours, h["date"])
                     print("updated mentor hours")
                     return {"status": 0, "mentor_log": h}
                 else:
@@ -246,6 +352,9 @@ def confirm_mentor_mentee_logging(catalog_id, mentee_email, mentor_email, mentee
 
 
 def get_mentor_description(mentor_email, target_catalog_id):
+    entry = get_ledger_entry(target_catalog_id)
+    if entry is not None:
+        return {"status": 0, "desc": entry["description"]}
     mentor_id = get_el_id("Mentors", mentor_email)
     mentor = get_doc("Mentors", mentor_id)
     catalog = mentor["hours_worked_catalog"]
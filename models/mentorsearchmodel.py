@@ -0,0 +1,166 @@
+from .model import get_collection_python
+from .indexmodel import SharedIndex
+
+# In-process inverted index for /mentors/search. Every mentor gets a bit position and
+# each facet value keeps an int bitmap of the mentors that have it, so a filter is a few
+# big-int ANDs / ORs and a facet count is a popcount. The index lives in memory on each
+# instance and is kept in step with the other instances by indexmodel.SharedIndex.
+
+FACETS = ["races", "religions", "gender", "languages", "academics"]
+INDEX_NAME = "mentors"
+MAX_SEARCH_RESULTS = 100  # mentors per page
+# Returned for each hit (the hours catalog can be long and is not needed to browse).
+SUMMARY_FIELDS = [
+    "firstname",
+    "lastname",
+    "bio",
+    "email",
+    "profile_pic",
+    "profile_pic_renditions",
+    "show",
+] + FACETS
+
+
+def bits_of(bitmap):
+    while bitmap:
+        low = bitmap & -bitmap
+        yield low.bit_length() - 1
+        bitmap ^= low
+
+
+def facet_values(mentor, facet):
+    values = mentor.get(facet) or []
+    if isinstance(values, str):  # gender is sometimes stored as a plain string
+        values = [values]
+    return values
+
+
+class MentorIndex:
+    def __init__(self):
+        self.slots = {}  # mentor id -> bit position
+        self.mentors = []  # bit position -> summary dict (None when free)
+        self.free = []
+        self.postings = {f: {} for f in FACETS}  # facet -> value -> bitmap
+        self.visible = 0  # bitmap of mentors with show == True
+
+    def add(self, mentor_id, mentor):
+        self.remove(mentor_id)
+        slot = self.free.pop() if self.free else len(self.mentors)
+        if slot == len(self.mentors):
+            self.mentors.append(None)
+        bit = 1 << slot
+        summary = {k: mentor[k] for k in SUMMARY_FIELDS if k in mentor}
+        summary["id"] = mentor_id
+        self.slots[mentor_id] = slot
+        self.mentors[slot] = summary
+        for facet in FACETS:
+            postings = self.postings[facet]
+            for value in facet_values(mentor, facet):
+                postings[value] = postings.get(value, 0) | bit
+        if mentor.get("show", True):
+            self.visible |= bit
+
+    def remove(self, mentor_id):
+        slot = self.slots.pop(mentor_id, None)
+        if slot is None:
+            return
+        mentor = self.mentors[slot]
+        mask = ~(1 << slot)
+        for facet in FACETS:
+            postings = self.postings[facet]
+            for value in facet_values(mentor, facet):
+                postings[value] = postings.get(value, 0) & mask
+                if postings[value] == 0:
+                    del postings[value]
+        self.visible &= mask
+        self.mentors[slot] = None
+        self.free.append(slot)
+
+    def set_visible(self, mentor_id, show):
+        slot = self.slots.get(mentor_id)
+        if slot is None:
+            return
+        self.mentors[slot]["show"] = show
+        if show:
+            self.visible |= 1 << slot
+        else:
+            self.visible &= ~(1 << slot)
+
+    def facet_match(self, facet, values, match):
+        postings = self.postings[facet]
+        if match == "all":
+            result = self.visible
+            for v in values:
+                result &= postings.get(v, 0)
+            return result
+        result = 0
+        for v in values:
+            result |= postings.get(v, 0)
+        return result
+
+    def search(self, filters, match="any", limit=20, offset=0):
+        # filters: {facet: [values]}. Facets are always ANDed together; the values of
+        # one facet are ORed (match="any") or ANDed (match="all").
+        matches = {
+            f: self.facet_match(f, values, match)
+            for f, values in filters.items()
+            if f in self.postings and values
+        }
+        result = self.visible
+        for bitmap in matches.values():
+            result &= bitmap
+
+        # Counts for each facet ignore that facet's own filter, so the frontend can show
+        # how many mentors each extra choice would add.
+        facets = {}
+        for facet, postings in self.postings.items():
+            base = self.visible
+            for f, bitmap in matches.items():
+                if f != facet:
+                    base &= bitmap
+            counts = {v: (base & b).bit_count() for v, b in postings.items()}
+            facets[facet] = {v: n for v, n in counts.items() if n > 0}
+
+        hits = [self.mentors[slot] for slot in bits_of(result)]
+        hits.sort(key=lambda m: (m.get("lastname", ""), m.get("firstname", "")))
+        return {
+            "total": result.bit_count(),
+            "mentors": hits[offset : offset + limit],
+            "facets": facets,
+        }
+
+
+def build_mentor_index():
+    index = MentorIndex()
+    for m in get_collection_python("Mentors"):
+        index.add(m["id"], m)
+    return index
+
+
+mentor_index = SharedIndex(INDEX_NAME, build_mentor_index)
+
+
+def rebuild_mentor_index():
+    index = mentor_index.rebuild()
+    return {"status": 0, "mentors": len(index.slots)}
+
+
+def index_mentor(mentor_id, mentor):
+    mentor_index.apply(lambda index: index.add(mentor_id, mentor))
+
+
+def unindex_mentor(mentor_id):
+    mentor_index.apply(lambda index: index.remove(mentor_id))
+
+
+def set_mentor_visible(mentor_id, show):
+    mentor_index.apply(lambda index: index.set_visible(mentor_id, show))
+
+
+def search_mentors(filters, match="any", limit=20, offset=0):
+    # limit must be 1..MAX_SEARCH_RESULTS (negative values would slice from the end).
+    if not 1 <= limit <= MAX_SEARCH_RESULTS or offset < 0:
+        raise ValueError(
+            f"limit must be between 1 and {MAX_SEARCH_RESULTS} and offset at least 0"
+        )
+    return mentor_index.read(lambda index: index.search(filters, match, limit, offset))
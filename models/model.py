@@ -1,4 +1,6 @@
 import firebase_admin, json, os
+import copy
+from contextvars import ContextVar
 from firebase_admin import credentials, storage, auth
 from firebase_admin import firestore
 from dotenv import load_dotenv
@@ -30,47 +32,107 @@ redis = Redis(
 )
 
 
+# Per-request identity map. main.py opens a unit of work for every HTTP request; inside
+# it, get_el_id builds one {key: doc id} map per collection from a single scan and the
+# documents it reads (and those read by get_doc / get_collection_id) are memoized, so a
+# request that looks up the same mentor five times only hits Firestore once. Write
+# paths call forget() so later reads in the same request see the new data. Outside a
+# unit of work (scripts, background jobs) every call goes straight to Firestore.
+
+EL_ID_FIELDS = {
+    "Clubs": "secret_password",
+    "Users": "email",
+    "Mentors": "email",
+    "Opportunities": "name",
+}
+
+_unit_of_work = ContextVar("unit_of_work", default=None)
+
+
+class UnitOfWork:
+    def __init__(self):
+        self.ids = {}  # collection -> {key field value: doc id}
+        self.docs = {}  # (collection, doc id) -> document dict
+        self.open = True
+
+
+def begin_unit_of_work():
+    return _unit_of_work.set(UnitOfWork())
+
+
+def end_unit_of_work(token):
+    # Background tasks scheduled by the request share its context, so close the map
+    # instead of only resetting the variable; they then read Firestore directly.
+    uow = _unit_of_work.get()
+    if uow is not None:
+        uow.open = False
+        uow.ids.clear()
+        uow.docs.clear()
+    _unit_of_work.reset(token)
+
+
+def current_unit_of_work():
+    uow = _unit_of_work.get()
+    if uow is not None and uow.open:
+        return uow
+    return None
+
+
+def forget(collection, ident=None):
+    # Call after writing: drops one memoized document, or the whole collection (and its
+    # id map) when ident is None, e.g. after adding or deleting documents.
+    uow = current_unit_of_work()
+    if uow is None:
+        return
+    if ident is not None:
+        uow.docs.pop((collection, ident), None)
+        return
+    uow.ids.pop(collection, None)
+    for key in [k for k in uow.docs if k[0] == collection]:
+        del uow.docs[key]
+
+
+def scan_el_ids(collection):
+    field = EL_ID_FIELDS[collection]
+    ids = {}
+    docs = {}
+    for doc in db.collection(collection).get():
+        doc_dict = doc.to_dict()
+        docs[doc.id] = doc_dict
+        ids.setdefault(doc_dict.get(field), doc.id)  # first match wins, as before
+    return ids, docs
+
+
 def get_el_id(collection, target):
     # target is club_name (Clubs) or email (Users & Mentors)
-
-    if collection == "Clubs":
-        collection = db.collection(collection)
-        docs = collection.get()
-        results = []
-        for doc in docs:
-            doc_dict = doc.to_dict()
-            doc_dict["id"] = doc.id
-            results.append(doc_dict)
-        for r in results:
-            if r["secret_password"] == target:
-                return r["id"]
-    elif collection == "Users" or collection == "Mentors":
-        collection = db.collection(collection)
-        docs = collection.get()
-        results = []
-        for doc in docs:
-            doc_dict = doc.to_dict()
-            doc_dict["id"] = doc.id
-            results.append(doc_dict)
-        for r in results:
-            if r["email"] == target:
-                return r["id"]
-    elif collection == "Opportunities":
-        collection = db.collection(collection)
-        docs = collection.get()
-        results = []
-        for doc in docs:
-            doc_dict = doc.to_dict()
-            doc_dict["id"] = doc.id
-            results.append(doc_dict)
-        for r in results:
-            if r["name"] == target:
-                return r["id"]
+    if collection not in EL_ID_FIELDS:
+        return None
+    uow = current_unit_of_work()
+    if uow is None:
+        ids, _ = scan_el_ids(collection)
+        return ids.get(target)
+    if collection not in uow.ids:
+        ids, docs = scan_el_ids(collection)
+        uow.ids[collection] = ids
+        for doc_id, doc_dict in docs.items():
+            uow.docs[(collection, doc_id)] = doc_dict
+    return uow.ids[collection].get(target)
+
+
+def read_doc(collection, ident):
+    uow = current_unit_of_work()
+    if uow is None:
+        return db.collection(collection).document(ident).get().to_dict()
+    key = (collection, ident)
+    if key not in uow.docs:
+        uow.docs[key] = db.collection(collection).document(ident).get().to_dict()
+    # Callers mutate what they get back before writing it, so hand out copies.
+    return copy.deepcopy(uow.docs[key])
 
 
 def get_collection_id(collection, ident):
     try:
-        result = db.collection(collection).document(ident).get().to_dict()
+        result = read_doc(collection, ident)
         return result
     except Exception as e:
         return {"status": f"Failed: {str(e)}"}
@@ -125,6 +187,7 @@ def get_sub_collection(collection, ident, subcollection):
 def remove_id(collection, ident):
     try:
         db.collection(collection).document(ident).delete()
+        forget(collection)
         return {"status": "Success"}
     except Exception as e:
         return {"status": f"Failed: {str(e)}"}
@@ -132,7 +195,7 @@ def remove_id(collection, ident):
 
 def get_doc(collection, doc):
     try:
-        result = db.collection(collection).document(doc).get().to_dict()
+        result = read_doc(collection, doc)
         return result
     except Exception as e:
         return {"status": f"Failed: {str(e)}"}
@@ -1,23 +1,79 @@
+import json
+
 from .model import (
     db,
     get_el_id,
+    get_doc,
     get_collection_id,
     get_collection_python,
+    forget,
+)
+from .redismodel import redis, PATCH_CACHED_SCRIPT, patch_args
+from .deadlinemodel import (
+    parse_deadline,
+    reindex_link,
+    unindex_link,
+    index_deadline,
+    unindex_deadline,
 )
 
+CATEGORY_BATCH_SIZE = 400  # links per WriteBatch (Firestore allows 500 writes)
+
+
+def rewrite_category(old_cat_name, new_cat_name=None):
+    # Renames old_cat_name to new_cat_name (or removes it when new_cat_name is None) on
+    # every link that has it. Only the matching links are read (array_contains query),
+    # they are written in WriteBatch chunks, and their cached Opportunities entries (if
+    # the hash is cached) and deadline index entries are patched in the same pass. Returns the number of links changed.
+    if old_cat_name == new_cat_name:
+        return 0
+    query = db.collection("Opportunities").where(
+        "categories", "array_contains", old_cat_name
+    )
+    changed = 0
+    while True:
+        # Rewritten links no longer match, so each pass gets the next chunk.
+        snapshots = list(query.limit(CATEGORY_BATCH_SIZE).stream())
+        if len(snapshots) == 0:
+            return changed
+        batch = db.batch()
+        tx = redis.multi()
+        cached = {}
+        for snap in snapshots:
+            link = snap.to_dict()
+            categories = []
+            for c in link["categories"]:
+                c = new_cat_name if c == old_cat_name else c
+                if c is not None and c not in categories:
+                    categories.append(c)
+            batch.update(snap.reference, {"categories": categories})
+            unindex_deadline(tx, snap.id, link["categories"])
+            index_deadline(tx, snap.id, link.get("deadline_ts"), categories)
+            link["categories"] = categories
+            link["id"] = snap.id
+            cached[snap.id] = json.dumps(link)
+        batch.commit()
+        for snap in snapshots:
+            forget("Opportunities", snap.id)
+        tx.eval(PATCH_CACHED_SCRIPT, keys=["Opportunities"], args=patch_args(cached))
+        tx.exec()
+        changed += len(snapshots)
+
 
 def create_link(link_name, link_url, categories, bio, deadline):
     collection = "Opportunities"
     try:
-        db.collection(collection).add(
-            {
-                "name": link_name,
-                "src": link_url,
-                "categories": categories,
-                "bio": bio,
-                "deadline": deadline,
-            }
-        )
+        link = {
+            "name": link_name,
+            "src": link_url,
+            "categories": categories,
+            "bio": bio,
+            "deadline": deadline,
+            "deadline_ts": parse_deadline(deadline),
+        }
+        result = db.collection(collection).add(link)
+        forget(collection)
+        reindex_link(result[1].id, link)
         return {"status": "Success"}
     except Exception as e:
         return {"status": f"Failed: {str(e)}"}
@@ -26,7 +82,10 @@ def create_link(link_name, link_url, categories, bio, deadline):
 def remove_link(name):
     doc_id = get_el_id("Opportunities", name)
     try:
+        categories = get_doc("Opportunities", doc_id).get("categories")
         db.collection("Opportunities").document(doc_id).delete()
+        forget("Opportunities")
+        unindex_link(doc_id, categories)
         return {"Status": "Successfully removed link"}
     except Exception as e:
         return {"status": f"Failed to remove link: {e}"}
@@ -39,15 +98,18 @@ def update_link(oldname, newname, newurl, categories, bio, deadline):
     except Exception as e:
         return {"status": "Failed to find doc_id"}
     try:
-        db.collection(collection).document(doc_id).update(
-            {
-                "name": newname,
-                "src": newurl,
-                "categories": categories,
-                "bio": bio,
-                "deadline": deadline,
-            }
-        )
+        old_categories = get_doc(collection, doc_id).get("categories")
+        link = {
+            "name": newname,
+            "src": newurl,
+            "categories": categories,
+            "bio": bio,
+            "deadline": deadline,
+            "deadline_ts": parse_deadline(deadline),
+        }
+        db.collection(collection).document(doc_id).update(link)
+        forget(collection)  # the name (lookup key) may have changed
+        reindex_link(doc_id, link, old_categories)
         return {"status": "Successfully updated link"}
     except Exception as e:
         return {"status": f"Failed: {str(e)}"}
@@ -63,6 +125,9 @@ def update_category(old_cat_name, new_cat_name):
 
     try:
         db.collection(collection).document(doc_id).update({"categories": all_cats})
+        forget(collection, doc_id)
+        # Rename it on the links that use it too:
+        rewrite_category(old_cat_name, new_cat_name)
         return {"status": "Successfully edited category"}
     except Exception as e:
         return {"status": f"Failed to edit category: {e}"}
@@ -75,6 +140,7 @@ def create_category(cat_name):
     all_cats.append(cat_name)
     try:
         db.collection(collection).document(doc_id).update({"categories": all_cats})
+        forget(collection, doc_id)
         return {"status": "Successfully created category"}
     except Exception as e:
         return {"status": f"Failed to create category: {e}"}
@@ -87,16 +153,10 @@ def delete_category(cat_name):
     all_cats.remove(cat_name)
     try:
         db.collection(collection).document(doc_id).update({"categories": all_cats})
+        forget(collection, doc_id)
         # successfully deleted category by here When deleting category, also have to remove this category from all
         # the opportunity links who have this category listed:
-        opportunity = get_collection_python("Opportunities")
-        for o in opportunity:
-            if cat_name in o["categories"]:
-                curr_cats = o["categories"]
-                curr_cats.remove(cat_name)
-                db.collection("Opportunities").document(o["id"]).update(
-                    {"categories": curr_cats}
-                )
+        rewrite_category(cat_name)
         return {"status": "Successfully deleted category"}
     except Exception as e:
         return {"status": f"Failed to delete category: {e}"}
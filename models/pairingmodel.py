@@ -0,0 +1,120 @@
+import json
+
+from .model import get_collection_python
+from .ledgermodel import LEDGER
+from .redismodel import redis
+
+# Materialized mentor-mentee pairings for /getmentees (the admin hours page), stored as a
+# Redis hash of catalog_id -> pairing entry. Entries are written when a mentor logs hours
+# (pending) and patched when the mentee confirms, so the page never recomputes the join.
+# rebuild_pairings() recomputes everything from Firestore with a hash join on catalog id.
+
+PAIRINGS = "pairings"
+PAIRINGS_READY = "pairings:ready"
+
+
+def pending_entry(mentor_email, catalog):
+    return {
+        "mentee": catalog["mentee"],
+        "mentor": mentor_email,
+        "mentee_description": "N/A",
+        "mentor_description": catalog["description"],
+        "hours": catalog["hours"],
+        "date_confirmed": "N/A",
+        "date_met": catalog["date"],
+    }
+
+
+def confirmed_entry(mentee_email, mentor_email, log, catalog):
+    return {
+        "mentee": mentee_email,
+        "mentor": mentor_email,
+        "mentee_description": log["description"],
+        "mentor_description": catalog["description"],
+        "hours": catalog["hours"],
+        "date_confirmed": log["date_confirmed"],
+        "date_met": log["date_met"],
+    }
+
+
+def ledger_pairing(e):
+    if e["status"] == 0:
+        return {
+            "mentee": e["mentee"],
+            "mentor": e["mentor"],
+            "mentee_description": e["mentee_description"] or "N/A",
+            "mentor_description": e["description"],
+            "hours": e["hours"],
+            "date_confirmed": e["date_confirmed"] or "N/A",
+            "date_met": e["date"],
+        }
+    return pending_entry(e["mentor"], e)
+
+
+def join_pairings(mentors, mentees):
+    # Index every mentee log by catalog id once, then probe it for each mentor catalog
+    # entry: O(logs + catalog entries) instead of comparing every pair.
+    logs_by_id = {}
+    for mentee in mentees:
+        for l in mentee["mentee_logs"]:
+            logs_by_id.setdefault(l["id"], []).append((mentee["email"], l))
+
+    pairings = {}
+    for m in mentors:
+        for c in m["hours_worked_catalog"]:
+            if c["status"] == 0:
+                for mentee_email, l in logs_by_id.get(c["id"], []):
+                    pairings[c["id"]] = confirmed_entry(mentee_email, m["email"], l, c)
+            elif c["status"] == -1:
+                pairings[c["id"]] = pending_entry(m["email"], c)
+    return pairings
+
+
+def ordered(pairings):
+    # Hash order is arbitrary: list by mentor, then date met (catalog id breaks ties).
+    def key(k):
+        p = pairings[k]
+        return (p.get("mentor") or "", str(p.get("date_met")), k)
+
+    return [pairings[k] for k in sorted(pairings, key=key)]
+
+
+def rebuild_pairings():
+    try:
+        mentors = get_collection_python("Mentors")
+        mentees = [u for u in get_collection_python("Users") if u["is_mentee"]]
+        pairings = join_pairings(mentors, mentees)
+        for e in get_collection_python(LEDGER):
+            pairings[e["id"]] = ledger_pairing(e)
+        tx = redis.multi()
+        tx.delete(PAIRINGS)
+        if len(pairings) > 0:
+            tx.hset(PAIRINGS, values={k: json.dumps(v) for k, v in pairings.items()})
+        tx.set(PAIRINGS_READY, 1)
+        tx.exec()
+        return {"status": 0, "pairings": ordered(pairings)}
+    except Exception as e:
+        print(f"Failed to rebuild pairings: {e}")
+        return {"status": -1, "error_message": e}
+
+
+def get_pairings():
+    if not redis.exists(PAIRINGS_READY):
+        rebuilt = rebuild_pairings()
+        if rebuilt["status"] != 0:
+            raise Exception(rebuilt["error_message"])
+        return rebuilt["pairings"]
+    return ordered({k: json.loads(v) for k, v in (redis.hgetall(PAIRINGS) or {}).items()})
+
+
+def update_pairing(catalog_id, fields):
+    # Merge fields into one pairing entry (creating it if needed).
+    try:
+        raw = redis.hget(PAIRINGS, catalog_id)
+        entry = json.loads(raw) if raw else {}
+        entry.update(fields)
+        redis.hset(PAIRINGS, catalog_id, json.dumps(entry))
+        return {"status": 0}
+    except Exception as e:
+        print(f"Failed to update pairing: {e}")
+        return {"status": -1, "error_message": e}
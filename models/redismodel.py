@@ -8,6 +8,37 @@ load_dotenv()
 redis = Redis(url=os.environ.get("REDIS_URL"), token=os.environ.get("REDIS_TOKEN"))
 
 
+# Patches fields of a cached collection hash only if it is cached at all; an evicted
+# hash must not come back holding just the documents that were patched, since
+# /read/{collection} would serve those as the whole collection.
+PATCH_CACHED_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HSET', KEYS[1], unpack(ARGV))
+end
+return 0
+"""
+
+
+def patch_args(values):
+    # {field: value} -> [field, value, field, value, ...] for PATCH_CACHED_SCRIPT
+    return [v for pair in values.items() for v in pair]
+
+
+def patch_cached(collection, values):
+    redis.eval(PATCH_CACHED_SCRIPT, keys=[collection], args=patch_args(values))
+
+
+def scan_keys(pattern, count=500):
+    # Keys matching pattern, read with SCAN pages instead of one blocking KEYS.
+    keys = []
+    cursor = 0
+    while True:
+        cursor, page = redis.scan(cursor, match=pattern, count=count)
+        keys.extend(page)
+        if int(cursor) == 0:
+            return keys
+
+
 def format_json(docs):
     results = []
     for key, value in docs.items():
@@ -179,3 +210,14 @@ def delete_redis_id(collection, delete_id):
             "status": -1,
             "error_message": f"Failed to delete redis collection id: {e}",
         }
+
+
+# Version counters for the in-process search indexes. Every write bumps the index's
+# version; an instance whose copy was built at an older version rebuilds it, so
+# serverless instances that did not see the write still converge.
+def get_index_version(name):
+    return int(redis.get(f"index:{name}:version") or 0)
+
+
+def bump_index_version(name):
+    return redis.incr(f"index:{name}:version")
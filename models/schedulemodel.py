@@ -0,0 +1,157 @@
+import re
+from bisect import bisect_left, insort
+
+from .model import get_collection_python
+from .indexmodel import SharedIndex
+
+# Meeting-schedule index for approved clubs: club_days and start_time are parsed once
+# into per-day lists of (start, end, club id) sorted by start (minutes after midnight),
+# so "clubs on Tuesday after 15:00" is a bisect and overlap checks are a sweep. Clubs
+# only store a start time, so every meeting is assumed to last MEETING_MINUTES. Kept in
+# step with the other instances by indexmodel.SharedIndex.
+
+INDEX_NAME = "club-schedule"
+MEETING_MINUTES = 60
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+SUMMARY_FIELDS = ["club_name", "club_days", "start_time", "room_number"]
+
+
+def parse_day(day):
+    # "Tuesday", "tues", "TUE" -> "Tuesday"
+    prefix = str(day).strip().lower()[:3]
+    if len(prefix) < 3:
+        return None
+    for d in DAYS:
+        if d.lower().startswith(prefix):
+            return d
+    return None
+
+
+def parse_time(text):
+    # "15:00", "3:00 PM", "3pm", "3:30p.m." -> minutes after midnight (None if unparsable)
+    match = re.match(
+        r"^\s*(\d{1,2})(?::(\d{2}))?\s*([ap])?\.?m?\.?\s*$", str(text).lower()
+    )
+    if not match:
+        return None
+    hour, minute, half = int(match.group(1)), int(match.group(2) or 0), match.group(3)
+    if half == "p" and hour < 12:
+        hour += 12
+    elif half == "a" and hour == 12:
+        hour = 0
+    if hour > 23 or minute > 59:
+        return None
+    return hour * 60 + minute
+
+
+def format_time(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class ScheduleIndex:
+    def __init__(self):
+        self.days = {d: [] for d in DAYS}  # day -> sorted [(start, end, club id)]
+        self.slots = {}  # club id -> [(day, start, end)]
+        self.clubs = {}  # club id -> summary dict
+
+    def add(self, club_id, club):
+        self.remove(club_id)
+        start = parse_time(club.get("start_time", ""))
+        if club.get("status") != "Approved" or start is None:
+            return
+        end = start + MEETING_MINUTES
+        days = {parse_day(d) for d in club.get("club_days") or []} - {None}
+        if not days:
+            return
+        summary = {k: club[k] for k in SUMMARY_FIELDS if k in club}
+        summary["id"] = club_id
+        self.clubs[club_id] = summary
+        self.slots[club_id] = []
+        for day in days:
+            insort(self.days[day], (start, end, club_id))
+            self.slots[club_id].append((day, start, end))
+
+    def remove(self, club_id):
+        for day, start, end in self.slots.pop(club_id, []):
+            meetings = self.days[day]
+            del meetings[bisect_left(meetings, (start, end, club_id))]
+        self.clubs.pop(club_id, None)
+
+    def meeting(self, day, start, end, club_id):
+        return {
+            **self.clubs[club_id],
+            "day": day,
+            "start": format_time(start),
+            "end": format_time(end),
+        }
+
+    def on_day(self, day, after=0, before=24 * 60):
+        # Meetings on day that start at or after `after` and before `before`.
+        meetings = self.days[day]
+        i = bisect_left(meetings, (after,))
+        results = []
+        while i < len(meetings) and meetings[i][0] < before:
+            start, end, club_id = meetings[i]
+            results.append(self.meeting(day, start, end, club_id))
+            i += 1
+        return results
+
+    def conflicts(self, club_ids):
+        # Pairs of the given clubs whose meetings overlap on the same day.
+        wanted = set(club_ids)
+        results = []
+        for day, meetings in self.days.items():
+            active = []  # meetings still running at the current start, sweep by start
+            for start, end, club_id in meetings:
+                if club_id not in wanted:
+                    continue
+                active = [m for m in active if m[1] > start]
+                for other_start, other_end, other_id in active:
+                    results.append(
+                        {
+                            "day": day,
+                            "clubs": [
+                                self.meeting(day, other_start, other_end, other_id),
+                                self.meeting(day, start, end, club_id),
+                            ],
+                        }
+                    )
+                active.append((start, end, club_id))
+        return results
+
+
+def build_schedule_index():
+    index = ScheduleIndex()
+    for c in get_collection_python("Clubs"):
+        index.add(c["id"], c)
+    return index
+
+
+schedule_index = SharedIndex(INDEX_NAME, build_schedule_index)
+
+
+def rebuild_schedule_index():
+    index = schedule_index.rebuild()
+    return {"status": 0, "clubs": len(index.clubs)}
+
+
+def schedule_club(club_id, club):
+    schedule_index.apply(lambda index: index.add(club_id, club))
+
+
+def unschedule_club(club_id):
+    schedule_index.apply(lambda index: index.remove(club_id))
+
+
+def get_schedule(day, after=None, before=None):
+    # Returns None for an unknown day or time.
+    day = parse_day(day)
+    after = parse_time(after) if after else 0
+    before = parse_time(before) if before else 24 * 60
+    if day is None or after is None or before is None:
+        return None
+    return schedule_index.read(lambda index: index.on_day(day, after, before))
+
+
+def get_conflicts(club_ids):
+    return schedule_index.read(lambda index: index.conflicts(club_ids))
@@ -0,0 +1,432 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import timedelta
+from urllib.parse import urlparse, unquote
+from uuid import uuid4
+
+from fastapi import UploadFile
+from google.api_core import exceptions
+from starlette.concurrency import run_in_threadpool
+
+from .model import storage, get_collection_python
+from .imagemodel import build_renditions, store_renditions
+from .redismodel import redis
+
+# Upload pipeline for club and mentor images. Oversized requests are refused from their
+# Content-Length before the multipart body is read (see limit_upload_size in main.py).
+# The spooled file is then read in chunks and written straight into a resumable Cloud
+# Storage upload, so an image is never held in memory whole and the event loop is never
+# blocked on the network. The type is checked from the file's magic bytes (the
+# Content-Type header is whatever the client says), the size cap is enforced again while
+# streaming, and a semaphore limits concurrent uploads.
+
+CHUNK_SIZE = 256 * 1024  # resumable upload chunks must be a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = 4 * CHUNK_SIZE  # bytes sent to Cloud Storage per request
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", 5 * 1024 * 1024))
+MAX_UPLOAD_BODY_BYTES = MAX_IMAGE_BYTES + 64 * 1024  # room for the multipart framing
+MAX_CONCURRENT_UPLOADS = int(os.environ.get("MAX_CONCURRENT_UPLOADS", 4))
+
+IMAGE_EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+}
+
+SIGNED_UPLOAD_EXPIRY = timedelta(minutes=15)
+
+# Uploads are content addressed: each image lives in <prefix>/<sha256>/, and this Redis
+# hash maps "<prefix>/<sha256>" to {"img_url", "original_url", "renditions"}, so uploading
+# a picture that is already stored returns the existing URLs without writing anything.
+# One stored image can be used by several clubs / mentors, so content-addressed folders
+# are never deleted eagerly; sweep_images() removes the ones nothing references.
+IMAGE_INDEX = "images:index"
+IMAGE_USED = "images:used"  # "<prefix>/<sha256>" -> time it was last handed out as a dedupe hit
+IMAGE_PREFIXES = ("club-images", "mentor-images")
+PROTECTED_BLOBS = {"club-images/elementor-placeholder-image.webp"}  # default club_img
+
+upload_slots = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+_bucket = None
+
+
+def get_bucket():
+    # One bucket handle (and so one authorized HTTP session) for the whole process.
+    global _bucket
+    if _bucket is None:
+        _bucket = storage.bucket()
+    return _bucket
+
+
+def sniff_image_type(head):
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"GIF87a") or head.startswith(b"GIF89a"):
+        return "image/gif"
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def rendition_folder(blob_name):
+    # "club-images/<image_id>/card.webp" -> "club-images/<image_id>/"; None for the older
+    # flat "club-images/<uuid>.jpg" uploads.
+    parts = blob_name.split("/")
+    if len(parts) == 3 and parts[0] in IMAGE_PREFIXES and parts[1]:
+        return f"{parts[0]}/{parts[1]}/"
+    return None
+
+
+def is_content_addressed(blob_name):
+    folder = rendition_folder(blob_name)
+    return folder is not None and re.fullmatch(r"[0-9a-f]{64}", folder.split("/")[1])
+
+
+def blob_name_from_url(url):
+    # Handles both public URLs (storage.googleapis.com/<bucket>/<name>) and Firebase
+    # download URLs (firebasestorage.googleapis.com/v0/b/<bucket>/o/<quoted name>?...).
+    if not isinstance(url, str) or len(url) == 0:
+        return None
+    parsed = urlparse(url)
+    if "/o/" in parsed.path:
+        return unquote(parsed.path.split("/o/", 1)[1])
+    parts = parsed.path.lstrip("/").split("/", 1)
+    if len(parts) == 2:
+        return unquote(parts[1])
+    return None
+
+
+def lookup_image(prefix, digest):
+    raw = redis.hget(IMAGE_INDEX, f"{prefix}/{digest}")
+    if raw is None:
+        return None
+    entry = json.loads(raw)
+    # Metadata-only check, in case the sweeper removed the image after it was indexed.
+    if not get_bucket().blob(blob_name_from_url(entry["original_url"])).exists():
+        redis.hdel(IMAGE_INDEX, f"{prefix}/{digest}")
+        return None
+    # The caller is about to reference it, so the sweeper must leave it alone even if
+    # nothing references it yet.
+    redis.hset(IMAGE_USED, f"{prefix}/{digest}", time.time())
+    return entry
+
+
+def record_image(prefix, digest, entry):
+    redis.hset(IMAGE_INDEX, f"{prefix}/{digest}", json.dumps(entry))
+
+
+async def hash_upload(file: UploadFile):
+    # sha256 of the (already spooled) upload, read in chunks; -3 if over MAX_IMAGE_BYTES.
+    digest = hashlib.sha256()
+    total = 0
+    chunk = await file.read(CHUNK_SIZE)
+    while chunk:
+        total += len(chunk)
+        if total > MAX_IMAGE_BYTES:
+            return {"status": -3, "error_message": "Image is too large"}
+        digest.update(chunk)
+        chunk = await file.read(CHUNK_SIZE)
+    await file.seek(0)
+    return {"status": 0, "sha256": digest.hexdigest()}
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+def abandon_upload(part, writer):
+    # A resumable upload cannot be cancelled through the public API; close() commits
+    # what was sent so far. That only ever lands on the upload's own part object, which
+    # is then deleted.
+    if not writer.closed:
+        writer.close()
+    part.delete()
+
+
+def commit_upload(part, blob):
+    # Moves a finished part object to its real name. Named uploads are content
+    # addressed, so if the name is already taken it holds these same bytes.
+    try:
+        get_bucket().copy_blob(part, get_bucket(), blob.name, if_generation_match=0)
+    except exceptions.PreconditionFailed:
+        pass
+    part.delete()
+
+
+async def stream_image_upload(file: UploadFile, prefix, name=None, keep_bytes=False):
+    # Returns {"status": 0, "img_url", "blob_name", "size"}; -2 = not a supported image,
+    # -3 = over MAX_IMAGE_BYTES, -1 = storage error. With keep_bytes the uploaded bytes
+    # are also returned as "data" (bounded by MAX_IMAGE_BYTES).
+    async with upload_slots:
+        head = await file.read(CHUNK_SIZE)
+        content_type = sniff_image_type(head)
+        if content_type is None:
+            return {"status": -2, "error_message": "Unsupported image type"}
+        if file.size is not None and file.size > MAX_IMAGE_BYTES:
+            return {"status": -3, "error_message": "Image is too large"}
+
+        extension = IMAGE_EXTENSIONS[content_type]
+        blob = get_bucket().blob(f"{prefix}/{name or uuid4()}.{extension}")
+        # Streamed into an object only this upload uses, so aborting it (which commits
+        # the partial data) never touches an image stored under the real name.
+        part = get_bucket().blob(f"{prefix}/{uuid4().hex}.part") if name else blob
+        data = bytearray() if keep_bytes else None
+        writer = None
+        try:
+            writer = await run_in_threadpool(
+                part.open,
+                "wb",
+                chunk_size=UPLOAD_CHUNK_SIZE,
+                ignore_flush=True,
+                content_type=content_type,
+            )
+            total = 0
+            chunk = head
+            while chunk:
+                total += len(chunk)
+                if total > MAX_IMAGE_BYTES:
+                    raise ImageTooLarge()
+                await run_in_threadpool(writer.write, chunk)
+                if keep_bytes:
+                    data.extend(chunk)
+                chunk = await file.read(CHUNK_SIZE)
+            await run_in_threadpool(writer.close)
+            if part is not blob:
+                await run_in_threadpool(commit_upload, part, blob)
+            await run_in_threadpool(blob.make_public)
+        except Exception as e:
+            # The part is committed if need be and deleted. An object under the real
+            # name is only deleted when that name is unique to this upload; a content
+            # addressed one may be shared and is left to sweep_images().
+            try:
+                if writer is not None:
+                    await run_in_threadpool(abandon_upload, part, writer)
+            except Exception:
+                pass
+            if isinstance(e, ImageTooLarge):
+                return {"status": -3, "error_message": "Image is too large"}
+            print(f"Failed to upload img: {e}")
+            return {"status": -1, "error_message": str(e)}
+
+        print(f"Successfully uploaded image: {blob.public_url}")
+        result = {
+            "status": 0,
+            "img_url": blob.public_url,
+            "blob_name": blob.name,
+            "size": total,
+        }
+        if keep_bytes:
+            result["data"] = bytes(data)
+        return result
+
+
+async def process_image_upload(file: UploadFile, prefix):
+    # Stores the original under <prefix>/<sha256>/original.<ext> and its thumb / card /
+    # full WebP renditions next to it. img_url is the card rendition (what club_img and
+    # profile_pic point to); all three are returned in "renditions". If the image cannot
+    # be decoded the original is used and renditions is None. If the same image was
+    # uploaded before, its URLs are returned and nothing is written ("deduplicated").
+    hashed = await hash_upload(file)
+    if hashed["status"] != 0:
+        return hashed
+    image_id = hashed["sha256"]
+    # Storage metadata request plus Redis calls, so off the event loop.
+    existing = await run_in_threadpool(lookup_image, prefix, image_id)
+    if existing is not None:
+        print(f"Image already stored: {existing['img_url']}")
+        return {"status": 0, **existing, "deduplicated": True}
+
+    upload = await stream_image_upload(
+        file, f"{prefix}/{image_id}", name="original", keep_bytes=True
+    )
+    if upload["status"] != 0:
+        return upload
+    data = upload.pop("data")
+    try:
+        renditions = await build_renditions(data)
+        urls = await store_renditions(get_bucket(), f"{prefix}/{image_id}", renditions)
+    except Exception as e:
+        print(f"Failed to build renditions: {e}")
+        return {**upload, "original_url": upload["img_url"], "renditions": None}
+    entry = {"img_url": urls["card"], "original_url": upload["img_url"], "renditions": urls}
+    await run_in_threadpool(record_image, prefix, image_id, entry)
+    return {**upload, **entry, "deduplicated": False}
+
+
+# Direct-to-storage uploads: the browser posts the file straight to Cloud Storage with a
+# short-lived V4 POST policy, then calls the finalize route, so image bytes never pass
+# through the backend on the way in. The policy pins a random object name and the content
+# type and caps the size. Finalize hashes what was actually uploaded and moves it to its
+# content-addressed name, so a client can never place bytes under someone else's hash.
+
+
+def create_signed_upload(prefix, content_type, sha256=None):
+    # If the browser sends the file's sha256 and that image is already stored, its URLs
+    # are returned instead of a policy (status 0 with "deduplicated": True). The sha256
+    # is only used for that lookup, never for the object name.
+    if content_type == "image/jpg":
+        content_type = "image/jpeg"
+    if content_type not in IMAGE_EXTENSIONS:
+        return {"status": -2, "error_message": "Unsupported image type"}
+    if sha256 is not None:
+        sha256 = sha256.lower()
+        if not re.fullmatch(r"[0-9a-f]{64}", sha256):
+            return {"status": -4, "error_message": "Invalid sha256"}
+        existing = lookup_image(prefix, sha256)
+        if existing is not None:
+            return {"status": 0, **existing, "deduplicated": True}
+    blob_name = f"{prefix}/{uuid4().hex}/original.{IMAGE_EXTENSIONS[content_type]}"
+    try:
+        policy = get_bucket().client.generate_signed_post_policy_v4(
+            get_bucket().name,
+            blob_name,
+            expiration=SIGNED_UPLOAD_EXPIRY,
+            conditions=[
+                ["content-length-range", 0, MAX_IMAGE_BYTES],
+                ["eq", "$Content-Type", content_type],
+            ],
+            fields={"Content-Type": content_type},
+        )
+        # The browser sends a multipart/form-data POST to url with every field in fields
+        # followed by the file (form field name "file").
+        return {
+            "status": 0,
+            "url": policy["url"],
+            "fields": policy["fields"],
+            "blob_name": blob_name,
+            "max_bytes": MAX_IMAGE_BYTES,
+            "deduplicated": False,
+        }
+    except Exception as e:
+        print(f"Failed to sign upload: {e}")
+        return {"status": -1, "error_message": str(e)}
+
+
+def finalize_signed_upload(prefix, blob_name):
+    # Checks an object uploaded through create_signed_upload, then copies it to
+    # <prefix>/<sha256 of its bytes>/original.<ext> and makes that public. If that image
+    # was already stored, the upload is dropped and the stored URLs (with renditions) are
+    # returned with "deduplicated": True.
+    # -4 = bad name or not uploaded, -3 = too large, -2 = not an image (both deleted).
+    if not re.fullmatch(
+        rf"{prefix}/[0-9a-f]{{32}}/original\.(jpg|png|gif|webp)", blob_name
+    ):
+        return {"status": -4, "error_message": "Invalid upload name"}
+    try:
+        blob = get_bucket().get_blob(blob_name)
+        if blob is None:
+            return {"status": -4, "error_message": "Upload not found"}
+        if blob.size > MAX_IMAGE_BYTES:
+            blob.delete()
+            return {"status": -3, "error_message": "Image is too large"}
+        data = blob.download_as_bytes()
+        content_type = sniff_image_type(data[:16])
+        if content_type is None:
+            blob.delete()
+            return {"status": -2, "error_message": "Unsupported image type"}
+        image_id = hashlib.sha256(data).hexdigest()
+        existing = lookup_image(prefix, image_id)
+        if existing is not None:
+            blob.delete()
+            return {
+                "status": 0,
+                **existing,
+                "blob_name": blob_name_from_url(existing["original_url"]),
+                "deduplicated": True,
+            }
+        target = f"{prefix}/{image_id}/original.{IMAGE_EXTENSIONS[content_type]}"
+        try:
+            get_bucket().copy_blob(blob, get_bucket(), target, if_generation_match=0)
+        except exceptions.PreconditionFailed:
+            pass  # already there; only finalize writes this name, so the bytes match
+        blob.delete()
+        stored = get_bucket().blob(target)
+        stored.make_public()
+        return {
+            "status": 0,
+            "img_url": stored.public_url,
+            "blob_name": target,
+            "renditions": None,
+            "deduplicated": False,
+        }
+    except Exception as e:
+        print(f"Failed to finalize upload: {e}")
+        return {"status": -1, "error_message": str(e)}
+
+
+async def build_stored_renditions(blob_name):
+    # Renditions for an image that is already in storage (direct uploads). Meant to run
+    # as a background task after the finalize route has answered. The image is added to
+    # the dedup index only if its folder name really is its sha256.
+    blob = get_bucket().blob(blob_name)
+    data = await run_in_threadpool(blob.download_as_bytes)
+    renditions = await build_renditions(data)
+    folder = blob_name.rsplit("/", 1)[0]
+    urls = await store_renditions(get_bucket(), folder, renditions)
+    prefix, image_id = folder.split("/")
+    if hashlib.sha256(data).hexdigest() == image_id:
+        entry = {
+            "img_url": urls["card"],
+            "original_url": blob.public_url,
+            "renditions": urls,
+        }
+        await run_in_threadpool(record_image, prefix, image_id, entry)
+    return urls
+
+
+def referenced_blobs():
+    # Every blob name (and rendition folder) a Clubs or Mentors document points to.
+    referenced = set(PROTECTED_BLOBS)
+    urls = []
+    for c in get_collection_python("Clubs"):
+        urls.append(c.get("club_img"))
+        urls.extend((c.get("club_img_renditions") or {}).values())
+    for m in get_collection_python("Mentors"):
+        urls.append(m.get("profile_pic"))
+        urls.extend((m.get("profile_pic_renditions") or {}).values())
+    for url in urls:
+        name = blob_name_from_url(url)
+        if name is None:
+            continue
+        referenced.add(name)
+        folder = rendition_folder(name)
+        if folder:
+            referenced.add(folder)
+    return referenced
+
+
+def sweep_images(grace_seconds=24 * 3600, dry_run=True):
+    # Deletes images no Clubs / Mentors document references. Anything uploaded or handed
+    # out as a dedupe hit within grace_seconds is kept, since an upload is referenced only
+    # once /setclubimg/ or /setmentorimg/ runs.
+    try:
+        referenced = referenced_blobs()
+        cutoff = time.time() - grace_seconds
+        # Images just handed out as dedupe hits are about to be referenced.
+        used = {k: float(v) for k, v in (redis.hgetall(IMAGE_USED) or {}).items()}
+        deleted = []
+        for prefix in IMAGE_PREFIXES:
+            for blob in get_bucket().list_blobs(prefix=f"{prefix}/"):
+                folder = rendition_folder(blob.name)
+                key = folder or blob.name
+                if key in referenced or blob.name in referenced:
+                    continue
+                if blob.updated is not None and blob.updated.timestamp() > cutoff:
+                    continue
+                if folder and used.get(folder.rstrip("/"), 0) > cutoff:
+                    continue
+                deleted.append(blob.name)
+                if not dry_run:
+                    blob.delete()
+                    if folder and is_content_addressed(blob.name):
+                        redis.hdel(IMAGE_INDEX, folder.rstrip("/"))
+                        redis.hdel(IMAGE_USED, folder.rstrip("/"))
+        return {"status": 0, "dry_run": dry_run, "deleted": deleted}
+    except Exception as e:
+        print(f"Failed to sweep images: {e}")
+        return {"status": -1, "error_message": str(e)}
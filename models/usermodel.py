@@ -1,12 +1,23 @@
 from fastapi import HTTPException, Header
-from firebase_admin import auth
+from firebase_admin import auth, firestore
 
-from .model import db, get_el_id, get_doc, get_collection_python, get_collection_id
+from .model import (
+    db,
+    get_el_id,
+    get_doc,
+    get_collection_python,
+    get_collection_id,
+    forget,
+)
 from .redismodel import add_redis_collection_id
 from fastapi import HTTPException, Header, Depends
 from firebase_admin import auth
-from sendmail import send_mail
+from digest import record_admin_event
 from .redismodel import redis, get_redis_collection_id
+from .audiencemodel import add_user_audience, remove_user_audience
+from .pairingmodel import update_pairing
+from .ledgermodel import get_ledger_entry, to_hours
+from .membershipmodel import add_membership, remove_membership, remove_user_memberships
 import json
 
 
@@ -38,12 +49,10 @@ def make_user(email, is_leader, role, leading, joined_clubs):
             }
         )
         print(result)
-        # Send email when new user signs up
-        receiver = "crlspathfinders25@gmail.com"
-        subject = "New user login"
-        body = f"""{email} just made an account.
-"""
-        send_mail(receiver, subject, body)
+        forget(collection)
+        add_user_audience(email, curr_grade)
+        # Notify the admin inbox (batched into the next admin digest)
+        record_admin_event("New user login", f"{email} just made an account.")
         return {"status": "Success"}
     except Exception as e:
         return {"status": f"Failed: {str(e)}"}
@@ -66,6 +75,7 @@ def change_user(email, is_leader, password, role):
                 }
             )
         )
+        forget(collection, doc_id)
         print(result)
         return {"status": "Success"}
     except Exception as e:
@@ -119,6 +129,11 @@ def join_leave_club(join_leave, email, club):
 
         doc = db.collection("Users").document(user_id)
         doc.update({"joined_clubs": clubs})
+        forget("Users", user_id)
+        if join_leave == "leave":
+            remove_membership(email, club)
+        elif join_leave == "join":
+            add_membership(email, club)
         coll_id = get_collection_id("Users", user_id)
         add_id = add_redis_collection_id("Users", coll_id, user_id=user_id)
         return {"status": "Successfully left club"}
@@ -141,6 +156,7 @@ def change_user_role(email, role):
             change_is_leader(email, True)
         doc = db.collection("Users").document(user_id)
         doc.update({"role": role})
+        forget("Users", user_id)
         return {"status": "Successfully changed user role"}
     except Exception as e:
         print(f"Failed to change role: {e}")
@@ -161,6 +177,9 @@ def delete_user(email):
         user_id = get_el_id("Users", email)
         print(f"userid - {user_id}")
         db.collection("Users").document(user_id).delete()
+        forget("Users")
+        remove_user_audience(email)
+        remove_user_memberships(email)
         return {"status": "Successfully deleted user"}
     except Exception as e:
         print(f"Failed to delete user: {e}")
@@ -171,6 +190,7 @@ def change_is_leader(email, leader):
     try:
         user_id = get_el_id("Users", email)
         db.collection("Users").document(user_id).update({"is_leader": leader})
+        forget("Users", user_id)
         return {"status": "Successfully changed is leader"}
     except Exception as e:
         print(f"Failed to change is leader: {e}")
@@ -181,6 +201,7 @@ def change_is_mentor(email, mentor):
     try:
         user_id = get_el_id("Users", email)
         db.collection("Users").document(user_id).update({"is_mentor": mentor})
+        forget("Users", user_id)
         return {"status": "Successfully changed is mentor"}
     except Exception as e:
         print(f"Failed to change is mentor: {e}")
@@ -191,6 +212,7 @@ def change_mentor_eligible(email, eligible):
     try:
         user_id = get_el_id("Users", email)
         db.collection("Users").document(user_id).update({"mentor_eligible": eligible})
+        forget("Users", user_id)
         return {"status": "Successfully changed mentor eligible"}
     except Exception as e:
         print(f"Failed to change mentor eligible: {e}")
@@ -208,6 +230,18 @@ def update_mentee_catalog(
 ):
     print("started")
     try:
+        if get_ledger_entry(catalog_id) is not None:
+            # The log is in the HoursLedger: confirm_hours already wrote the mentee side
+            # in the same transaction as the mentor side.
+            update_pairing(
+                catalog_id,
+                {
+                    "mentee_description": mentee_description,
+                    "date_confirmed": date_confirmed,
+                    "date_met": date_met,
+                },
+            )
+            return {"status": 0}
         new_mentee_catalog = {
             "id": catalog_id,  # Same id as the mentor catalog's id
             "mentor": mentor_email,
@@ -231,9 +265,22 @@ def update_mentee_catalog(
         print(f"mentee logs - {mentee_logs}")
         print(db.collection("Users").document(mentee_id))
         db.collection("Users").document(mentee_id).update(
-            {"is_mentee": True, "mentee_logs": mentee_logs}
+            {
+                "is_mentee": True,
+                "mentee_logs": mentee_logs,
+                "total_mentee_hours": firestore.Increment(to_hours(hours)),
+            }
         )
-        
+        forget("Users", mentee_id)
+        update_pairing(
+            catalog_id,
+            {
+                "mentee_description": mentee_description,
+                "date_confirmed": date_confirmed,
+                "date_met": date_met,
+            },
+        )
+
         return {"status": 0}
     except Exception as e:
         print(f"failed: {e}")
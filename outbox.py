@@ -0,0 +1,201 @@
+import json
+import os
+import time
+import uuid
+
+from dotenv import load_dotenv
+from upstash_redis import Redis
+
+from sendmail import send_mail
+
+load_dotenv()
+
+# Outbox for outgoing email. Request handlers call enqueue_mail() and return as soon as
+# their database writes are done; drain_outbox() (run as a background task after the
+# response, or from the /drainoutbox/ cron route) does the actual SMTP work.
+
+OUTBOX_READY = "outbox:ready"  # list of messages that can be sent right now
+OUTBOX_PROCESSING = "outbox:processing"  # messages a worker has popped but not finished
+OUTBOX_DELAYED = "outbox:delayed"  # sorted set of messages waiting for a retry (score = retry time)
+OUTBOX_DEAD = "outbox:dead"  # list of messages that ran out of attempts
+
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], 0, ARGV[1])
+for _, raw in ipairs(due) do
+    redis.call('ZREM', KEYS[1], raw)
+    redis.call('LPUSH', KEYS[2], raw)
+end
+return #due
+"""
+
+MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 5))
+BASE_DELAY = int(os.environ.get("OUTBOX_BASE_DELAY", 30))  # seconds
+MAX_DELAY = int(os.environ.get("OUTBOX_MAX_DELAY", 3600))  # seconds
+
+
+class RedisQueue:
+    def __init__(self, client):
+        self.client = client
+
+    def push(self, message):
+        self.client.lpush(OUTBOX_READY, json.dumps(message))
+
+    def pop(self):
+        # The message stays in the processing list until ack(), so an instance that dies
+        # mid-send does not lose it (see recover()).
+        raw = self.client.lmove(OUTBOX_READY, OUTBOX_PROCESSING, "RIGHT", "LEFT")
+        if raw is None:
+            return None
+        message = json.loads(raw)
+        message["_raw"] = raw
+        return message
+
+    def ack(self, message):
+        self.client.lrem(OUTBOX_PROCESSING, 1, message.pop("_raw"))
+
+    def recover(self):
+        # Put messages abandoned in the processing list back on the ready list. Only run
+        # this when no other worker is draining, or a message may be sent twice.
+        moved = 0
+        while self.client.lmove(OUTBOX_PROCESSING, OUTBOX_READY, "RIGHT", "LEFT"):
+            moved += 1
+        return moved
+
+    def push_delayed(self, message, run_at):
+        # Takes the popped message off the processing list in the same MULTI, so a worker
+        # dying in between can neither lose it nor leave it in both places.
+        raw = message.pop("_raw")
+        tx = self.client.multi()
+        tx.zadd(OUTBOX_DELAYED, {json.dumps(message): run_at})
+        tx.lrem(OUTBOX_PROCESSING, 1, raw)
+        tx.exec()
+
+    def promote_due(self, now):
+        # Move every delayed message whose retry time has passed back onto the ready list.
+        # One script, so a message is never lost between the ZREM and the LPUSH, and two
+        # workers never both promote it.
+        return int(
+            self.client.eval(PROMOTE_SCRIPT, keys=[OUTBOX_DELAYED, OUTBOX_READY], args=[now])
+        )
+
+    def bury(self, message):
+        # Like push_delayed, one MULTI with the removal from the processing list.
+        raw = message.pop("_raw")
+        tx = self.client.multi()
+        tx.lpush(OUTBOX_DEAD, json.dumps(message))
+        tx.lrem(OUTBOX_PROCESSING, 1, raw)
+        tx.exec()
+
+    def dead(self):
+        return [json.loads(raw) for raw in self.client.lrange(OUTBOX_DEAD, 0, -1)]
+
+    def stats(self):
+        return {
+            "ready": self.client.llen(OUTBOX_READY),
+            "processing": self.client.llen(OUTBOX_PROCESSING),
+            "delayed": self.client.zcard(OUTBOX_DELAYED),
+            "dead": self.client.llen(OUTBOX_DEAD),
+        }
+
+
+class MemoryQueue:
+    # Same interface as RedisQueue, kept in process. Used for tests and local runs
+    # (set OUTBOX_BACKEND=memory).
+    def __init__(self):
+        self.ready = []
+        self.delayed = []
+        self.dead_letters = []
+
+    def push(self, message):
+        self.ready.insert(0, json.dumps(message))
+
+    def pop(self):
+        if not self.ready:
+            return None
+        return json.loads(self.ready.pop())
+
+    def ack(self, message):
+        pass
+
+    def recover(self):
+        return 0
+
+    def push_delayed(self, message, run_at):
+        self.delayed.append((run_at, json.dumps(message)))
+
+    def promote_due(self, now):
+        due = [d for d in self.delayed if d[0] <= now]
+        for d in due:
+            self.delayed.remove(d)
+            self.ready.insert(0, d[1])
+        return len(due)
+
+    def bury(self, message):
+        self.dead_letters.insert(0, json.dumps(message))
+
+    def dead(self):
+        return [json.loads(raw) for raw in self.dead_letters]
+
+    def stats(self):
+        return {
+            "ready": len(self.ready),
+            "processing": 0,
+            "delayed": len(self.delayed),
+            "dead": len(self.dead_letters),
+        }
+
+
+def make_queue():
+    if os.environ.get("OUTBOX_BACKEND") == "memory":
+        return MemoryQueue()
+    return RedisQueue(
+        Redis(url=os.environ.get("REDIS_URL"), token=os.environ.get("REDIS_TOKEN"))
+    )
+
+
+queue = make_queue()
+
+
+def enqueue_mail(email_receiver, subject, body):
+    message = {
+        "id": str(uuid.uuid4()),
+        "receiver": email_receiver,
+        "subject": subject,
+        "body": body,
+        "attempts": 0,
+        "created": time.time(),
+    }
+    queue.push(message)
+    return message["id"]
+
+
+def retry_delay(attempts):
+    # Exponential backoff: 30s, 60s, 120s, ... capped at MAX_DELAY.
+    return min(BASE_DELAY * (2 ** (attempts - 1)), MAX_DELAY)
+
+
+def drain_outbox(max_messages=50, sender=send_mail):
+    sent, retried, dead = 0, 0, 0
+    queue.promote_due(time.time())
+    for _ in range(max_messages):
+        message = queue.pop()
+        if message is None:
+            break
+        try:
+            sender(message["receiver"], message["subject"], message["body"])
+        except Exception as e:
+            # push_delayed / bury also take it off the processing list.
+            message["attempts"] += 1
+            message["last_error"] = str(e)
+            if message["attempts"] >= MAX_ATTEMPTS:
+                print(f"Outbox message {message['id']} dead-lettered: {e}")
+                queue.bury(message)
+                dead += 1
+            else:
+                queue.push_delayed(message, time.time() + retry_delay(message["attempts"]))
+                retried += 1
+        else:
+            # Outside the try: a failed ack must not count as a failed send and retry it.
+            queue.ack(message)
+            sent += 1
+    return {"status": 0, "sent": sent, "retried": retried, "dead": dead}
@@ -1,6 +1,7 @@
 import os
 import secrets
-from typing import Annotated
+from datetime import datetime
+from typing import Annotated, Optional
 
 from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status, APIRouter
@@ -9,6 +10,7 @@ from pydantic import BaseModel
 
 from models.allinfomodel import (
     update_all_info_collection,
+    update_all_info_fields,
     add_document_to_all_info_collection,
 )
 from models.redismodel import add_redis_collection
@@ -24,6 +26,12 @@ class UpdateAllInfo(BaseModel):
     vals: dict
 
 
+class UpdateAllInfoFields(BaseModel):
+    doc: str
+    updates: dict  # field path ("a.b", backticks around odd names) -> new value
+    last_update_time: Optional[datetime] = None  # only apply if unchanged since then
+
+
 class AddDocument(BaseModel):
     doc: dict
 
@@ -55,13 +63,24 @@ def update_all_info(
     update: UpdateAllInfo, username: Annotated[str, Depends(get_current_username)]
 ):
     result = update_all_info_collection(update.doc, update.vals)
-    add_redis_collection("AllInfo")
     if result["status"] == 0:
         return {"status": 0}
     print(result)
     return {"status": -1, "error_message": result["error_message"]}
 
 
+# Sets the given fields of one AllInfo document in a single write.
+@router.post("/updatefields/")
+def update_all_info_field_paths(
+    update: UpdateAllInfoFields,
+    username: Annotated[str, Depends(get_current_username)],
+):
+    result = update_all_info_fields(update.doc, update.updates, update.last_update_time)
+    if result["status"] == 0:
+        return {"status": 0, "update_time": result["update_time"]}
+    return {"status": result["status"], "error_message": result["error_message"]}
+
+
 @router.post("/adddocument/")
 def add_document(doc: AddDocument):
     result = add_document_to_all_info_collection(doc.doc)
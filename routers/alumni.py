@@ -1,15 +1,21 @@
-import os, secrets, uuid, random, string
-from typing import Annotated, List
+import os, secrets, uuid
+from typing import Annotated, List, Optional
 from dotenv import load_dotenv
-from fastapi import Depends, HTTPException, status, APIRouter
+from fastapi import Depends, HTTPException, status, APIRouter, Query
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pydantic import BaseModel
-from models.allinfomodel import add_document_to_all_info_collection, update_all_info_collection, update_doc
-from models.model import get_doc
+from models.allinfomodel import add_document_to_all_info_collection, update_all_info_collection
 
 from models.alumnimodel import (
-    make_alumni
+    make_alumni,
+    rebuild_school_index,
 )
+from models.alumnistatsmodel import (
+    STATS_GROUPS,
+    get_alumni_stats,
+    rebuild_alumni_stats,
+)
+from models.mapmodel import MAX_ZOOM, schools_in_bbox, get_tile, rebuild_map_index
 from models.redismodel import add_redis_collection
 
 load_dotenv()
@@ -54,41 +60,68 @@ class Alum(BaseModel):
 def add_alumni(alum: Alum, username: Annotated[str, Depends(get_current_username)]):
     try:
         new_alum = alum.model_dump()
-        # print(new_alum)
+        # Adds the alum and increments their school's amount_in in AllInfo/universities
+        # (creating the school if needed) in one batch.
         res = make_alumni(new_alum)
-        # print(res)
         if res["status"] == 0:
-            # Update and increment AllInfo/universities
-            new_id = str(generate_rand_id())
-            universities = get_doc("AllInfo", "universities")
-            unis = list(universities.keys())
-            # print(unis)
-            for u in unis:
-                curr_uni = universities[u]
-                # print(curr_uni)
-                if curr_uni["name"] == alum.fullschool:
-                    # print("found")
-                    universities[u]["amount_in"] += 1
-                    update_doc("universities", universities)
-                    return {"status": 0}
-            # print("not found")
-            new_uni = {
-                "name": alum.fullschool,
-                "loc": alum.loc,
-                "amount_in": 1,
-                "coords": alum.coords,
-                "logo": alum.logo
-            }
-            # print(new_uni)
-            universities[new_id] = new_uni
-            # print(universities)
-            # print("starting update all info collection")
-            update_doc("universities", universities)
             return {"status": 0}
         return {"status": -1, "error_message": res["error_message"]}
     except Exception as e:
         return {"status": -1, "error_message": e}
 
-def generate_rand_id(length=20):
-    chars = string.ascii_letters 
-    return ''.join(random.choices(chars, k=length))
\ No newline at end of file
+
+@router.get("/alumni/schools/rebuild")
+def rebuild_schools(username: Annotated[str, Depends(get_current_username)]):
+    return rebuild_school_index()
+
+
+# Schools (or, with zoom, clusters of schools) inside a bounding box in degrees.
+# west > east means the box crosses the antimeridian.
+@router.get("/alumni/map")
+def alumni_map(
+    west: float, south: float, east: float, north: float, zoom: Optional[int] = None
+):
+    try:
+        if south > north or (zoom is not None and not 0 <= zoom <= MAX_ZOOM):
+            return {"status": -1.1, "error_message": "Invalid bounding box or zoom"}
+        return {"status": 0, "schools": schools_in_bbox(west, south, east, north, zoom)}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+# Clustered schools of one z/x/y map tile (cached in Redis).
+@router.get("/alumni/map/tiles/{z}/{x}/{y}")
+def alumni_map_tile(z: int, x: int, y: int):
+    try:
+        if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2**z and 0 <= y < 2**z):
+            return {"status": -1.1, "error_message": "Invalid tile"}
+        return {"status": 0, "schools": get_tile(z, x, y)}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+@router.get("/alumni/map/rebuild")
+def rebuild_map(username: Annotated[str, Depends(get_current_username)]):
+    return rebuild_map_index()
+
+
+# Alumni counts per school, major, graduation year and location, largest first.
+# by picks the groups (all by default), limit keeps the top entries of each.
+@router.get("/alumni/stats")
+def alumni_stats(by: Optional[List[str]] = Query(None), limit: Optional[int] = None):
+    try:
+        if by and any(g not in STATS_GROUPS for g in by):
+            return {"status": -1.1, "error_message": f"by must be one of {STATS_GROUPS}"}
+        return {"status": 0, "stats": get_alumni_stats(by, limit)}
+    except ValueError as e:
+        return {"status": -1, "error_message": str(e)}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+# recount=true recounts from AlumniNetwork (e.g. after alumni were edited by hand).
+@router.get("/alumni/stats/rebuild")
+def rebuild_stats(
+    username: Annotated[str, Depends(get_current_username)], recount: bool = False
+):
+    return rebuild_alumni_stats(recount)
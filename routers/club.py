@@ -11,8 +11,10 @@ from fastapi import (
     status,
     APIRouter,
     Form,
+    BackgroundTasks,
 )
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
 from models.clubmodel import (
@@ -24,6 +26,9 @@ from models.clubmodel import (
     upload_club_image,
     delete_club_image,
     set_club_image_doc,
+    create_club_image_upload,
+    finalize_club_image,
+    add_club_image_renditions,
 )
 from models.model import (
     get_el_id,
@@ -34,7 +39,12 @@ from models.redismodel import (
     delete_redis_id,
     add_redis_collection,
 )
-from sendmail import send_mail
+from models.clubsearchmodel import search_clubs, rebuild_club_index
+from models.schedulemodel import get_schedule, get_conflicts, rebuild_schedule_index
+from models.membershipmodel import user_clubs
+from models.cascademodel import create_cascade_job, run_cascade_job
+from outbox import enqueue_mail, drain_outbox
+from digest import record_admin_event
 
 load_dotenv()
 
@@ -69,6 +79,18 @@ class SetClubImg(BaseModel):
     img_url: str
     club_id: str
     old_id: str
+    renditions: Optional[dict] = None
+
+
+class ImageUploadRequest(BaseModel):
+    content_type: str
+    sha256: Optional[str] = None  # lets an already stored image be reused without uploading
+
+
+class FinalizeClubImg(BaseModel):
+    blob_name: str
+    club_id: str
+    old_id: str
 
 
 def get_current_username(
@@ -94,7 +116,7 @@ def get_current_username(
 
 
 @router.post("/createclub/")
-async def create_info(club: Club):
+async def create_info(club: Club, background_tasks: BackgroundTasks):
     try:
         # Client side makes sure that the president email and advisor emails are correct, etc.
         # Make club will make create it as Pending -> will wait for advisor verification to Approve it.
@@ -133,10 +155,10 @@ Once successful, {club.club_name} should appear after hitting "Find a Club."
 Thank you, and if there are any problems, send me an email @25ranjaria@cpsd.us
 """
         try:
-            send_mail(receiver, subject, body)
-            print("sent first mail")
+            enqueue_mail(receiver, subject, body)
+            print("queued first mail")
         except Exception as e:
-            print(f"Failed to send mail: {e}")
+            print(f"Failed to queue mail: {e}")
             return {"status": -16, "error_message": e}
 
         # Now send email to the club president:
@@ -153,14 +175,13 @@ Once successful, {club.club_name} will appear after hitting "Find a Club." Try r
 Thank you, and if there are any problems, send me an email @25ranjaria@cpsd.us
 """
         try:
-            send_mail(receiver, subject, body)
-            print("sent second mail")
+            enqueue_mail(receiver, subject, body)
+            print("queued second mail")
         except Exception as e:
-            print(f"Failed to send mail: {e}")
+            print(f"Failed to queue mail: {e}")
             return {"status": -16, "error_message": e}
 
-        receiver = "crlspathfinders25@gmail.com"
-        subject = f"{club.club_name} | Club Registration"
+        # Admin copy goes into the next admin digest:
         body = f"""Club registration confifrmation for {club.club_name}
 
 Advisor: {club.advisor_email}
@@ -176,13 +197,10 @@ Status: {club.status}
 Vice Presidents: {club.vice_president_emails}
 """
 
-        try:
-            send_mail(receiver, subject, body)
-            print("sent second mail")
-        except Exception as e:
-            print(f"Failed to send mail: {e}")
-            return {"status": -16, "error_message": e}
+        record_admin_event("Club Registration", body)
 
+        # The mails are sent by the outbox worker once the response has gone out.
+        background_tasks.add_task(drain_outbox)
         return {"status": 0}
     except Exception as e:
         return {"status": -17, "error_message": e}
@@ -227,28 +245,64 @@ def change_status(change_status: ChangeStatus):
 
 
 @router.get("/deleteclub/{club_id}")
-def delete_club(club_id: str):
+def delete_club(club_id: str, background_tasks: BackgroundTasks):
     try:
         del_id = delete_redis_id("Clubs", club_id)
         if del_id["status"] == 0:
             remove_club(club_id)
-            # Now remove this club from all the users who are members of this club:
-            # users = get_collection_python("Users")
-            # print(f"57 - {users}")
-            # for u in users:
-            #     if len(u["joined_clubs"]) > 0:
-            #         if club_id in u["joined_clubs"]:
-            #             print("59 - Found!")
-            #             join_leave_club("leave", u["email"], club_id)
-            #         else:
-            #             print("61 - Not found")
-            return {"status": 0}
+            # Remove this club from the joined_clubs of its members in the background
+            # (progress: /cascade/{job_id}).
+            job = create_cascade_job("club", club_id)
+            background_tasks.add_task(run_cascade_job, job["id"])
+            return {"status": 0, "cascade_job_id": job["id"]}
         return {"status": -20.1}
 
     except Exception as e:
         return {"status": -20, "error_message": e}
 
 
+# Ranked search over approved clubs (name, description, advisor / president emails).
+@router.get("/clubs/search")
+def clubs_search(q: str, limit: int = 20, offset: int = 0):
+    try:
+        return {"status": 0, **search_clubs(q, limit, offset)}
+    except ValueError as e:
+        return {"status": -1, "error_message": str(e)}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+@router.get("/clubs/search/rebuild")
+def clubs_search_rebuild(username: Annotated[str, Depends(get_current_username)]):
+    return rebuild_club_index()
+
+
+# Approved clubs meeting on a day, optionally between two times ("15:00" or "3:00 PM").
+@router.get("/clubs/schedule")
+def clubs_schedule(day: str, after: Optional[str] = None, before: Optional[str] = None):
+    try:
+        meetings = get_schedule(day, after, before)
+        if meetings is None:
+            return {"status": -1.1, "error_message": "Unknown day or time"}
+        return {"status": 0, "meetings": meetings}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+# Joined clubs of a user whose meetings overlap.
+@router.get("/clubs/conflicts/{email}")
+def clubs_conflicts(email: str):
+    try:
+        return {"status": 0, "conflicts": get_conflicts(user_clubs(email))}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+@router.get("/clubs/schedule/rebuild")
+def clubs_schedule_rebuild(username: Annotated[str, Depends(get_current_username)]):
+    return rebuild_schedule_index()
+
+
 @router.post("/verifyclub")
 def verify_club(verify: VerifyClub):
     try:
@@ -265,20 +319,23 @@ async def upload_image(
 ):
     print(file)
     try:
-        # Validate file type
-        if file.content_type not in [
-            "image/jpeg",
-            "image/jpg",
-            "image/png",
-            "image/gif",
-            "image/webp",
-        ]:
+        # File type (magic bytes) and size are validated while streaming the upload
+        upload = await upload_club_image(file)
+        if upload["status"] == -2:
             return {"status": -22.1}
+        if upload["status"] == -3:
+            return {"status": -22.2, "error_message": upload["error_message"]}
+        if upload["status"] != 0:
+            return {"status": -22, "error_message": upload["error_message"]}
         if old_file_name:
-            delete_club_image(old_file_name)
-
-        img_url = upload_club_image(file)
-        return {"status": 0, "img_url": img_url}
+            # Synchronous Storage calls, so off the event loop.
+            await run_in_threadpool(delete_club_image, old_file_name)
+
+        return {
+            "status": 0,
+            "img_url": upload["img_url"],
+            "renditions": upload["renditions"],
+        }
     except Exception as e:
         return {"status": -22, "error_message": e}
 
@@ -286,9 +343,63 @@ async def upload_image(
 @router.post("/setclubimg/")
 async def set_club_img(upload: SetClubImg, username: Annotated[str, Depends(get_current_username)]):
     if upload.img_url != "Failed":
-        set_club_image_doc(upload.club_id, upload.img_url, upload.old_id)
+        # Firestore write plus the old image's deletion, off the event loop.
+        await run_in_threadpool(
+            set_club_image_doc,
+            upload.club_id,
+            upload.img_url,
+            upload.old_id,
+            upload.renditions,
+        )
         coll_id = get_collection_id("Clubs", upload.club_id)
         add_redis_collection_id("Clubs", coll_id, club_id=upload.club_id)
         return {"status": 0}
     else:
         return {"status": -23}
+
+
+# Direct-to-storage upload: returns a signed POST policy the browser uploads the image with.
+@router.post("/clubimageuploadurl/")
+def club_image_upload_url(
+    request: ImageUploadRequest, username: Annotated[str, Depends(get_current_username)]
+):
+    try:
+        signed = create_club_image_upload(request.content_type, request.sha256)
+        if signed["status"] == -2:
+            return {"status": -24.1}
+        if signed["status"] != 0:
+            return {"status": -24, "error_message": signed["error_message"]}
+        return signed
+    except Exception as e:
+        return {"status": -24, "error_message": e}
+
+
+# Called once the browser's direct upload has finished: checks the object and records it.
+@router.post("/finalizeclubimage/")
+async def finalize_club_img(
+    upload: FinalizeClubImg,
+    background_tasks: BackgroundTasks,
+    username: Annotated[str, Depends(get_current_username)],
+):
+    try:
+        # Downloads and hashes the upload, so it runs off the event loop.
+        final = await run_in_threadpool(finalize_club_image, upload.blob_name)
+        if final["status"] != 0:
+            return {"status": -25.1, "error_message": final["error_message"]}
+        # Until the task builds them, the doc has no renditions (the old image's go).
+        await run_in_threadpool(
+            set_club_image_doc,
+            upload.club_id,
+            final["img_url"],
+            upload.old_id,
+            final["renditions"],
+        )
+        coll_id = get_collection_id("Clubs", upload.club_id)
+        add_redis_collection_id("Clubs", coll_id, club_id=upload.club_id)
+        if not final["deduplicated"]:
+            background_tasks.add_task(
+                add_club_image_renditions, upload.club_id, final["blob_name"]
+            )
+        return {"status": 0, "img_url": final["img_url"]}
+    except Exception as e:
+        return {"status": -25, "error_message": e}
@@ -1,6 +1,8 @@
+import asyncio
 import httpx
 import os
 import secrets
+import time
 from typing import Annotated
 
 from dotenv import load_dotenv
@@ -18,6 +20,31 @@ security = HTTPBasic()
 
 router = APIRouter(tags=["libraryinfo"])
 
+# One long-lived HTTP/2 client, so library requests reuse a kept-alive connection
+# instead of a new TLS handshake each time. The response is kept in memory for
+# LIBRARY_TTL; after that the next request revalidates it with the upstream ETag /
+# Last-Modified (a 304 just renews it). Concurrent requests share one upstream fetch,
+# and while the upstream fails the last response is served for up to LIBRARY_STALE.
+# After a failed fetch, the stale response is served at once for LIBRARY_BACKOFF rather
+# than every request waiting out the timeout again. The client and the shared fetch
+# belong to an event loop, so they are created on first use in the running loop
+# (serverless hosts may never run the app's lifespan) and replaced if the loop changes.
+
+LIBRARY_TTL = 300  # seconds
+LIBRARY_STALE = 24 * 3600  # seconds
+LIBRARY_BACKOFF = 30  # seconds
+
+client = None
+client_loop = None  # the event loop client was created in
+library_cache = {
+    "data": None,
+    "etag": None,
+    "last_modified": None,
+    "fetched": 0.0,
+    "failed": float("-inf"),  # when the last upstream fetch failed
+}
+library_fetch = None  # the upstream fetch in flight, shared by concurrent requests
+
 
 def get_current_username(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)]
@@ -41,14 +68,78 @@ def get_current_username(
     return credentials.username
 
 
+def get_client():
+    global client, client_loop, library_fetch
+    loop = asyncio.get_running_loop()
+    if client is None or client_loop is not loop:
+        client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(10.0),
+            limits=httpx.Limits(max_keepalive_connections=5, keepalive_expiry=300),
+        )
+        client_loop = loop
+        library_fetch = None  # a fetch from another loop cannot be awaited here
+    return client
+
+
+async def close_client():
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
+
+
+async def revalidate_library_info():
+    headers = {}
+    if library_cache["etag"]:
+        headers["If-None-Match"] = library_cache["etag"]
+    if library_cache["last_modified"]:
+        headers["If-Modified-Since"] = library_cache["last_modified"]
+    response = await get_client().get(
+        os.environ.get("LIBRARY_INFO_URL"), headers=headers
+    )
+    if response.status_code == 304 and library_cache["data"] is not None:
+        library_cache["fetched"] = time.monotonic()
+        return library_cache["data"]
+    response.raise_for_status()  # Raise exception for HTTP errors
+    library_cache.update(
+        data=response.json(),
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+        fetched=time.monotonic(),
+    )
+    return library_cache["data"]
+
+
+async def load_library_info():
+    # Returns (data, stale).
+    global library_fetch
+    get_client()  # resets library_fetch if it belongs to another event loop
+    now = time.monotonic()
+    age = now - library_cache["fetched"]
+    if library_cache["data"] is not None and age < LIBRARY_TTL:
+        return library_cache["data"], False
+    can_serve_stale = library_cache["data"] is not None and age < LIBRARY_STALE
+    if can_serve_stale and now - library_cache["failed"] < LIBRARY_BACKOFF:
+        return library_cache["data"], True
+    if library_fetch is None or library_fetch.done():
+        library_fetch = asyncio.ensure_future(revalidate_library_info())
+    try:
+        # shield: a client disconnecting must not cancel the fetch others are waiting on.
+        return await asyncio.shield(library_fetch), False
+    except Exception as e:
+        library_cache["failed"] = time.monotonic()
+        if can_serve_stale:
+            print(f"Serving cached library info, upstream failed: {e}")
+            return library_cache["data"], True
+        raise
+
+
 @router.get("/getlibraryinfo/")
 async def get_library_info(username: Annotated[str, Depends(get_current_username)]):
 # async def get_library_info():
     try:
-        url = os.environ.get("LIBRARY_INFO_URL")
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
-            response.raise_for_status()  # Raise exception for HTTP errors
-            return {"status": 0, "data": response.json()}
+        data, stale = await load_library_info()
+        return {"status": 0, "data": data, "stale": stale}
     except Exception as e:
         return {"status": -1, "error_message": e}
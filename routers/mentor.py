@@ -13,8 +13,11 @@ from fastapi import (
     status,
     APIRouter,
     Form,
+    BackgroundTasks,
+    Query,
 )
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
 from models.mentormodel import (
@@ -28,11 +31,26 @@ from models.mentormodel import (
     confirm_mentor_mentee_logging,
     delete_mentor_image,
     get_mentor_description,
+    create_mentor_image_upload,
+    finalize_mentor_image,
+    add_mentor_image_renditions,
 )
 from models.model import get_el_id, get_collection_id
 from models.redismodel import add_redis_collection_id, delete_redis_id
 from models.usermodel import update_mentee_catalog
-from sendmail import send_mail
+from models.ledgermodel import mentor_ledger, mentee_ledger, backfill_mentee_totals
+from models.leaderboardmodel import (
+    MAX_LEADERBOARD,
+    get_leaderboard,
+    get_hours_totals,
+    get_mentor_hours,
+    rebuild_hours_reports,
+)
+from models.mentorsearchmodel import search_mentors, rebuild_mentor_index
+from models.matchmodel import match_mentors, rebuild_mentor_matrix
+from models.cascademodel import create_cascade_job, run_cascade_job
+from outbox import enqueue_mail, drain_outbox
+from digest import record_admin_event
 
 load_dotenv()
 curr_url = os.environ.get("CURR_URL")
@@ -56,6 +74,17 @@ class Mentor(BaseModel):
 class SetMentorImg(BaseModel):
     img_url: str
     mentor_email: str
+    renditions: Optional[dict] = None
+
+
+class ImageUploadRequest(BaseModel):
+    content_type: str
+    sha256: Optional[str] = None  # lets an already stored image be reused without uploading
+
+
+class FinalizeMentorImg(BaseModel):
+    blob_name: str
+    mentor_email: str
 
 
 class MentorPitch(BaseModel):
@@ -63,6 +92,16 @@ class MentorPitch(BaseModel):
     pitch: str
 
 
+class MentorMatch(BaseModel):
+    races: List[str] = []
+    religions: List[str] = []
+    gender: List[str] = []
+    languages: List[str] = []
+    academics: List[str] = []
+    weights: Optional[dict] = None  # e.g. {"languages": 5}, see matchmodel.MATCH_WEIGHTS
+    limit: int = 10
+
+
 class MentorMenteeLog(BaseModel):
     mentor_email: str
     mentee_email: str
@@ -151,13 +190,16 @@ async def update_mentor(mentor: Mentor):
 
 
 @router.get("/deletementor/{email}")
-async def delete_mentor(email: str):
+async def delete_mentor(email: str, background_tasks: BackgroundTasks):
     try:
         mentor_id = get_el_id("Mentors", email)
         del_id = delete_redis_id("Mentors", mentor_id)
         if del_id["status"] == 0:
             remove_mentor(email)
-            return {"status": 0}
+            # Reset the user's is_mentor and drop unconfirmed logs in the background.
+            job = create_cascade_job("mentor", email)
+            background_tasks.add_task(run_cascade_job, job["id"])
+            return {"status": 0, "cascade_job_id": job["id"]}
     except Exception as e:
         return {"status": -4, "error_message": e}
 
@@ -178,20 +220,23 @@ async def upload_image(
 ):
     print(file)
     try:
-        # Validate file type
-        if file.content_type not in [
-            "image/jpeg",
-            "image/jpg",
-            "image/png",
-            "image/gif",
-            "image/webp",
-        ]:
+        # File type (magic bytes) and size are validated while streaming the upload
+        upload = await upload_mentor_image(file)
+        if upload["status"] == -2:
             return {"status": -5.1}
+        if upload["status"] == -3:
+            return {"status": -5.2, "error_message": upload["error_message"]}
+        if upload["status"] != 0:
+            return {"status": -5, "error_message": upload["error_message"]}
         if old_file_name:
-            delete_mentor_image(old_file_name)
-
-        img_url = upload_mentor_image(file)
-        return {"status": 0, "img_url": img_url}
+            # Synchronous Storage calls, so off the event loop.
+            await run_in_threadpool(delete_mentor_image, old_file_name)
+
+        return {
+            "status": 0,
+            "img_url": upload["img_url"],
+            "renditions": upload["renditions"],
+        }
     except Exception as e:
         return {"status": -5, "error_message": e}
 
@@ -199,7 +244,9 @@ async def upload_image(
 @router.post("/setmentorimg/")
 async def set_mentor_img(upload: SetMentorImg):
     if upload.img_url != "Failed":
-        set_mentor_image_doc(upload.mentor_email, upload.img_url)
+        await run_in_threadpool(
+            set_mentor_image_doc, upload.mentor_email, upload.img_url, upload.renditions
+        )
         mentor_id = get_el_id("Mentors", upload.mentor_email)
         coll_id = get_collection_id("Mentors", mentor_id)
         add_redis_collection_id("Mentors", coll_id, mentor_id=mentor_id)
@@ -209,8 +256,51 @@ async def set_mentor_img(upload: SetMentorImg):
         return {"status": -6}
 
 
+# Direct-to-storage upload: returns a signed POST policy the browser uploads the image with.
+@router.post("/mentorimageuploadurl/")
+def mentor_image_upload_url(request: ImageUploadRequest):
+    try:
+        signed = create_mentor_image_upload(request.content_type, request.sha256)
+        if signed["status"] == -2:
+            return {"status": -26.1}
+        if signed["status"] != 0:
+            return {"status": -26, "error_message": signed["error_message"]}
+        return signed
+    except Exception as e:
+        return {"status": -26, "error_message": e}
+
+
+# Called once the browser's direct upload has finished: checks the object and records it.
+@router.post("/finalizementorimage/")
+async def finalize_mentor_img(
+    upload: FinalizeMentorImg, background_tasks: BackgroundTasks
+):
+    try:
+        # Downloads and hashes the upload, so it runs off the event loop.
+        final = await run_in_threadpool(finalize_mentor_image, upload.blob_name)
+        if final["status"] != 0:
+            return {"status": -27.1, "error_message": final["error_message"]}
+        # Until the task builds them, the doc has no renditions (the old image's go).
+        await run_in_threadpool(
+            set_mentor_image_doc,
+            upload.mentor_email,
+            final["img_url"],
+            final["renditions"],
+        )
+        mentor_id = get_el_id("Mentors", upload.mentor_email)
+        coll_id = get_collection_id("Mentors", mentor_id)
+        add_redis_collection_id("Mentors", coll_id, mentor_id=mentor_id)
+        if not final["deduplicated"]:
+            background_tasks.add_task(
+                add_mentor_image_renditions, upload.mentor_email, final["blob_name"]
+            )
+        return {"status": 0, "img_url": final["img_url"]}
+    except Exception as e:
+        return {"status": -27, "error_message": e}
+
+
 @router.post("/sendmentorpitch/")
-async def send_mentor_pitch(mentor_pitch: MentorPitch):
+async def send_mentor_pitch(mentor_pitch: MentorPitch, background_tasks: BackgroundTasks):
     receiver = "crlspathfinders25@gmail.com"
     subject = f"Mentor pitch from {mentor_pitch.mentor_email}"
     body = f"""Mentor pitch received from {mentor_pitch.mentor_email}
@@ -219,31 +309,29 @@ Pitch:
 {mentor_pitch.pitch}
     """
     try:
-        send_mail(receiver, subject, body)
+        enqueue_mail(receiver, subject, body)
+        background_tasks.add_task(drain_outbox)
         return {"status": 0}
     except Exception as e:
         return {"status": -7, "error_message": e}
 
 
 @router.post("/mentormenteelogs/")
-def log_mentor_mentee(log: MentorMenteeLog):
+def log_mentor_mentee(log: MentorMenteeLog, background_tasks: BackgroundTasks):
     print("started mentormentee logs")
     # Send crlspathfinders25 the log, send mentor the confirmation, and send mentee the confirmation.
     try:
 
         catalog_id = str(uuid.uuid4())
 
-        # Send to crlspathfinders25:
-        receiver = "crlspathfinders25@gmail.com"
-        subject = f"Mentor-Mentee Logging Form from {log.mentor_email}"
+        # Send to crlspathfinders25 (batched into the next admin digest):
         body = f"""{log.mentor_email} has submitted a logging form.
 
 Description: {log.log_description}
 
 Hours: {log.log_hours}
 """
-        send_mail(receiver, subject, body)
-        # print("sent cp email")
+        record_admin_event("Mentor-Mentee Logging Form", body)
 
         # Send email to mentor:
         receiver = log.mentor_email
@@ -264,7 +352,7 @@ CRLS PathFinders,
 Rehaan Anjaria '25
 Abel Asefaw '25
 """
-        send_mail(receiver, subject, body)
+        enqueue_mail(receiver, subject, body)
         # print("sent mentor email")
 
         # Update mentor total_hours_worked
@@ -315,14 +403,133 @@ Rehaan Anjaria '25
 Abel Asefaw '25
 """
 
-        send_mail(receiver, subject, body)
+        enqueue_mail(receiver, subject, body)
         # print("sent mentee email")
+        background_tasks.add_task(drain_outbox)
         return {"status": 0}
     except Exception as e:
         # print(f"Failed to send logging email: {e}")
         return {"status": -8, "error_message": e}
 
 
+# One-off: sets total_mentee_hours for mentees whose logs predate the running total.
+@router.get("/hoursledger/mentee/rebuild")
+def rebuild_mentee_totals(username: Annotated[str, Depends(get_current_username)]):
+    return backfill_mentee_totals()
+
+
+# A mentor's logs (HoursLedger entries plus older hours_worked_catalog entries).
+@router.get("/hoursledger/mentor/{mentor_email}")
+def get_mentor_ledger(mentor_email: str):
+    try:
+        return {"status": 0, "logs": mentor_ledger(mentor_email)}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+# A mentee's confirmed logs, in the old mentee_logs format.
+@router.get("/hoursledger/mentee/{mentee_email}")
+def get_mentee_ledger(mentee_email: str):
+    try:
+        return {"status": 0, "logs": mentee_ledger(mentee_email)}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+# Top mentors by confirmed hours: all time, or for one month (YYYY-MM) or semester
+# (YYYY-fall / YYYY-spring).
+@router.get("/hours/leaderboard")
+def hours_leaderboard(
+    limit: int = 10, month: Optional[str] = None, semester: Optional[str] = None
+):
+    if not 1 <= limit <= MAX_LEADERBOARD:
+        return {
+            "status": -1.1,
+            "error_message": f"limit must be between 1 and {MAX_LEADERBOARD}",
+        }
+    try:
+        return {"status": 0, "leaderboard": get_leaderboard(limit, month, semester)}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+@router.get("/hours/totals")
+def hours_totals():
+    try:
+        return {"status": 0, **get_hours_totals()}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+@router.get("/hours/mentor/{mentor_email}")
+def mentor_hours(mentor_email: str):
+    try:
+        return {"status": 0, "hours": get_mentor_hours(mentor_email)}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+@router.get("/hours/rebuild")
+def rebuild_hours(username: Annotated[str, Depends(get_current_username)]):
+    return rebuild_hours_reports()
+
+
+# Faceted search over visible mentors. Repeat a facet to pass several values, e.g.
+# /mentors/search?languages=Spanish&languages=Hindi&academics=Math. match="any" keeps
+# mentors with any of a facet's values, match="all" only those with every one of them.
+@router.get("/mentors/search")
+def mentors_search(
+    races: List[str] = Query(None),
+    religions: List[str] = Query(None),
+    gender: List[str] = Query(None),
+    languages: List[str] = Query(None),
+    academics: List[str] = Query(None),
+    match: str = "any",
+    limit: int = 20,
+    offset: int = 0,
+):
+    try:
+        filters = {
+            "races": races,
+            "religions": religions,
+            "gender": gender,
+            "languages": languages,
+            "academics": academics,
+        }
+        return {"status": 0, **search_mentors(filters, match, limit, offset)}
+    except ValueError as e:
+        return {"status": -1, "error_message": str(e)}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+@router.get("/mentors/search/rebuild")
+def mentors_search_rebuild(username: Annotated[str, Depends(get_current_username)]):
+    return rebuild_mentor_index()
+
+
+# Visible mentors ranked by how well they fit a prospective mentee's preferences.
+@router.post("/mentors/match")
+def mentors_match(request: MentorMatch):
+    try:
+        preferences = {
+            "races": request.races,
+            "religions": request.religions,
+            "gender": request.gender,
+            "languages": request.languages,
+            "academics": request.academics,
+        }
+        mentors = match_mentors(preferences, request.weights, request.limit)
+        return {"status": 0, "mentors": mentors}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+@router.get("/mentors/match/rebuild")
+def mentors_match_rebuild(username: Annotated[str, Depends(get_current_username)]):
+    return rebuild_mentor_matrix()
+
+
 @router.get("/toggleshowmentor/{mentor_email}/")
 def toggle_show_mentor(mentor_email: str):
     return show_or_hide_mentor(mentor_email)
@@ -344,6 +551,7 @@ def test_update_mentee_cat(test: TestUpMenCat):
 @router.post("/menteeconfirmhours/")
 def mentee_confirm_hours(
     mentee_log: MenteeConfirmHours,
+    background_tasks: BackgroundTasks,
 ):
     confirm = mentee_log.confirm
     catalog_id = mentee_log.catalog_id
@@ -356,8 +564,14 @@ def mentee_confirm_hours(
     # If true, first change mentee is_mentor to True, and update their mentee logs with their own description, timestamp, hours worked, and with which mentor they worked.
     # Then, update mentor logs.
     if confirm == 0:  # 0 = yes, -1 = no
+        date_confirmed = datetime.date.today()
         log_status = confirm_mentor_mentee_logging(
-            catalog_id, mentee_email, mentor_email, mentee_hours
+            catalog_id,
+            mentee_email,
+            mentor_email,
+            mentee_hours,
+            mentee_description,
+            str(date_confirmed),
         )
         print(log_status)
         if log_status["status"] == 0:
@@ -369,7 +583,6 @@ def mentee_confirm_hours(
             print("mentor log found")
             mentor_log = log_status["mentor_log"]
             date_met = mentor_log["date"]
-            date_confirmed = datetime.date.today()
             update_mentee_cat = update_mentee_catalog(
                 catalog_id,
                 mentee_email,
@@ -393,9 +606,7 @@ def mentee_confirm_hours(
             # print(f"Failed to confirm mentor mentee logging: {log_status["error_message"]}")
             return {"status": -1}
 
-        # If we get to here, that means all has worked. Now send confirmation email to crlspathfinders25@gmail.com:
-        receiver = "crlspathfinders25@gmail.com"
-        subject = f"{mentee_email} Confirmation Successful"
+        # If we get to here, that means all has worked. Now notify crlspathfinders25@gmail.com (via the admin digest):
         mentor_description = get_mentor_description(mentor_email, catalog_id)
         if mentor_description["status"] == -1:
             return {"status": -9.2}
@@ -406,7 +617,7 @@ def mentee_confirm_hours(
 Mentee Description: {mentee_description}
 Mentor Description: {mentor_description}
 """
-        send_mail(receiver, subject, body)
+        record_admin_event("Mentee Confirmation Successful", body)
 
         # Send confirmation email to mentor:
         n_receiver = mentor_email
@@ -424,7 +635,8 @@ Abel Asefaw '25
         # print(n_receiver)
         # print(n_subject)
         # print(n_body)
-        send_mail(n_receiver, n_subject, n_body)
+        enqueue_mail(n_receiver, n_subject, n_body)
+        background_tasks.add_task(drain_outbox)
 
         mentor_id = get_el_id("Mentors", mentee_log.mentor_email)
         coll_id = get_collection_id("Mentors", mentor_id)
@@ -1,6 +1,6 @@
 import os
 import secrets
-from typing import List, Annotated
+from typing import List, Optional, Annotated
 
 from dotenv import load_dotenv
 from fastapi import (
@@ -22,6 +22,11 @@ from models.opportunitymodel import (
     delete_category,
 )
 from models.redismodel import add_redis_collection_id, delete_redis_id
+from models.deadlinemodel import (
+    upcoming_links,
+    archive_expired_links,
+    rebuild_deadline_index,
+)
 
 load_dotenv()
 
@@ -169,3 +174,35 @@ def edit_category(edit_cat: EditCategory):
         return {"status": -15.1}
     except Exception as e:
         return {"status": -15, "error_message": e}
+
+
+# Links whose deadline has not passed yet, soonest first (optionally one category).
+@router.get("/opportunities/upcoming")
+def opportunities_upcoming(
+    limit: int = 20, offset: int = 0, category: Optional[str] = None
+):
+    try:
+        return {"status": 0, **upcoming_links(limit, offset, category)}
+    except ValueError as e:
+        return {"status": -1, "error_message": str(e)}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+# Moves links whose deadline passed into OpportunitiesArchive. Meant to run periodically
+# (e.g. daily); grace_days keeps recently expired links around a little longer.
+@router.get("/opportunities/archive")
+def opportunities_archive(
+    username: Annotated[str, Depends(get_current_username)], grace_days: int = 0
+):
+    try:
+        return archive_expired_links(grace_days * 24 * 3600)
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+@router.get("/opportunities/deadlines/rebuild")
+def opportunities_deadlines_rebuild(
+    username: Annotated[str, Depends(get_current_username)]
+):
+    return rebuild_deadline_index()
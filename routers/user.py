@@ -10,13 +10,26 @@ from fastapi import (
     status,
     APIRouter,
     Request,
+    BackgroundTasks,
+    Query,
 )
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pydantic import BaseModel
 
-from models.clubmodel import get_members, manage_members, get_secret_pass
-from models.model import get_el_id, get_collection_python, get_collection_id
+from models.model import get_el_id, get_collection_python, get_collection_id, read_doc
 from models.redismodel import add_redis_collection_id, delete_redis_id
+from models.pairingmodel import get_pairings, rebuild_pairings
+from models.cascademodel import create_cascade_job, run_cascade_job
+from models.membershipmodel import (
+    toggle_membership,
+    sync_membership,
+    sync_unsynced,
+    is_member,
+    club_members,
+    user_clubs,
+    shared_members,
+    rebuild_memberships,
+)
 from models.usermodel import (
     make_user,
     change_user,
@@ -31,6 +44,7 @@ from models.usermodel import (
     change_mentor_eligible,
     get_mentees,
 )
+from outbox import drain_outbox
 
 load_dotenv()
 
@@ -84,13 +98,14 @@ def get_current_username(
 
 
 @router.post("/createuser/")
-async def create_user(user: User):
+async def create_user(user: User, background_tasks: BackgroundTasks):
     use = make_user(
         user.email, user.is_leader, user.role, user.leading, user.joined_clubs
     )
     user_id = get_el_id("Users", user.email)
     coll_id = get_collection_id("Users", user_id)
     add_redis_collection_id("Users", coll_id, user_id=user_id)
+    background_tasks.add_task(drain_outbox)
     return use
 
 
@@ -132,7 +147,7 @@ def create_user_route(token: Token):
 
 
 @router.post("/make-user")
-def make_new_user(user: User):
+def make_new_user(user: User, background_tasks: BackgroundTasks):
     try:
         make_user(
             user.email, user.is_leader, user.role, user.leading, user.joined_clubs
@@ -140,6 +155,7 @@ def make_new_user(user: User):
         user_id = get_el_id("Users", user.email)
         coll_id = get_collection_id("Users", user_id)
         add_redis_collection_id("Users", coll_id, user_id=user_id)
+        background_tasks.add_task(drain_outbox)
         return {"status": "Successfully made user"}
     except Exception as e:
         return {"status": f"Failed to make user: {e}"}
@@ -162,51 +178,72 @@ def get_user_doc_data(email: str):
         return {"status": f"Failed to getuserdocfromdata: {e}"}
 
 
-# noinspection DuplicatedCode
 @router.get("/toggleclub/{email}/{club_id}")
-def toggle_club(email: str, club_id: str):
-    user = get_user_from_email(email)
-    # print("---------------------------")
-    # print(user)
-    # print("---------------------------")
-    # print(user[0])
-    # print("---------------------------")
-    # print(json.loads(user[0]))
-    # print("---------------------------")
-    # temp = json.loads(user[0])
-    # print(temp["joined_clubs"])
-    clubs = json.loads(user[0])["joined_clubs"]
-    print(clubs)
-
-    members = get_members(club_id)
-    secret_password = get_secret_pass(club_id)
-
-    if club_id in clubs:
-        try:
-            join_leave_club("leave", email, club_id)
-            members.remove(email)
-            manage_members(secret_password, members)
-            user_id = get_el_id("Users", email)
-            coll_id = get_collection_id("Users", user_id)
-            add_redis_collection_id("Users", coll_id, user_id=user_id)
-            coll_id = get_collection_id("Clubs", club_id)
-            add_redis_collection_id("Clubs", coll_id, club_id=club_id)
-            return {"status": "Successfully left club"}
-        except Exception as e:
-            return {"status": f"Failed to leave club: {e}"}
-    else:
-        try:
-            join_leave_club("join", email, club_id)
-            members.append(email)
-            manage_members(secret_password, members)
-            user_id = get_el_id("Users", email)
-            coll_id = get_collection_id("Users", user_id)
-            add_redis_collection_id("Users", coll_id, user_id=user_id)
-            coll_id = get_collection_id("Clubs", club_id)
-            add_redis_collection_id("Clubs", coll_id, club_id=club_id)
+def toggle_club(email: str, club_id: str, background_tasks: BackgroundTasks):
+    # The Redis membership graph flips both sides at once; Firestore catches up in the
+    # background (see models/membershipmodel.py).
+    try:
+        # Both documents must exist before the graph changes, or Redis would record a
+        # membership Firestore can never hold.
+        user_id = get_el_id("Users", email)
+        if user_id is None:
+            return {"status": "Failed to join / leave club: no such user"}
+        if read_doc("Clubs", club_id) is None:
+            return {"status": "Failed to join / leave club: no such club"}
+        joined = toggle_membership(email, club_id)
+        background_tasks.add_task(sync_membership, email, club_id, user_id)
+        if joined:
             return {"status": "Successfully joined club"}
-        except Exception as e:
-            return {"status": f"Failed to join club: {e}"}
+        return {"status": "Successfully left club"}
+    except Exception as e:
+        return {"status": f"Failed to join / leave club: {e}"}
+
+
+@router.get("/ismember/{email}/{club_id}")
+def check_membership(email: str, club_id: str):
+    try:
+        return {"status": 0, "is_member": is_member(email, club_id)}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+@router.get("/clubmembers/{club_id}")
+def get_club_members(club_id: str):
+    try:
+        return {"status": 0, "members": club_members(club_id)}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+@router.get("/userclubs/{email}")
+def get_user_clubs(email: str):
+    try:
+        return {"status": 0, "clubs": user_clubs(email)}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+# Members in every one of the given clubs: /sharedmembers?club_ids=a&club_ids=b
+@router.get("/sharedmembers")
+def get_shared_members(club_ids: List[str] = Query(...)):
+    try:
+        return {"status": 0, "members": shared_members(club_ids)}
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+# Copies memberships whose background sync failed into Firestore (cron).
+@router.get("/syncmemberships")
+def sync_membership_graph(username: Annotated[str, Depends(get_current_username)]):
+    try:
+        return sync_unsynced()
+    except Exception as e:
+        return {"status": -1, "error_message": e}
+
+
+@router.get("/rebuildmemberships")
+def rebuild_membership_graph(username: Annotated[str, Depends(get_current_username)]):
+    return rebuild_memberships()
 
 
 @router.post("/changerole")
@@ -223,13 +260,17 @@ def change_role(change: ChangeRole):
 
 
 @router.get("/deleteuser/{email}")
-def remove_user(email: str):
+def remove_user(email: str, background_tasks: BackgroundTasks):
     try:
         user_id = get_el_id("Users", email)
         del_id = delete_redis_id("Users", user_id)
         if del_id["status"] == 0:
             print("status 0, deleting user")
             delete_user(email)
+            # Remove the user from the members of their clubs in the background.
+            job = create_cascade_job("user", email)
+            background_tasks.add_task(run_cascade_job, job["id"])
+            return {"status": "Successfully deleted user", "cascade_job_id": job["id"]}
         return {"status": "Successfully deleted user"}
     except Exception as e:
         print(f"Failed to delete user: {e}")
@@ -277,42 +318,10 @@ def toggle_leader_mentor(toggle: ToggleLeaderMentor):
 
 @router.get("/getmentees")
 def read_mentees():
-    pairings = []
-    mentees = get_mentees()
-    mentors = get_collection_python("Mentors")
-
-    for m in mentors:
-        curr_mentor = m
-        curr_mentor_catalog = curr_mentor["hours_worked_catalog"]
-        for c in curr_mentor_catalog:
-            curr_catalog = c
-            if curr_catalog["status"] == 0:
-                catalog_id = c["id"]
-                for ment in mentees:
-                    curr_mentee = ment
-                    mentee_logs = curr_mentee["mentee_logs"]
-                    for l in mentee_logs:
-                        if catalog_id == l["id"]:
-                            entry = {
-                                "mentee": curr_mentee["email"],
-                                "mentor": curr_mentor["email"],
-                                "mentee_description": l["description"],
-                                "mentor_description": curr_catalog["description"],
-                                "hours": curr_catalog["hours"],
-                                "date_confirmed": l["date_confirmed"],
-                                "date_met": l["date_met"],
-                            }
-                            pairings.append(entry)
-            elif curr_catalog["status"] == -1:
-                entry = {
-                    "mentee": curr_catalog["mentee"],
-                    "mentor": curr_mentor["email"],
-                    "mentee_description": "N/A",
-                    "mentor_description": curr_catalog["description"],
-                    "hours": curr_catalog["hours"],
-                    "date_confirmed": "N/A",
-                    "date_met": curr_catalog["date"],
-                }
-                pairings.append(entry)
-
-    return pairings
+    # Served from the materialized pairings (see models/pairingmodel.py).
+    return get_pairings()
+
+
+@router.get("/rebuildpairings")
+def rebuild_mentee_pairings(username: Annotated[str, Depends(get_current_username)]):
+    return rebuild_pairings()
@@ -9,18 +9,38 @@ import os
 load_dotenv()
 
 
-# Normal email sending:
-def send_mail(email_receiver, subject, body):
+def get_sender_credentials():
     email_sender = os.environ.get("EMAIL_SENDER")
     email_password = os.environ.get("EMAIL_PASSWORD")
 
-    bcc_receivers = []
-
     if not email_sender or not email_password:
         raise ValueError(
             "Email sender credentials are not set in the environment variables."
         )
 
+    return email_sender, email_password
+
+
+def open_smtp():
+    # Logged-in SMTP connection; the caller is responsible for closing it (use it with `with`).
+    email_sender, email_password = get_sender_credentials()
+    # Add SSL (layer of security)
+    context = ssl.create_default_context()
+    smtp = smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context)
+    try:
+        smtp.login(email_sender, email_password)
+    except Exception:
+        smtp.close()
+        raise
+    return smtp
+
+
+# Normal email sending:
+def send_mail(email_receiver, subject, body):
+    email_sender, email_password = get_sender_credentials()
+
+    bcc_receivers = []
+
     if isinstance(email_receiver, list):
         if "crlspathfinders25@gmail.com" in email_receiver:
             primary_receiver = "crlspathfinders25@gmail.com"
@@ -37,13 +57,8 @@ def send_mail(email_receiver, subject, body):
     em["Subject"] = subject
     em.set_content(body)
 
-    # Add SSL (layer of security)
-    context = ssl.create_default_context()
-
     # Log in and send the email
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as smtp:
-        smtp.login(email_sender, email_password)
-
+    with open_smtp() as smtp:
         # Send email to primary and BCC recipients
         if len(bcc_receivers) > 0:
             smtp.sendmail(
@@ -53,6 +68,19 @@ def send_mail(email_receiver, subject, body):
             smtp.sendmail(email_sender, primary_receiver, em.as_string())
 
 
+# Send one batch of a bulk mailing over an already open connection. Every recipient is
+# BCC'd: the visible To is the sender, so addresses are not exposed to each other.
+# Returns the recipients the server refused ({address: (code, message)}).
+def send_batch(smtp, bcc_receivers, subject, body):
+    email_sender, _ = get_sender_credentials()
+    em = EmailMessage()
+    em["From"] = email_sender
+    em["To"] = email_sender
+    em["Subject"] = subject
+    em.set_content(body)
+    return smtp.sendmail(email_sender, list(bcc_receivers), em.as_string())
+
+
 # Email sending with embedded HTML:
 def send_alt_mail(email_sender, email_password, email_receiver, subject, text, html):
     port = 587
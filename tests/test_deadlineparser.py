@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import pytest
+
+from models.deadlineparser import SCHOOL_TZ, parse_deadline
+
+NOW = datetime(2024, 12, 10, 12, 0, tzinfo=SCHOOL_TZ)
+
+
+def end_of_day(year, month, day):
+    return datetime(year, month, day, 23, 59, 59, tzinfo=SCHOOL_TZ).timestamp()
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("March 15, 2025", end_of_day(2025, 3, 15)),
+        ("3/15/25", end_of_day(2025, 3, 15)),
+        ("Due 2025-03-15", end_of_day(2025, 3, 15)),
+        ("Deadline: applications due March 15, 2025", end_of_day(2025, 3, 15)),
+        ("December 20", end_of_day(2024, 12, 20)),
+    ],
+)
+def test_parses_dates(text, expected):
+    assert parse_deadline(text, now=NOW) == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Summer 2025",
+        "Every Friday",
+        "2nd round: April 3",
+        "Apply by 5pm",
+        "May",
+        "Rolling",
+        "N/A",
+        "",
+        None,
+        "Interviews for the spring leadership cohort begin March 15",
+    ],
+)
+def test_ambiguous_text_has_no_deadline(text):
+    assert parse_deadline(text, now=NOW) is None
+
+
+def test_missing_year_rolls_forward():
+    # Entered in December, "January 10" is next month, not eleven months ago.
+    assert parse_deadline("January 10", now=NOW) == end_of_day(2025, 1, 10)
+
+
+def test_keeps_time_of_day():
+    expected = datetime(2025, 3, 15, 17, 0, tzinfo=SCHOOL_TZ).timestamp()
+    assert parse_deadline("March 15, 2025 at 5pm", now=NOW) == expected
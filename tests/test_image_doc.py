@@ -0,0 +1,88 @@
+import pytest
+
+try:
+    from firebase_admin import firestore
+
+    from models import clubmodel, mentormodel
+except Exception as e:  # needs firebase_admin and the Firebase credentials in .env
+    pytest.skip(f"Firestore models unavailable: {e}", allow_module_level=True)
+
+OLD_RENDITIONS = {
+    "thumb": "https://storage.googleapis.com/b/club-images/old/thumb.webp",
+    "card": "https://storage.googleapis.com/b/club-images/old/card.webp",
+    "full": "https://storage.googleapis.com/b/club-images/old/full.webp",
+}
+NEW_URL = "https://storage.googleapis.com/b/club-images/new/original.png"
+
+
+class FakeDocument:
+    def __init__(self, docs, key):
+        self.docs = docs
+        self.key = key
+
+    def update(self, data):
+        for field, value in data.items():
+            if value is firestore.DELETE_FIELD:
+                self.docs[self.key].pop(field, None)
+            else:
+                self.docs[self.key][field] = value
+
+
+class FakeDb:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def collection(self, collection):
+        db = self
+
+        class Collection:
+            def document(self, ident):
+                return FakeDocument(db.docs, (collection, ident))
+
+        return Collection()
+
+
+@pytest.fixture
+def docs(monkeypatch):
+    docs = {
+        ("Clubs", "club1"): {
+            "club_img": OLD_RENDITIONS["card"],
+            "club_img_renditions": dict(OLD_RENDITIONS),
+        },
+        ("Mentors", "mentor1"): {
+            "profile_pic": OLD_RENDITIONS["card"],
+            "profile_pic_renditions": dict(OLD_RENDITIONS),
+        },
+    }
+    get_doc = lambda collection, ident: dict(docs[(collection, ident)])
+    for module in (clubmodel, mentormodel):
+        monkeypatch.setattr(module, "db", FakeDb(docs))
+        monkeypatch.setattr(module, "get_doc", get_doc)
+        monkeypatch.setattr(module, "forget", lambda *args: None)
+    monkeypatch.setattr(clubmodel, "index_club", lambda *args: None)
+    monkeypatch.setattr(clubmodel, "delete_club_image", lambda *args: None)
+    monkeypatch.setattr(mentormodel, "get_el_id", lambda *args: "mentor1")
+    monkeypatch.setattr(mentormodel, "index_mentor", lambda *args: None)
+    monkeypatch.setattr(mentormodel, "update_mentor_matrix", lambda *args: None)
+    return docs
+
+
+def test_club_image_without_renditions_drops_old_ones(docs):
+    # What /finalizeclubimage/ does before the renditions are built in the background.
+    clubmodel.set_club_image_doc("club1", NEW_URL, "", None)
+    club = docs[("Clubs", "club1")]
+    assert club["club_img"] == NEW_URL
+    assert "club_img_renditions" not in club
+
+
+def test_mentor_image_without_renditions_drops_old_ones(docs):
+    mentormodel.set_mentor_image_doc("mentor@example.com", NEW_URL, None)
+    mentor = docs[("Mentors", "mentor1")]
+    assert mentor["profile_pic"] == NEW_URL
+    assert "profile_pic_renditions" not in mentor
+
+
+def test_club_image_with_renditions_replaces_them(docs):
+    new = {name: url.replace("/old/", "/new/") for name, url in OLD_RENDITIONS.items()}
+    clubmodel.set_club_image_doc("club1", new["card"], "", new)
+    assert docs[("Clubs", "club1")]["club_img_renditions"] == new
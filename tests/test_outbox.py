@@ -0,0 +1,108 @@
+import os
+
+os.environ["OUTBOX_BACKEND"] = "memory"
+
+import pytest
+
+import outbox
+from outbox import MemoryQueue, drain_outbox, enqueue_mail, retry_delay
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(outbox.time, "time", lambda: now[0])
+    monkeypatch.setattr(outbox, "queue", MemoryQueue())
+    return now
+
+
+def failing_sender(*args):
+    raise Exception("SMTP down")
+
+
+def test_sends_ready_messages(clock):
+    sent = []
+    enqueue_mail("a@example.com", "Hi", "Body")
+    result = drain_outbox(sender=lambda *args: sent.append(args))
+    assert result == {"status": 0, "sent": 1, "retried": 0, "dead": 0}
+    assert sent == [("a@example.com", "Hi", "Body")]
+    assert outbox.queue.stats()["ready"] == 0
+
+
+def test_failed_message_is_retried_after_backoff(clock):
+    enqueue_mail("a@example.com", "Hi", "Body")
+    assert drain_outbox(sender=failing_sender)["retried"] == 1
+    assert outbox.queue.stats()["delayed"] == 1
+
+    # Not due yet: nothing is sent.
+    clock[0] += retry_delay(1) - 1
+    sent = []
+    assert drain_outbox(sender=lambda *args: sent.append(args))["sent"] == 0
+
+    clock[0] += 1
+    assert drain_outbox(sender=lambda *args: sent.append(args))["sent"] == 1
+    assert outbox.queue.stats() == {"ready": 0, "processing": 0, "delayed": 0, "dead": 0}
+
+
+def test_backoff_doubles_up_to_the_cap():
+    assert [retry_delay(a) for a in (1, 2, 3)] == [
+        outbox.BASE_DELAY,
+        outbox.BASE_DELAY * 2,
+        outbox.BASE_DELAY * 4,
+    ]
+    assert retry_delay(50) == outbox.MAX_DELAY
+
+
+def test_message_is_dead_lettered_after_max_attempts(clock):
+    enqueue_mail("a@example.com", "Hi", "Body")
+    for attempt in range(1, outbox.MAX_ATTEMPTS + 1):
+        result = drain_outbox(sender=failing_sender)
+        if attempt < outbox.MAX_ATTEMPTS:
+            assert result["retried"] == 1
+            clock[0] += retry_delay(attempt)
+        else:
+            assert result["dead"] == 1
+    [dead] = outbox.queue.dead()
+    assert dead["attempts"] == outbox.MAX_ATTEMPTS
+    assert dead["last_error"] == "SMTP down"
+    assert outbox.queue.stats()["delayed"] == 0
+
+
+class RecordingClient:
+    # Just enough of the Redis client for RedisQueue.pop / push_delayed / bury.
+    def __init__(self, raw):
+        self.raw = raw
+        self.transactions = []
+
+    def lmove(self, *args):
+        raw, self.raw = self.raw, None
+        return raw
+
+    def multi(self):
+        client = self
+
+        class Transaction:
+            def __init__(self):
+                self.commands = []
+                client.transactions.append(self.commands)
+
+            def __getattr__(self, name):
+                return lambda *args: self.commands.append((name,) + args)
+
+            def exec(self):
+                self.commands.append(("exec",))
+
+        return Transaction()
+
+
+def test_failed_message_leaves_processing_in_the_same_transaction():
+    raw = '{"id": "1", "receiver": "a@example.com", "attempts": 0}'
+    client = RecordingClient(raw)
+    queue = outbox.RedisQueue(client)
+    message = queue.pop()
+    message["attempts"] += 1
+    queue.push_delayed(message, 2000)
+    [commands] = client.transactions
+    assert [c[0] for c in commands] == ["zadd", "lrem", "exec"]
+    assert commands[1] == ("lrem", outbox.OUTBOX_PROCESSING, 1, raw)
+    assert "_raw" not in next(iter(commands[0][2]))